@@ -1,16 +1,106 @@
+from array import array
 import config
 from math import exp
 
+# An animation is a definition that doesn't change once made, so one can be
+# shared by every light showing it.  Where each light is in it is held by a
+# Playhead, which value(play, now) is given.
+#
+# Animations are made with levels in percent, and value() returns the level
+# in 1/LEVEL_STEPS of a percent, the resolution lights are shown at.
+
+LEVEL_STEPS = 10
+
 class Animation:
+    pass
+
+class Playhead:
+
+    # One light's playback of an animation
+
+    def __init__(self):
+        self.animation = None
 
-    def start(self, start, loop = False, callback = None):
+    def start(self, animation, start, loop = False, callback = None):
+        self.animation = animation
         self.start_time = start
         self.loop = loop
         self.callback = callback
+        # Keyframe last shown by a SimpleAnimation
+        self.cursor = 0
 
-    def done(self, light, now):
-        if self.callback is not None:
-            self.callback(light, now)
+    def value(self, now):
+        return self.animation.value(self, now)
+
+# The most animations kept by cached()
+CACHE_SIZE = 16
+
+class AnimationCache:
+
+    # The most recently used animations, by the function that made them and
+    # its arguments, so showing the same animation again doesn't allocate a
+    # new one.
+
+    def __init__(self, size):
+        self.size = size
+        self.animations = {}
+        # Keys, least recently used first
+        self.keys = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, make, args):
+        key = (make, args)
+        animation = self.animations.get(key)
+        if animation is None:
+            self.misses += 1
+            if len(self.keys) >= self.size:
+                del self.animations[self.keys.pop(0)]
+            animation = make(*args)
+            self.animations[key] = animation
+        else:
+            self.hits += 1
+            self.keys.remove(key)
+        self.keys.append(key)
+        return animation
+
+    def clear(self):
+        self.animations.clear()
+        self.keys.clear()
+
+cache = AnimationCache(CACHE_SIZE)
+
+def cached(make, *args):
+    # make(*args), or the animation it made last time.  Arguments are
+    # positional only, and settings such as the fade time must be passed
+    # rather than read from the config, as they are part of the key.
+    return cache.get(make, args)
+
+# Animations work in integers, as the RP2040 does floating point in software.
+# Curves are worked out when an animation is made, so each tick is only
+# integer arithmetic.
+
+def mix(a, b, n, d):
+    # a moved n/d of the way to b, rounded towards a
+    if b >= a:
+        return a + (b - a) * n // d
+    return a - (a - b) * n // d
+
+# Samples across the rise and fall of a breath
+BREATHE_STEPS = 64
+# Scale of the breathe curve
+BREATHE_ONE = 1 << 12
+breathe_curve = None
+
+def get_breathe_curve():
+    # A gaussian from 0 to BREATHE_ONE at BREATHE_STEPS + 1 points, made the
+    # first time something breathes
+    global breathe_curve
+    if breathe_curve is None:
+        gamma = 0.14; # affects the width of peak (more or less darkness)
+        beta = 0.5; # shifts the gaussian to be symmetric
+        breathe_curve = array("H", (int(BREATHE_ONE * exp(-(pow(((i / BREATHE_STEPS) - beta) / gamma, 2.0)) / 2.0) + 0.5) for i in range(BREATHE_STEPS + 1)))
+    return breathe_curve
 
 class BreatheAnimation(Animation):
 
@@ -20,63 +110,102 @@ class BreatheAnimation(Animation):
         self.length = breathe_time + gap
         self.brightness = brightness
         self.off_brightness = off_brightness
-
-    def value(self, now):
-        t = now - self.start_time
-        if self.loop:
+        # Levels along the breath
+        low = brightness * off_brightness * LEVEL_STEPS // 100
+        high = brightness * LEVEL_STEPS
+        self.table = array("h", (low + (high - low) * c // BREATHE_ONE for c in get_breathe_curve()))
+        self.min_brightness = low
+
+    def value(self, play, now):
+        t = now - play.start_time
+        if play.loop:
             t = t % self.length
 
         if t > self.length:
             return None
 
-        gamma = 0.14; # affects the width of peak (more or less darkness)
-        beta = 0.5; # shifts the gaussian to be symmetric
-
-        min_brightness = self.brightness*self.off_brightness/100
-
         if t > self.breathe_time:
-            return min_brightness
-
-        return (exp(-(pow(((t/self.breathe_time)-beta)/gamma,2.0))/2.0))*(self.brightness-min_brightness) + min_brightness
+            return self.min_brightness
+
+        # Interpolate between the samples either side
+        pos = t * BREATHE_STEPS
+        i = pos // self.breathe_time
+        if i >= BREATHE_STEPS:
+            return self.table[BREATHE_STEPS]
+        a = self.table[i]
+        return mix(a, self.table[i + 1], pos - i * self.breathe_time, self.breathe_time)
         
 
 class Fade(Animation):
 
     def __init__(self, from_level, to_level, fade_time = None):
-        self.from_level = from_level
-        self.to_level = to_level
+        self.from_level = int(from_level * LEVEL_STEPS)
+        self.to_level = int(to_level * LEVEL_STEPS)
         if fade_time is None:
             self.fade_time = config.config.fade_time
+        else:
+            self.fade_time = fade_time
 
-    def value(self, now):
-        t = now - self.start_time
+    def value(self, play, now):
+        t = now - play.start_time
         if t > self.fade_time or self.fade_time == 0:
             return None
-        return min(100, max(0, self.from_level + int(t * (self.to_level-self.from_level) / self.fade_time)))
+        return min(100 * LEVEL_STEPS, max(0, mix(self.from_level, self.to_level, t, self.fade_time)))
 
 class SimpleAnimation(Animation):
 
-    def __init__(self, sequence):
-        self.sequence = sequence
-
-    @property
-    def length(self):
-        return self.sequence[-1][1];
-
-    def value(self, now):
-        t = now - self.start_time
-        if self.loop:
+    def __init__(self, sequence, scale = LEVEL_STEPS):
+        # (value, time) keyframes, held as parallel arrays of times and values
+        # scaled to 1/LEVEL_STEPS of a percent.  The default scale is for
+        # values in percent.
+        self.times = array("i", (t for (v, t) in sequence))
+        self.values = array("h", (int(v * scale) for (v, t) in sequence))
+        self.length = self.times[-1]
+
+    def sequence(self):
+        # The (value, time) keyframes, with values in 1/LEVEL_STEPS of a
+        # percent
+        return list(zip(self.values, self.times))
+
+    def find(self, t):
+        # Index of the last keyframe at or before t, or 0 before the first
+        times = self.times
+        lo = 0
+        hi = len(times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[mid] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1 if lo else 0
+
+    def value(self, play, now):
+        t = now - play.start_time
+        if play.loop:
             t = t % self.length
 
         if t > self.length:
             return None
 
-        v = self.sequence[0][0]
-        for i, (value, ta) in enumerate(self.sequence):
-            if (ta <= t and i < len(self.sequence) - 1 and t < self.sequence[i+1][1]):
-                v = value
-        return v
-
+        # Usually the keyframe the playhead last showed or the next one, as
+        # time only moves forward, otherwise the animation looped or was
+        # seeked
+        times = self.times
+        last = len(times) - 1
+        i = play.cursor
+        if times[i] > t:
+            i = self.find(t)
+        elif i < last and times[i + 1] <= t:
+            i += 1
+            if i < last and times[i + 1] <= t:
+                i = self.find(t)
+        play.cursor = i
+
+        # The final keyframe only marks the end
+        if i == last or times[i] > t:
+            return self.values[0]
+        return self.values[i]
 
     def multi_flash(n, start = 150, on = 150, off = 150, invert = False, brightness = 75):
         seq = [(0,0)]
@@ -95,17 +224,17 @@ class SimpleAnimation(Animation):
         if speed is None:
             speed = config.config.fade_speed
         step = (to_level - from_level) / 5
-        return SimpleAnimation(list((int(from_level + step * x), x * speed) for x in range(5)))
+        return SimpleAnimation(list((from_level + step * x, x * speed) for x in range(5)))
 
     def join(*args):
         t = 0
         animation = []
         for anim in args:
-            for (val, tt) in anim.sequence:
+            for (val, tt) in anim.sequence():
                 animation.append((val, tt + t))
             t += anim.length
 
-        return SimpleAnimation(animation)
+        return SimpleAnimation(animation, scale = 1)
 
     def faded_flash(on, off, t, fade_speed = None):
         if fade_speed is None:
@@ -121,58 +250,65 @@ class SimpleAnimation(Animation):
 
 class EmergencyFlash(Animation):
 
-    def __init__(self, brightness1 = 100, brightness2 = 0, period = 400, flash_count = 2, fade = False):
-        self.period = period 
+    def __init__(self, brightness1 = 100, brightness2 = 0, period = 400, flash_count = 2, fade = False, fade_time = None):
+        self.period = period
         self.flash_time = self.period // (flash_count * 4) # 2 sides, on and off
-        self.brightness1 = brightness1
-        self.brightness2 = brightness2
+        self.brightness1 = brightness1 * LEVEL_STEPS
+        self.brightness2 = brightness2 * LEVEL_STEPS
         self.fade = fade
+        # No fade is the same as fading in no time
+        if not fade:
+            self.fade_time = 0
+        elif fade_time is None:
+            self.fade_time = config.config.fade_time
+        else:
+            self.fade_time = fade_time
 
-    def value(self, now):
+    def value(self, play, now):
 
-        t = (now - self.start_time) % self.period
+        t = (now - play.start_time) % self.period
         brightness = self.brightness1 if 2 * t // self.period == 0 else self.brightness2
 
-        fade_time = config.config.fade_time
-        if fade_time > 0 and self.fade:
-            # Time past last transition / fade_time
-            fade = min(t % self.flash_time, fade_time) / fade_time
-        else:
-            fade = 1
+        # Time past last transition
+        fade_time = self.fade_time
+        since = t % self.flash_time
         on = ((t // self.flash_time) % 2) 
+        if since >= fade_time:
+            return brightness if on == 1 else 0
         if on == 1:
-            return fade * brightness
+            return mix(0, brightness, since, fade_time)
         else:
-            return (1-fade) * brightness
+            return mix(brightness, 0, since, fade_time)
 
 class FadedFlash(Animation):
 
     def __init__(self, on = 100, off = 0, period = 1000, fade_time = None):
         self.period = period
-        self.on = on
-        self.off = off
+        self.half_period = period // 2
+        self.on = on * LEVEL_STEPS
+        self.off = off * LEVEL_STEPS
         if fade_time is None:
             self.fade_time = config.config.fade_time
         else:
             self.fade_time = fade_time
 
-    def value(self, now):
+    def value(self, play, now):
 
-        t = (now - self.start_time) 
+        t = (now - play.start_time) 
         
-        if not self.loop and t > self.period:
+        if not play.loop and t > self.period:
             return None
         t = t % self.period
 
-        brightness = self.on if t*2 // self.period == 0 else self.off
-
+        # Time past last transition
         fade_time = self.fade_time
-        if fade_time > 0:
-            fade = min(t % (self.period//2), fade_time) / fade_time
-        else:
-            fade = 1
+        since = t % self.half_period
+        if since > fade_time:
+            since = fade_time
         on = (2 * t // self.period) == 1
+        if fade_time <= 0:
+            return self.off if on else self.on
         if on == 1:
-            return self.on + int(fade * (self.off-self.on))
+            return mix(self.on, self.off, since, fade_time)
         else:
-            return self.off + int(fade * (self.on-self.off))
+            return mix(self.off, self.on, since, fade_time)
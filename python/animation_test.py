@@ -0,0 +1,179 @@
+import sim
+sim.install()
+
+from math import exp
+
+from animation import LEVEL_STEPS, AnimationCache, BreatheAnimation, EmergencyFlash, Fade, FadedFlash, Playhead, SimpleAnimation
+import config
+
+
+def scan(sequence, t):
+    # The keyframe lookup SimpleAnimation used to do every tick
+    v = sequence[0][0]
+    for i, (value, ta) in enumerate(sequence):
+        if (ta <= t and i < len(sequence) - 1 and t < sequence[i+1][1]):
+            v = value
+    return v
+
+def check(sequence, times, loop = False):
+    # sequence values are in 1/LEVEL_STEPS of a percent, as sequence() gives
+    play = Playhead()
+    play.start(SimpleAnimation(sequence, scale = 1), 1000, loop)
+    length = sequence[-1][1]
+    for t in times:
+        expected = None
+        if loop:
+            expected = scan(sequence, t % length)
+        elif t <= length:
+            expected = scan(sequence, t)
+        assert play.value(1000 + t) == expected, (sequence, t)
+
+def test_keyframes():
+    sequences = [
+        ((50, 0),),
+        ((0, 750),),
+        ((100, 0), (0, 50), (0, 100)),
+        # Keyframes at the same time are skipped
+        ((10, 0), (20, 100), (30, 100), (40, 200), (0, 300)),
+        SimpleAnimation.multi_flash(3, 0, 750, 750, brightness = 40).sequence(),
+        SimpleAnimation.faded_flash(100, 0, 400, 20).sequence(),
+    ]
+    for sequence in sequences:
+        length = sequence[-1][1]
+        ticks = list(range(0, length + 20, 4))
+        check(sequence, ticks)
+        # Seeking back and skipping ahead
+        check(sequence, [length // 2, 0, length, length // 3, length + 1])
+        if length:
+            check(sequence, ticks * 3, loop = True)
+            check(sequence, range(0, 4 * length + 1, 7), loop = True)
+
+def test_join():
+    joined = SimpleAnimation.join(
+        SimpleAnimation(((0, 750),)),
+        SimpleAnimation.multi_flash(2, on = 250, off = 250),
+        SimpleAnimation(((0, 750),)))
+    assert joined.length == 750 + 1400 + 750
+    assert joined.sequence()[:3] == [(0, 750), (0, 750), (750, 900)]
+    play = Playhead()
+    play.start(joined, 0)
+    values = [play.value(t) for t in (0, 900, 1000, 1150, 1400, 2600, 2900, 2901)]
+    assert values == [0, 750, 750, 0, 750, 0, 0, None]
+
+# The floating point curves the integer animations replaced
+
+def breathe(breathe_time, brightness, off_brightness, t):
+    min_brightness = brightness*off_brightness/100
+    if t > breathe_time:
+        return min_brightness
+    return (exp(-(pow(((t/breathe_time)-0.5)/0.14,2.0))/2.0))*(brightness-min_brightness) + min_brightness
+
+def emergency(brightness1, brightness2, period, flash_count, fade_time, t):
+    flash_time = period // (flash_count * 4)
+    t = t % period
+    brightness = brightness1 if 2 * t // period == 0 else brightness2
+    fade = min(t % flash_time, fade_time) / fade_time if fade_time > 0 else 1
+    if (t // flash_time) % 2 == 1:
+        return fade * brightness
+    return (1-fade) * brightness
+
+def faded_flash(on, off, period, fade_time, t):
+    t = t % period
+    fade = min(t % (period//2), fade_time) / fade_time if fade_time > 0 else 1
+    if (2 * t // period) == 1:
+        return on + fade * (off-on)
+    return off + fade * (on-off)
+
+# The breathe curve is sampled at BREATHE_STEPS points, and is within 0.4%
+# of the gaussian between them
+TOLERANCE = 4
+
+def check_close(anim, reference, length, loop = True):
+    # The reference is in percent, the animation in 1/LEVEL_STEPS of a percent
+    play = Playhead()
+    play.start(anim, 500, loop)
+    for t in range(0, 2 * length):
+        v = play.value(500 + t)
+        assert type(v) is int
+        assert abs(v - reference(t) * LEVEL_STEPS) <= TOLERANCE, (t, v, reference(t))
+
+def test_integer_animations():
+    for (breathe_time, brightness, off) in ((2000, 100, 0), (1500, 60, 20), (333, 100, 50), (5000, 7, 0)):
+        check_close(BreatheAnimation(breathe_time, 700, brightness, off),
+            lambda t: breathe(breathe_time, brightness, off, t % (breathe_time + 700)), breathe_time + 700)
+
+    fade_time = config.config.fade_time
+    try:
+        for ft in (0, 30, 77):
+            config.config.fade_time = ft
+            for (b1, b2, period, count, fade) in ((100, 0, 400, 2, True), (100, 100, 1000, 3, True), (35, 80, 600, 1, False)):
+                check_close(EmergencyFlash(b1, b2, period, count, fade),
+                    lambda t: emergency(b1, b2, period, count, ft if fade else 0, t), period)
+            for (on, off, period) in ((100, 0, 1000), (20, 90, 1500), (50, 50, 400)):
+                check_close(FadedFlash(on, off, period, ft), lambda t: faded_flash(on, off, period, ft, t), period)
+    finally:
+        config.config.fade_time = fade_time
+
+    # Dim breathing steps by less than a percent
+    play = Playhead()
+    play.start(BreatheAnimation(5000, 700, 7, 0), 0)
+    assert any(play.value(t) % LEVEL_STEPS for t in range(0, 5000, 10))
+
+    play.start(Fade(10, 90, 240), 0)
+    assert [play.value(t) for t in (0, 120, 240, 241)] == [100, 500, 900, None]
+    play.start(Fade(90, 10, 240), 0)
+    assert [play.value(t) for t in (0, 1, 120, 239, 240)] == [900, 897, 500, 104, 100]
+
+def test_shared_playback():
+    # Lights showing one animation each play it from their own start
+    anim = SimpleAnimation(((0, 0), (50, 100), (0, 200), (0, 300)))
+    first = Playhead()
+    second = Playhead()
+    first.start(anim, 0)
+    second.start(anim, 150)
+    assert (first.value(120), second.value(160)) == (500, 0)
+    assert (first.value(220), second.value(260)) == (0, 500)
+
+def test_cache():
+    cache = AnimationCache(2)
+    flash = cache.get(SimpleAnimation.multi_flash, (3, 500))
+    assert cache.get(SimpleAnimation.multi_flash, (3, 500)) is flash
+    assert cache.get(SimpleAnimation.multi_flash, (3, 400)) is not flash
+    assert (cache.hits, cache.misses) == (1, 2)
+    # The least recently used is evicted
+    fade = cache.get(Fade, (0, 50, 100))
+    assert len(cache.animations) == 2
+    assert cache.get(SimpleAnimation.multi_flash, (3, 500)) is not flash
+    assert cache.get(Fade, (0, 50, 100)) is fade
+    assert cache.misses == 4
+
+def test_value_benchmark():
+    import benchmark
+    for n in (4, 16, 64):
+        anim = SimpleAnimation.multi_flash(n // 2 - 1, on = 20, off = 20)
+        play = Playhead()
+        play.start(anim, 0, loop = True)
+        now = [0]
+        def tick():
+            now[0] += 4
+            play.value(now[0])
+        (us, allocated) = benchmark.measure(tick)
+        benchmark.report("SimpleAnimation value, %d keyframes" % len(anim.times), us, allocated, "tick")
+
+        # The scan it replaced, for comparison
+        sequence = anim.sequence()
+        def tick_scan():
+            now[0] += 4
+            scan(sequence, now[0] % anim.length)
+        (us, allocated) = benchmark.measure(tick_scan)
+        benchmark.report("Keyframe scan, %d keyframes" % len(sequence), us, allocated, "tick")
+
+    for (name, anim) in (("BreatheAnimation", BreatheAnimation(2000, 1000, 80, 10)),
+            ("EmergencyFlash", EmergencyFlash(100, 60, 400, 2, True)),
+            ("FadedFlash", FadedFlash(100, 0, 1000, 100))):
+        play.start(anim, 0, loop = True)
+        def tick():
+            now[0] += 4
+            play.value(now[0])
+        (us, allocated) = benchmark.measure(tick)
+        benchmark.report("%s value" % name, us, allocated, "tick")
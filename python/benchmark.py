@@ -0,0 +1,71 @@
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Small timing and allocation helpers shared by the *_test.py benchmarks.
+# These run on both CPython and the MicroPython unix port, e.g.:
+#
+#   micropython -c "import srxl2_test; srxl2_test.test_framer_benchmark()"
+
+
+# Prefer the CPython clock, as the ticks functions may be a sim.clock
+# VirtualClock when benchmarking on the host.
+def ticks_us():
+    if hasattr(time, "perf_counter_ns"):
+        return time.perf_counter_ns() // 1000
+    return time.ticks_us()
+
+def ticks_diff(a, b):
+    if hasattr(time, "perf_counter_ns"):
+        return a - b
+    return time.ticks_diff(a, b)
+
+
+# True when measure() counts every byte allocated, as on MicroPython.  The
+# CPython figure is a per call peak, and its objects are sized differently
+# (a memoryview is 184 bytes), so paths that allocate different kinds of
+# object can only be compared on the device.
+COUNTS_ALL = hasattr(gc, "mem_alloc")
+
+def measure(fn, n = 1000):
+    # Returns (microseconds per call, bytes allocated per call).
+    #
+    # On MicroPython the allocation figure is taken from gc.mem_alloc() with
+    # the collector disabled, so it is the total allocated during the run.  On
+    # CPython memory is freed by reference counting, so the figure is the sum
+    # of the transient peak seen during each call, as reported by tracemalloc.
+    fn()
+    gc.collect()
+
+    start = ticks_us()
+    for i in range(n):
+        fn()
+    elapsed = ticks_diff(ticks_us(), start)
+
+    allocated = 0
+    if hasattr(gc, "mem_alloc"):
+        gc.disable()
+        before = gc.mem_alloc()
+        for i in range(n):
+            fn()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        gc.collect()
+    elif tracemalloc is not None:
+        tracemalloc.start()
+        for i in range(n):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            allocated += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+
+    return (elapsed / n, allocated / n)
+
+
+def report(name, us, allocated, unit = "call"):
+    print("BENCH %-40s %9.2fus/%s %9.1f bytes/%s" % (name, us, unit, allocated, unit))
@@ -0,0 +1,93 @@
+import struct
+import time
+
+# Capture file format for raw input, replayed on the host by sim.replay.
+#
+# Header:   b"RCAP" version:u8 kind:u8
+# Records:  t_us:u32 (microseconds since the start of the capture), followed by
+#             UART: n:u8, then n bytes as returned by one UART read
+#             PWM:  channel:u8, width_us:u16
+#
+# All fields are little endian.
+
+MAGIC = b"RCAP"
+VERSION = 1
+
+KIND_UART = 0
+KIND_PWM = 1
+
+HEADER = "<4sBB"
+UART_RECORD = "<IB"
+PWM_RECORD = "<IBH"
+
+
+class CaptureWriter:
+
+    BUFFER_SIZE = 2048
+
+    def __init__(self, f, kind):
+        self.f = f
+        self.kind = kind
+        self.buf = bytearray(self.BUFFER_SIZE)
+        self.n = 0
+        self.records = 0
+        f.write(struct.pack(HEADER, MAGIC, VERSION, kind))
+        # Time is accumulated from short differences, as ticks_us() wraps
+        self.t = 0
+        self.last = time.ticks_us()
+
+    def now(self):
+        t = time.ticks_us()
+        self.t += time.ticks_diff(t, self.last)
+        self.last = t
+        return self.t & 0xFFFFFFFF
+
+    def reserve(self, size):
+        if self.n + size > len(self.buf):
+            self.flush()
+
+    def uart(self, data):
+        # Record one UART read.  Longer reads are split into several records.
+        t = self.now()
+        for i in range(0, len(data), 255):
+            n = min(len(data) - i, 255)
+            self.reserve(5 + n)
+            struct.pack_into(UART_RECORD, self.buf, self.n, t, n)
+            self.buf[self.n + 5:self.n + 5 + n] = data[i:i + n]
+            self.n += 5 + n
+            self.records += 1
+
+    def pulse(self, channel, width):
+        t = self.now()
+        self.reserve(7)
+        struct.pack_into(PWM_RECORD, self.buf, self.n, t, channel, min(width, 0xFFFF))
+        self.n += 7
+        self.records += 1
+
+    def flush(self):
+        if self.n > 0:
+            self.f.write(memoryview(self.buf)[0:self.n])
+            self.n = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_capture(data):
+    # Returns (kind, records) for the contents of a capture file.  Records are
+    # (t_us, bytes) for UART captures and (t_us, channel, width) for PWM.
+    (magic, version, kind) = struct.unpack_from(HEADER, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a capture file")
+    records = []
+    i = struct.calcsize(HEADER)
+    while i < len(data):
+        if kind == KIND_UART:
+            (t, n) = struct.unpack_from(UART_RECORD, data, i)
+            records.append((t, bytes(data[i + 5:i + 5 + n])))
+            i += 5 + n
+        else:
+            records.append(struct.unpack_from(PWM_RECORD, data, i))
+            i += 7
+    return (kind, records)
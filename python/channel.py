@@ -43,3 +43,42 @@ class SteeringChannel(Channel):
     def threshold(self):
         return config.steering_threshold
     
+
+# config.channel_map() compiled into a flat table for dispatching control
+# packets.  Each entry is (channel, low, high, sign, zero, target), where low
+# and high are the zero point less and plus the target's threshold.
+class ChannelDispatch:
+
+    def __init__(self):
+        self.entries = ()
+        # Input channels used, in order
+        self.channels = ()
+        self.revision = None
+
+    def invalidate(self):
+        self.revision = None
+
+    def compile(self, channel_map, zeros, default_zero, revision = None):
+        entries = []
+        channels = []
+        for (ch, reverse), target in channel_map.items():
+            zero = zeros.get(ch, default_zero)
+            threshold = target.threshold
+            entries.append((ch, zero - threshold, zero + threshold, -1 if reverse else 1, zero, target))
+            if ch not in channels:
+                channels.append(ch)
+        self.entries = tuple(entries)
+        self.channels = tuple(channels)
+        self.revision = revision
+
+    def dispatch(self, channel_data):
+        for (ch, low, high, sign, zero, target) in self.entries:
+            v = channel_data.get(ch)
+            if v is not None:
+                if v > high:
+                    state = sign
+                elif v < low:
+                    state = -sign
+                else:
+                    state = ChannelState.NEUTRAL
+                target.update(state, v - zero)
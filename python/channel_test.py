@@ -0,0 +1,103 @@
+import sim
+sim.install()
+
+from channel import Channel, ChannelState, ChannelDispatch, SteeringChannel
+from channelframe import ChannelFrame
+from config import config, RCMode
+
+
+def frame(values):
+    f = ChannelFrame()
+    for (ch, v) in values.items():
+        f.values[ch] = v
+    channels = tuple(sorted(values))
+    mask = 0
+    for ch in channels:
+        mask |= 1 << (ch - 1)
+    f.set_channels(mask, channels)
+    return f
+
+def test_dispatch():
+    throttle = Channel()
+    button = Channel()
+    reversed_button = Channel()
+    d = ChannelDispatch()
+    d.compile({(1, False): throttle, (8, False): button, (8, True): reversed_button}, {1: 1520}, 1500)
+    assert d.channels == (1, 8)
+
+    d.dispatch(frame({1: 1600, 8: 1400}))
+    assert throttle.state == ChannelState.FORWARD
+    assert throttle.position == 80
+    assert button.state == ChannelState.REVERSE
+    assert reversed_button.state == ChannelState.FORWARD
+
+    # Within the threshold of the zero point
+    d.dispatch(frame({1: 1460, 8: 1550}))
+    assert throttle.state == ChannelState.NEUTRAL
+    assert throttle.position == -60
+    assert button.state == ChannelState.NEUTRAL
+
+    # Missing channels are left alone
+    d.dispatch(frame({8: 1200}))
+    assert throttle.position == -60
+    assert button.state == ChannelState.REVERSE
+
+def test_dispatch_rebuilt_on_change():
+    import importlib
+    import sys
+    from sim.clock import VirtualClock
+
+    threshold = config.steering_threshold
+    with VirtualClock() as clock:
+        try:
+            if "controller" in sys.modules:
+                controller = importlib.reload(sys.modules["controller"])
+            else:
+                controller = importlib.import_module("controller")
+            controller.mode = RCMode.SMART
+            steering = controller.vehicle.steering
+            d = controller.channel_dispatch()
+            entries = d.entries
+            assert controller.channel_dispatch().entries is entries
+
+            assert config.set_value("steering_threshold", "300")
+            d = controller.channel_dispatch()
+            assert d.entries is not entries
+            entry = [e for e in d.entries if e[5] is steering][0]
+            assert entry[2] - entry[1] == 600
+        finally:
+            config.set_value("steering_threshold", str(threshold))
+
+def test_dispatch_benchmark():
+    import benchmark
+    from vehicle import Vehicle
+    from sim.clock import VirtualClock
+
+    with VirtualClock() as clock:
+        vehicle = Vehicle(config)
+        zeros = {1: 0x8000, 4: 0x8000, 8: 0x8000}
+        f = frame({1: 0x9000, 4: 0x7000, 8: 0x8000, 6: 0x8000})
+
+        def per_packet():
+            # As handle_control_packet did before the dispatch table
+            cm = config.channel_map(RCMode.SMART, vehicle)
+            for (ch, reverse), target in cm.items():
+                v = f.get(ch)
+                if v is not None:
+                    zero = zeros.get(ch, 0x8000)
+                    if v > zero + target.threshold:
+                        state = ChannelState.FORWARD
+                    elif v < zero - target.threshold:
+                        state = ChannelState.REVERSE
+                    else:
+                        state = ChannelState.NEUTRAL
+                    if reverse:
+                        state *= -1
+                    target.update(state, v - zero)
+
+        d = ChannelDispatch()
+        d.compile(config.channel_map(RCMode.SMART, vehicle), zeros, 0x8000)
+        (us, allocated) = benchmark.measure(per_packet, 5000)
+        benchmark.report("Channel map per packet", us, allocated, "packet")
+        (us, allocated) = benchmark.measure(lambda: d.dispatch(f), 5000)
+        benchmark.report("Channel dispatch table", us, allocated, "packet")
@@ -0,0 +1,68 @@
+from array import array
+
+MAX_CHANNELS = 32
+
+# Channel values for one frame of input, indexed by channel number (1-32).
+#
+# Values are held in a fixed array that is overwritten by each new frame, and
+# the set of channels present is recorded as a bit mask.  The parts of the
+# dict interface used by the controller are provided, so a frame can be used
+# wherever a {channel: value} dict was used before.
+class ChannelFrame:
+
+    def __init__(self):
+        self.values = array('H', (0 for n in range(MAX_CHANNELS + 1)))
+        self.mask = 0
+        self.channels = ()
+
+    def set_channels(self, mask, channels):
+        # channels is the tuple of channel numbers in mask, in order
+        self.mask = mask
+        self.channels = channels
+
+    def copy(self, other):
+        # Copy the channels present in another frame
+        values = self.values
+        other_values = other.values
+        for ch in other.channels:
+            values[ch] = other_values[ch]
+        self.set_channels(other.mask, other.channels)
+
+    def __contains__(self, channel):
+        return 0 < channel <= MAX_CHANNELS and (self.mask >> (channel - 1)) & 1 == 1
+
+    def __getitem__(self, channel):
+        if channel not in self:
+            raise KeyError(channel)
+        return self.values[channel]
+
+    def get(self, channel, default = None):
+        if channel not in self:
+            return default
+        return self.values[channel]
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def keys(self):
+        return self.channels
+
+    def items(self):
+        return ((ch, self.values[ch]) for ch in self.channels)
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, ChannelFrame):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.as_dict())
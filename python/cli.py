@@ -3,17 +3,32 @@ import sys
 from config import config
 import json
 import time
+from capture import CaptureWriter
 
 class CLI:
     
     def __init__(self, vehicle):
         self.vehicle = vehicle
+        # Input driver, set once the signal type is known
+        self.driver = None
+        # Main loop scheduler, for TASKS
+        self.scheduler = None
+        # [(phase, ms)] from controller, for BOOT
+        self.boot_times = None
+        # Light renderer, for FRAMES
+        self.renderer = None
         self.buf = ""
         self.spoll = uselect.poll()
         self.spoll.register(sys.stdin, uselect.POLLIN)
 
+    def input_ready(self):
+        # ipoll() doesn't allocate a list of results, unlike poll()
+        for ready in self.spoll.ipoll(0):
+            return True
+        return False
+
     def process(self):
-        while self.spoll.poll(0):
+        while self.input_ready():
             c = sys.stdin.read(1)
             self.buf += c
             if c == "\n":
@@ -37,6 +52,72 @@ class CLI:
             print("DUMPCONFIG " + json.dumps(config.config_data()))
         elif cmd == 'MENUSPEC':
             print("MENUSPEC " + json.dumps(self.vehicle.menu.spec()))
+        elif cmd == 'LINKSTATS':
+            if self.driver is None or not hasattr(self.driver, 'stats'):
+                print("ERR")
+            elif params == 'RESET':
+                self.driver.reset_stats()
+                print("LINKSTATS")
+            else:
+                print("LINKSTATS " + json.dumps(self.driver.stats()))
+        elif cmd == 'TASKS':
+            if self.scheduler is None:
+                print("ERR")
+            elif params == 'RESET':
+                self.scheduler.reset_stats()
+                print("TASKS")
+            else:
+                print("TASKS " + json.dumps(self.scheduler.stats()))
+        elif cmd == 'FRAMES':
+            if self.renderer is None:
+                print("ERR")
+            elif params == 'RESET':
+                self.renderer.reset_stats()
+                if self.scheduler is not None:
+                    self.scheduler.reset_alloc()
+                print("FRAMES")
+            elif params == 'CHECK':
+                # Fails if any frame, or run of a task with an allocation
+                # budget such as input, since the last reset went over budget
+                tasks_ok = self.scheduler is None or self.scheduler.within_budget() is not False
+                if self.renderer.within_budget() and tasks_ok:
+                    print("FRAMES OK")
+                else:
+                    print("ERR")
+            else:
+                print("FRAMES " + json.dumps(self.renderer.stats()))
+        elif cmd == 'BOOT':
+            if self.boot_times is None:
+                print("ERR")
+            else:
+                print("BOOT " + json.dumps(self.boot_times))
+        elif cmd == 'PROFILE':
+            if self.scheduler is None or self.scheduler.profile() is None:
+                print("ERR")
+            elif params == 'RESET':
+                self.scheduler.reset_stats()
+                print("PROFILE")
+            else:
+                print("PROFILE " + json.dumps(self.scheduler.profile()))
+        elif cmd == 'CAPTURE' and params is not None:
+            # CAPTURE <filename> starts recording raw input, CAPTURE STOP ends it
+            if self.driver is None:
+                print("ERR")
+            elif params == 'STOP':
+                if self.driver.capture is not None:
+                    self.driver.capture.close()
+                    print("CAPTURE %d" % self.driver.capture.records)
+                    self.driver.capture = None
+                else:
+                    print("ERR")
+            else:
+                if self.driver.capture is not None:
+                    self.driver.capture.close()
+                try:
+                    self.driver.capture = CaptureWriter(open(params, "wb"), self.driver.CAPTURE_KIND)
+                    print("CAPTURE")
+                except OSError:
+                    print("ERR")
         elif cmd == 'IDENT' and params is not None:
             try:
                 i = int(params)
@@ -233,6 +233,20 @@ class EXTTemperatureAlarm:
     max_value = 120
     units = "C"
 
+class FrameRateConfig:
+    title = "Frame rate"
+    name = "frame_rate"
+
+    description = """
+        Light frames rendered per second.
+    """
+    min_value = 50
+    max_value = 1000
+
+def clamp(config_class, value):
+    # value limited to the config class's min_value to max_value
+    return min(config_class.max_value, max(config_class.min_value, value))
+
 
 class LightState:
 
@@ -311,9 +325,15 @@ class LightConfig:
             "turn_right",
             "emergency1",
             "emergency2",
+            "gamma",
+            "duty_min",
+            "duty_max",
             )
 
-    def __init__(self, pin, mode1, mode2, brake = 0, flash = 0, breathe = 0, turn_left = 0, turn_right = 0, emergency1 = 0, emergency2 = 0, menu = 50):
+    # gamma is in tenths, so 10 is linear and 22 suits most LEDs.  Levels
+    # above off are scaled into the duty_min to duty_max percentage range,
+    # e.g. to trim an output that doesn't light below a certain duty.
+    def __init__(self, pin, mode1, mode2, brake = 0, flash = 0, breathe = 0, turn_left = 0, turn_right = 0, emergency1 = 0, emergency2 = 0, menu = 50, gamma = 10, duty_min = 0, duty_max = 100):
         self.pin = pin
         self.mode1 = mode1
         self.mode2 = mode2
@@ -325,6 +345,10 @@ class LightConfig:
         self.emergency1 = emergency1
         self.emergency2 = emergency2
         self.menu = menu
+        # Out of range values from the file are brought into range
+        self.gamma = gamma if gamma > 0 else 10
+        self.duty_max = min(100, max(0, duty_max))
+        self.duty_min = min(self.duty_max, max(0, duty_min))
 
     def as_dict(self):
         d = {
@@ -334,13 +358,26 @@ class LightConfig:
             d[p] = getattr(self, p)
         return d
 
+    def valid(self, prop, value):
+        # gamma must be positive, and the trims percentages with duty_min no
+        # more than duty_max
+        if prop == "gamma":
+            return value > 0
+        if prop == "duty_min":
+            return 0 <= value <= self.duty_max
+        if prop == "duty_max":
+            return self.duty_min <= value <= 100
+        return True
+
     def set_value(self, prop, value):
         if prop in self.properties:
             try:
-                setattr(self, prop, int(value))
+                v = int(value)
             except ValueError:
                 return False
-
+            if not self.valid(prop, v):
+                return False
+            setattr(self, prop, v)
             return True
         return False
 
@@ -361,17 +398,43 @@ class PWMMode:
     title = "PWM Channel mode"
     description = "Configure which RC channels are connected to the controller's inputs."
 
+class PWMFilterMode:
+    MEDIAN = 0
+    EMA = 1
+
+    labels = {
+        MEDIAN: "Median",
+        EMA: "Moving average",
+    }
+
+    title = "PWM input filter"
+    description = """
+    <p>Filter applied to PWM input pulses to remove jitter.</p>
+    <ul>
+      <li><b>Median</b> - median of the last few pulses.  Rejects single glitches.</li>
+      <li><b>Moving average</b> - exponential moving average.  Smooths noisy inputs.</li>
+    </ul>
+    """
+
 class Config:
 
     properties = ("primary_button_channel", "primary_button_reverse", 
                 "fade_time", "secondary_button_mode", "emergency_mode", "pwm_mode", "breathe_time", "breathe_gap", "sleep_delay",
                 "sleep_when_lights_on", "breathe_min_brightness", "steering_threshold", "pwm_brake_mode", 
                 "emergency_flashes_per_side", "emergency_flash_period", "emergency_fade", 
-                "esc_temperature_alarm", "esc_temperature_alarm_enable", "ext_temperature_alarm", "ext_temperature_alarm_enable")
+                "esc_temperature_alarm", "esc_temperature_alarm_enable", "ext_temperature_alarm", "ext_temperature_alarm_enable",
+                "pwm_filter_depth", "pwm_filter_mode", "threaded_input", "frame_rate")
+
+    # Settings rejected by set_value() outside their config class's range
+    limits = {
+        FrameRateConfig.name: FrameRateConfig,
+    }
 
     def __init__(self, data):
         self.version = VERSION
         self.board = BOARD
+        # Incremented by changed()
+        self.revision = 0
 
         self.lights = []
         lights = data.get("lights")
@@ -387,6 +450,9 @@ class Config:
                 x.get("turn_right",0),
                 x.get("emergency1",0),
                 x.get("emergency2",0),
+                gamma = x.get("gamma", 10),
+                duty_min = x.get("duty_min", 0),
+                duty_max = x.get("duty_max", 100),
             ) for x in lights ]
         else:
             for pin in Pins.OUTPUTS:
@@ -441,6 +507,12 @@ class Config:
         self.esc_temperature_alarm_enable = data.get("esc_temperature_alarm_enable", 0)
         self.ext_temperature_alarm = data.get("ext_temperature_alarm", 75)
         self.ext_temperature_alarm_enable = data.get("ext_temperature_alarm_enable", 0)
+        self.pwm_filter_depth = data.get("pwm_filter_depth", 3)
+        self.pwm_filter_mode = data.get("pwm_filter_mode", PWMFilterMode.MEDIAN)
+        # Decode input on the second core
+        self.threaded_input = int(data.get("threaded_input", 0))
+        # Light frames rendered per second
+        self.frame_rate = clamp(FrameRateConfig, int(data.get("frame_rate", 250)))
         self.hardware_button_pin = Pins.BUTTON
         self.input_pins = Pins.INPUTS
         self.status_led_pins = Pins.STATUS_LEDS
@@ -471,6 +543,11 @@ class Config:
             json.dump(self.config_data(), fout)
         print("LOG config saved")
 
+    def changed(self):
+        # Call after changing settings, so anything derived from them, such
+        # as the controller's channel dispatch table, is rebuilt.
+        self.revision += 1
+
     def set_value(self, path, value):
         parts = path.split('/')
         prop = parts[0]
@@ -480,8 +557,13 @@ class Config:
                 if type(getattr(self, path)) == bool:
                     setattr(self, path, bool(int(value)))
                 else:
-                    setattr(self, path, int(value))
+                    v = int(value)
+                    limit = self.limits.get(path)
+                    if limit is not None and clamp(limit, v) != v:
+                        return False
+                    setattr(self, path, v)
                 print("LOG setting %s to %s" % (path, value))
+                self.changed()
                 return True
             except ValueError:
                 return False
@@ -491,7 +573,9 @@ class Config:
                 n = int(n)
             except ValueError:
                 return False
-            return self.lights[n].set_value(prop, value)
+            if self.lights[n].set_value(prop, value):
+                self.changed()
+                return True
 
         return False
 
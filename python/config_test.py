@@ -7,3 +7,15 @@ def test_config():
     assert c.lights[0].pin == 12
 
     c.save()
+
+def test_frame_rate_limits():
+    # Out of range frame rates from the file are clamped, and from SET are
+    # rejected, as the renderer can't run at them
+    assert config.Config({"frame_rate": 0}).frame_rate == config.FrameRateConfig.min_value
+    assert config.Config({"frame_rate": 100000}).frame_rate == config.FrameRateConfig.max_value
+    c = config.Config({})
+    for value in ("0", "-250", "100000"):
+        assert not c.set_value("frame_rate", value)
+    assert c.frame_rate == 250
+    assert c.set_value("frame_rate", "500")
+    assert c.frame_rate == 500
@@ -1,23 +1,40 @@
 import time
-time.sleep(1)
+
+# Time since power-on at the end of each boot phase, shown by the BOOT command
+boot_times = [("start", time.ticks_ms())]
+
+def boot_phase(name):
+    boot_times.append((name, time.ticks_ms()))
+
+# A short pause, so mpremote can still interrupt main.py before it starts
+BOOT_DELAY_MS = 100
+time.sleep_ms(BOOT_DELAY_MS)
+boot_phase("delay")
 
 try:
     from machine import Pin
 except:
     from machine_mock import Pin
+from config import config, LightConfig, RCMode
+boot_phase("config")
 import struct
 import light
 from button import Button
-from channel import ChannelState, Channel
+from channel import ChannelState, Channel, ChannelDispatch
 import vehicle as veh
-from config import config, LightConfig, RCMode
-from pwm import detect_signal_type, PWMRCDriver
+from pwm import SignalDetector, PWMRCDriver
 from srxl2driver import SRXL2Driver
-from animation import Animation, BreatheAnimation, SimpleAnimation
+from threadeddriver import ThreadedDriver
+from animation import Animation, BreatheAnimation, SimpleAnimation, cached
 import cli
 import therm
+from scheduler import Scheduler
+from renderer import Renderer
+boot_phase("imports")
 
 vehicle = veh.Vehicle(config)
+renderer = Renderer(vehicle.all_lights, vehicle.update, config.frame_rate)
+boot_phase("vehicle")
 
 status_led = vehicle.status_led
 
@@ -43,7 +60,13 @@ mode = None
 
 channel_zeros = {}
 
+# Compiled channel map, rebuilt when the config, mode or calibration changes
+dispatch = ChannelDispatch()
+
 packet_count = 0
+# Status LED flashes, by 2 * init + smart, made the first time each is shown
+# so the flash every 100 packets doesn't allocate
+status_flashes = [None] * 4
 
 input_pin = Pin(config.input_pins[0], Pin.IN)
 
@@ -60,45 +83,44 @@ def handle_hardware_button():
         pressed = hardware_button_pin.value() > 0
         hardware_button.update(pressed)
 
+def channel_dispatch():
+    if dispatch.revision != config.revision:
+        dispatch.compile(config.channel_map(mode, vehicle), channel_zeros,
+                1500 if mode == RCMode.PWM else 0x8000, config.revision)
+    return dispatch
+
+def render():
+    # SET frame_rate takes effect without a reboot
+    if renderer.revision != config.revision:
+        renderer.set_frame_rate(config.frame_rate, config.revision)
+    return renderer.render()
+
 def handle_control_packet(channel_data):
     global init
     global good_packets
-    cm = config.channel_map(mode, vehicle)
+    d = channel_dispatch()
     if not init:
         ok = False
-        for ch, rev in cm.keys():
+        for ch in d.channels:
             v = channel_data.get(ch)
             if v is not None:
                 channel_zeros[ch] = v
                 ok = True
         # For SMART, we only calibrate after we see channel 10 disappear.
-        if ok and ((10 not in channel_data and channel_data != {}) or mode == RCMode.PWM):
+        if ok and ((10 not in channel_data and len(channel_data) > 0) or mode == RCMode.PWM):
             good_packets += 1
             if good_packets > 30:
                 init = True
+                dispatch.invalidate()
                 for l in vehicle.lights:
-                    l.animate(SimpleAnimation.multi_flash(3), menu = True)
+                    l.animate(cached(SimpleAnimation.multi_flash, 3), menu = True)
                 vehicle.startup_complete()
     else:
-        for (ch, reverse), target in cm.items():
-            v = channel_data.get(ch)
-            if v is not None:
-                zero = channel_zeros.get(ch, 1500 if mode == RCMode.PWM else 0x8000)
-                #if ch == 1:
-                #    print("%d vs %d + %d" % (v, zero, target.threshold))
-                if v > zero + target.threshold:
-                    state = ChannelState.FORWARD
-                elif v < zero - target.threshold:
-                    state = ChannelState.REVERSE
-                else:
-                    state = ChannelState.NEUTRAL
-                if reverse:
-                    state *= -1
-                target.update(state, v - zero)
+        d.dispatch(channel_data)
         if mode == RCMode.SMART:
             v = channel_data.get(config.level_channel)
             if v is not None:
-                level = int(100 * (v - config.level_channel_min) / (config.level_channel_max - config.level_channel_min))
+                level = 100 * (v - config.level_channel_min) // (config.level_channel_max - config.level_channel_min)
                 level = max(level, 0)
                 level = min(level, 100)
                 vehicle.level_setting(level)
@@ -107,43 +129,139 @@ def handle_control_packet(channel_data):
     if packet_count >= 100:
         if not hardware_button.pressed and not vehicle.in_menu and not vehicle.in_telemetry:
             vehicle.status_led.set_level(100 if mode == RCMode.SMART else 0)
-            vehicle.status_led.animate(SimpleAnimation.multi_flash(1 if init else 2, 75, 75, 50, invert = mode == RCMode.SMART))
+            vehicle.status_led.animate(status_flash())
         packet_count = 0
 
 
+def status_flash():
+    smart = mode == RCMode.SMART
+    i = 2 * init + smart
+    flash = status_flashes[i]
+    if flash is None:
+        flash = SimpleAnimation.multi_flash(1 if init else 2, 75, 75, 50, smart)
+        status_flashes[i] = flash
+    return flash
+
 def sample_temperature():
-    temp = therm.get_value()
-    vehicle.ext_temperature = temp
+    therm.update()
+    vehicle.ext_temperature = therm.value
+
+driver = None
+detector = SignalDetector(config.input_pins)
+console = None
+# Set while a button press that aborted detection is still held, so the
+# release isn't seen as a click.
+hardware_button_held = False
 
-print("LOG Controller starting");
+def start_driver(new_mode):
+    global mode, driver, init, good_packets
+    if driver is not None:
+        driver.stop()
+    if new_mode != mode:
+        # A different receiver needs calibrating again
+        init = False
+        good_packets = 0
+        channel_zeros.clear()
+    mode = new_mode
+    dispatch.invalidate()
+    vehicle.mode = mode
+    if mode == RCMode.SMART:
+        driver = SRXL2Driver(config.input_pins[0], handle_control_packet, handle_telemetry_packet)
+    else:
+        driver = PWMRCDriver(config.input_pins, handle_control_packet, config.pwm_filter_depth, config.pwm_filter_mode)
+    if config.threaded_input:
+        driver = ThreadedDriver(driver, handle_control_packet, handle_telemetry_packet)
+    if console is not None:
+        console.driver = driver
+    driver.start()
 
-cli = cli.CLI(vehicle)
+def update_signal():
+    # Steps signal detection, starting it again in the background if the
+    # current driver loses its signal.  The receiver can then be replugged,
+    # or swapped for one of the other type, without a power cycle.
+    global hardware_button_held
+    if detector.active:
+        new_mode = detector.step()
+        if new_mode is not None:
+            if new_mode != mode or driver is None:
+                start_driver(new_mode)
+        elif driver is None and hardware_button_pin is not None and hardware_button_pin.value() == 1:
+            # Button pressed before any signal was found: assume PWM
+            print("LOG Signal detection aborted")
+            detector.stop()
+            hardware_button_held = True
+            start_driver(RCMode.PWM)
+            vehicle.startup_complete()
+    elif driver is not None and not driver.has_signal() and not hardware_button_held:
+        print("LOG Input signal lost")
+        detector.start(vehicle.status_led)
 
-mode = detect_signal_type(vehicle, config.input_pins, hardware_button_pin, cli)
-if mode == None:
-    mode = RCMode.PWM
-    vehicle.startup_complete()
-if mode == RCMode.SMART:
-    driver = SRXL2Driver(config.input_pins[0], handle_control_packet, handle_telemetry_packet)
-else:
-    driver = PWMRCDriver(config.input_pins, handle_control_packet)
-vehicle.mode = mode
+def process_input():
+    if driver is not None:
+        driver.process()
+    update_signal()
+
+def input_ready():
+    return detector.active or (driver is not None and driver.pending())
+
+def process_button():
+    global hardware_button_held
+    if hardware_button_held:
+        hardware_button_held = hardware_button_pin.value() == 1
+    elif driver is not None:
+        handle_hardware_button()
+
+# Task periods.  Input is also processed as soon as any arrives, and the
+# period only matters for timeouts.
+INPUT_PERIOD_US = 5000
+BUTTON_PERIOD_US = 10000
+CLI_PERIOD_US = 20000
+THERM_PERIOD_US = therm.SAMPLE_PERIOD_MS * 1000
+
+# Most bytes one run of the input task should allocate, checked by FRAMES
+# CHECK on the device.  Control and telemetry packets are decoded into
+# reused objects, leaving a view of the SRXL2 buffer for each read and
+# packet.
+INPUT_ALLOC_BUDGET = 128
+
+def make_scheduler():
+    scheduler = Scheduler()
+    scheduler.add("input", process_input, INPUT_PERIOD_US, input_ready, INPUT_ALLOC_BUDGET)
+    renderer.task = scheduler.add("lights", render, renderer.period_us)
+    scheduler.add("button", process_button, BUTTON_PERIOD_US)
+    scheduler.add("cli", console.process, CLI_PERIOD_US)
+    scheduler.add("therm", sample_temperature, THERM_PERIOD_US)
+    return scheduler
+
+def setup():
+    # Starts signal detection, and returns the scheduler for the main loop
+    global console
+
+    print("LOG Controller starting");
+
+    console = cli.CLI(vehicle)
+    console.boot_times = boot_times
+    console.renderer = renderer
+
+    # Lights come on at their last state before the receiver is found
+    renderer.render()
+    boot_phase("lights")
+
+    detector.start(vehicle.status_led)
+    #for l in vehicle.lights:
+    #    l.animate(BreatheAnimation(2000,3000), loop = True)
 
-last_brake = False
-driver.start()
-now = time.ticks_ms()
-#for l in vehicle.lights:
-#    l.animate(BreatheAnimation(2000,3000), loop = True)
+    therm.init()
 
-therm.init()
+    scheduler = make_scheduler()
+    console.scheduler = scheduler
+    boot_phase("ready")
+    print("LOG Boot " + " ".join("%s %dms" % t for t in boot_times))
+    return scheduler
 
-while True:
-    driver.process()
-    vehicle.update()
-    handle_hardware_button()
-    sample_temperature()
-    cli.process()
-    time.sleep_us(10)
-    #handle_control_packet({})
+def main():
+    setup().run()
 
 
+if __name__ == "__main__":
+    main()
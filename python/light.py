@@ -4,8 +4,32 @@ except ImportError:
     from machine_mock import Pin, PWM
 
 import time
+from array import array
 import config
-from animation import Fade
+from animation import LEVEL_STEPS, Fade, Playhead, cached
+
+# Levels are percentages, shown to 1/LEVEL_STEPS of a percent
+FULL_LEVEL = 100 * LEVEL_STEPS
+
+# PWM duty for each level, shared by outputs with the same gamma and trim.
+# Cleared when the config changes, so only the tables it uses are kept.
+luts = {}
+luts_revision = None
+
+def duty_lut(gamma, duty_min, duty_max):
+    # gamma is in tenths, and duty_min and duty_max are percentages of full
+    # duty that the lowest and highest levels above off are mapped to.
+    key = (gamma, duty_min, duty_max)
+    lut = luts.get(key)
+    if lut is None:
+        lut = array('H', (0 for i in range(FULL_LEVEL + 1)))
+        low = 0xFFFF * duty_min // 100
+        high = 0xFFFF * duty_max // 100
+        g = gamma / 10
+        for i in range(1, FULL_LEVEL + 1):
+            lut[i] = low + int((high - low) * (i / FULL_LEVEL) ** g)
+        luts[key] = lut
+    return lut
 
 class LightState:
     OFF = 0
@@ -31,9 +55,26 @@ class Light:
                 pwm.duty_u16(0)
                 pwm.freq(1000)
         self.level = 0
+        # Playheads of the running animations by priority, and their
+        # priorities in ascending order, so the highest is always last
         self.animations = dict()
+        self.priorities = []
+        # Playheads no longer in use, reused by push_animation()
+        self.spare_playheads = []
+        self._min_animation_priority = None
+        # The playhead shown and its animation, cached by select_animation()
+        # whenever the above change
+        self.playhead = None
+        self.animation = None
+        self.animation_priority = None
         self.cur_level = None
-        self.min_animation_priority = None
+        # Lookup table index of the level in the frame being rendered, and of
+        # the level last written to the outputs by commit()
+        self.cur_index = 0
+        self.out_index = 0
+        # Duty lookup table, and the config revision it was chosen for
+        self.lut = None
+        self.lut_revision = None
 
 
     def menu_scale(self, level, menu):
@@ -41,20 +82,50 @@ class Light:
             return level * self.config.menu/100
         return level
 
+    def select_lut(self):
+        global luts_revision
+        if luts_revision != config.config.revision:
+            luts.clear()
+            luts_revision = config.config.revision
+        c = self.config
+        self.lut = duty_lut(c.gamma, c.duty_min, c.duty_max)
+        self.lut_revision = config.config.revision
+        # Write the outputs again with the new table
+        self.out_index = None
+
     def show_level(self, level):
-        if self.cur_level is None or level != self.cur_level:
-            if self.pwms:
-                for pwm in self.pwms:
-                    pwm.duty_u16(int(0xFFFF * level / 100))
-            else:
-                for output in self.outputs:
-                    output.value(1 if level > 50 else 0)
-            self.cur_level = level
+        # Sets the level for the current frame, in 1/LEVEL_STEPS of a percent
+        # as animations return it, written out by commit()
+        i = int(level)
+        if i > FULL_LEVEL:
+            i = FULL_LEVEL
+        elif i < 0:
+            i = 0
+        self.cur_index = i
+        self.cur_level = level
+
+    def commit(self):
+        # Writes the outputs if the level has changed since the last commit.
+        # Returns True if they were written.
+        if self.lut_revision != config.config.revision:
+            self.select_lut()
+        i = self.cur_index
+        if i == self.out_index:
+            return False
+        if self.pwms:
+            duty = self.lut[i]
+            for pwm in self.pwms:
+                pwm.duty_u16(duty)
+        else:
+            for output in self.outputs:
+                output.value(1 if i > FULL_LEVEL // 2 else 0)
+        self.out_index = i
+        return True
 
     def set_level(self, level, menu = False):
         level = self.menu_scale(level, menu)
         if self.animation is None:
-            self.show_level(level)
+            self.show_level(level * LEVEL_STEPS)
         self.level = level
 
     def update(self, now, light_state, brake, flash, emergency):
@@ -72,50 +143,91 @@ class Light:
             else:
                 new_level = 0
             if new_level != self.level:
-                self.animate(Fade(self.level, new_level))
+                self.animate(cached(Fade, self.level, new_level, config.config.fade_time))
             self.set_level(new_level)
 
     def animate(self, animation, callback = None, loop = False, now = None, menu = False, priority = 0):
         if animation is not None:
 
             start = now if now is not None else time.ticks_ms()
-            self.animations[priority] = animation
-            animation.start(start, loop, callback)
+            play = self.push_animation(priority, animation, start, loop, callback)
 
             self.menu_animation = menu
-            v = animation.value(start)
+            v = play.value(start)
             if v is not None:
                 scaled = self.menu_scale(v, menu)
                 self.show_level(scaled)
         else:
-            self.animations.pop(priority, None)
+            self.pop_animation(priority)
             if self.animation is None:
-                self.show_level(self.level)
+                self.show_level(self.level * LEVEL_STEPS)
             else:
                 self.tick(now)
 
+    def push_animation(self, priority, animation, start, loop = False, callback = None):
+        # Starts animation at priority, replacing any there.  Returns its
+        # playhead.
+        play = self.animations.get(priority)
+        if play is None:
+            ps = self.priorities
+            i = len(ps)
+            while i > 0 and ps[i - 1] > priority:
+                i -= 1
+            ps.insert(i, priority)
+            play = self.spare_playheads.pop() if self.spare_playheads else Playhead()
+            self.animations[priority] = play
+        play.start(animation, start, loop, callback)
+        self.select_animation()
+        return play
+
+    def pop_animation(self, priority):
+        if priority in self.animations:
+            play = self.animations.pop(priority)
+            play.animation = None
+            self.spare_playheads.append(play)
+            if self.priorities[-1] == priority:
+                self.priorities.pop()
+            else:
+                self.priorities.remove(priority)
+            self.select_animation()
+
+    def select_animation(self):
+        # The highest priority animation is shown, unless it is below
+        # min_animation_priority
+        if self.priorities:
+            p = self.priorities[-1]
+            if self._min_animation_priority is None or p >= self._min_animation_priority:
+                self.playhead = self.animations[p]
+                self.animation = self.playhead.animation
+                self.animation_priority = p
+                return
+        self.playhead = None
+        self.animation = None
+        self.animation_priority = None
+
     @property
-    def animation(self):
-        if len(self.animations) == 0:
-            return None
-        p = max(self.animations.keys())
-        if self.min_animation_priority is None or p >= self.min_animation_priority:
-            return self.animations[p]
-        return None
+    def min_animation_priority(self):
+        return self._min_animation_priority
 
+    @min_animation_priority.setter
+    def min_animation_priority(self, priority):
+        self._min_animation_priority = priority
+        self.select_animation()
 
     def tick(self, now = None):
         if now is None:
             now = time.ticks_ms()
-        animation = self.animation
-        if animation is not None:
-            value = self.animation.value(now)
+        play = self.playhead
+        if play is not None:
+            value = play.value(now)
             if value is None:
-                # Animation is complete
-                self.animations.pop(max(self.animations.keys()))
-                animation.done(self, now)
+                # Animation is complete.  The callback may start another.
+                callback = play.callback
+                self.pop_animation(self.animation_priority)
+                if callback is not None:
+                    callback(self, now)
             else:
                 self.show_level(self.menu_scale(value, self.menu_animation))
         else:
-            self.show_level(self.level)
+            self.show_level(self.level * LEVEL_STEPS)
 
@@ -0,0 +1,183 @@
+import sim
+sim.install()
+
+from animation import LEVEL_STEPS, Animation
+from config import LightConfig
+import config
+from light import FULL_LEVEL, Light, LightState, duty_lut, luts
+from sim.clock import VirtualClock
+
+
+class Constant(Animation):
+
+    # level percent until length ms have passed
+
+    def __init__(self, level, length):
+        self.level = level * LEVEL_STEPS
+        self.length = length
+
+    def value(self, play, now):
+        if not play.loop and now - play.start_time >= self.length:
+            return None
+        return self.level
+
+def make_light():
+    return Light(LightConfig(10, 20, 80))
+
+def test_animation_priority():
+    light = make_light()
+    light.set_level(20)
+    low = Constant(30, 100)
+    high = Constant(60, 50)
+    light.animate(low, now = 0, priority = 1)
+    light.animate(high, now = 0, priority = 2)
+    light.animate(Constant(10, 1000), now = 0, priority = -1)
+    assert light.priorities == [-1, 1, 2]
+    assert light.animation is high
+    light.tick(10)
+    assert light.cur_level == 60 * LEVEL_STEPS
+
+    # The highest ends, and the next takes over
+    light.tick(50)
+    assert light.animation is low
+    light.tick(60)
+    assert light.cur_level == 30 * LEVEL_STEPS
+
+    # Only animations at or above the minimum priority are shown
+    light.min_animation_priority = 2
+    assert light.animation is None
+    light.tick(70)
+    assert light.cur_level == 20 * LEVEL_STEPS
+    light.min_animation_priority = None
+    assert light.animation is low
+
+    light.animate(None, priority = 1, now = 80)
+    assert light.priorities == [-1]
+    assert light.cur_level == 10 * LEVEL_STEPS
+    light.tick(1000)
+    assert light.animation is None
+    assert light.priorities == []
+    light.tick(1010)
+    assert light.cur_level == 20 * LEVEL_STEPS
+
+def test_replace_animation():
+    light = make_light()
+    first = Constant(30, 100)
+    second = Constant(40, 100)
+    light.animate(first, now = 0)
+    light.animate(second, now = 0)
+    assert light.priorities == [0]
+    assert light.animation is second
+
+def test_tick_benchmark():
+    import benchmark
+    lights = [make_light() for i in range(6)]
+    for l in lights:
+        l.animate(Constant(50, 0), loop = True, now = 0)
+        l.animate(Constant(70, 0), loop = True, now = 0, priority = 1)
+    def tick():
+        for l in lights:
+            l.tick(10)
+    (us, allocated) = benchmark.measure(tick)
+    benchmark.report("Light tick, 6 lights", us, allocated, "frame")
+    assert lights[0].cur_level == 70 * LEVEL_STEPS
+
+def test_update_state():
+    with VirtualClock() as clock:
+        light = make_light()
+        light.update(0, LightState.HIGH, False, False, False)
+        assert light.level == 80
+        # Fading up from off
+        assert light.animation is not None
+        clock.advance(1000000)
+        light.update(clock.ticks_ms(), LightState.HIGH, False, False, False)
+        light.update(clock.ticks_ms(), LightState.HIGH, False, False, False)
+        assert light.animation is None
+        assert light.cur_level == 80 * LEVEL_STEPS
+
+def test_commit_changes_only():
+    light = make_light()
+    light.show_level(400)
+    assert light.commit()
+    assert not light.commit()
+    light.show_level(400)
+    assert not light.commit()
+    light.show_level(401)
+    assert light.commit()
+
+def test_duty_lut():
+    linear = duty_lut(10, 0, 100)
+    assert len(linear) == FULL_LEVEL + 1
+    assert (linear[0], linear[500], linear[FULL_LEVEL]) == (0, 0x7FFF, 0xFFFF)
+    assert duty_lut(10, 0, 100) is linear
+
+    gamma = duty_lut(22, 0, 100)
+    assert gamma[FULL_LEVEL] == 0xFFFF
+    assert gamma[200] < linear[200] // 5
+    assert all(gamma[i] <= gamma[i + 1] for i in range(FULL_LEVEL))
+
+    trimmed = duty_lut(10, 10, 50)
+    assert trimmed[0] == 0
+    assert trimmed[1] >= 0xFFFF // 10
+    assert trimmed[FULL_LEVEL] == 0xFFFF // 2
+
+def test_fine_levels():
+    light = make_light()
+    duties = []
+    for level in (100, 100.5, 101, 102.5):
+        light.show_level(level)
+        light.commit()
+        duties.append(light.pwms[0].duty_u16())
+    # Tenths of a percent are distinct, and finer changes aren't written
+    assert duties[0] == duties[1] < duties[2] < duties[3]
+
+def test_gamma_config_change():
+    light = make_light()
+    light.show_level(500)
+    assert light.commit()
+    assert light.pwms[0].duty_u16() == 0x7FFF
+    config.config.lights.append(light.config)
+    try:
+        assert config.config.set_value("lights/%d/gamma" % (len(config.config.lights) - 1), "20")
+        assert light.commit()
+        assert light.pwms[0].duty_u16() == 0xFFFF // 4
+        # Tables the config no longer uses are dropped
+        assert config.config.set_value("lights/%d/gamma" % (len(config.config.lights) - 1), "30")
+        light.commit()
+        assert list(luts) == [(30, light.config.duty_min, light.config.duty_max)]
+    finally:
+        config.config.lights.pop()
+
+def test_shared_animation():
+    # One animation shown by two lights, started at different times
+    anim = Constant(50, 100)
+    first = make_light()
+    second = make_light()
+    first.animate(anim, now = 0)
+    second.animate(anim, now = 80)
+    first.tick(100)
+    second.tick(100)
+    assert first.animation is None
+    assert second.cur_level == 50 * LEVEL_STEPS
+    # Playheads are reused once animations finish
+    spare = first.spare_playheads[0]
+    first.animate(anim, now = 200)
+    assert first.playhead is spare
+
+def test_light_limits():
+    # Out of range settings would overflow the duty table
+    c = LightConfig(10, 20, 80, gamma = -5, duty_min = -10, duty_max = 150)
+    assert (c.gamma, c.duty_min, c.duty_max) == (10, 0, 100)
+    assert LightConfig(10, 20, 80, duty_min = 60, duty_max = 40).duty_min == 40
+    for (prop, value) in (("gamma", "0"), ("gamma", "-5"), ("duty_max", "150"), ("duty_min", "-1")):
+        assert not c.set_value(prop, value)
+    assert c.set_value("duty_max", "50")
+    assert not c.set_value("duty_min", "60")
+    assert (c.gamma, c.duty_min, c.duty_max) == (10, 0, 50)
+
+    # Negative levels are off rather than wrapping round the table
+    light = make_light()
+    light.show_level(-50)
+    light.commit()
+    assert light.cur_index == 0
+    assert light.pwms[0].duty_u16() == 0
@@ -1,8 +1,17 @@
 class Pin:
-    def __init__(self, pin, *args):
-        pass
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, pin, *args, **kwargs):
+        self.pin = pin
+        self._value = 0
 
-    OUT = None 
+    def value(self, v = None):
+        if v is None:
+            return self._value
+        self._value = v
 
 class PWM:
     def __init__(self, pin):
@@ -14,6 +23,31 @@ class PWM:
     def duty_u16(self, u16):
         pass
 
+class ADC:
+    # Reading returned by read_u16() for each pin.  With nothing set, the
+    # input reads as pulled up.
+    values = {}
+
+    def __init__(self, pin):
+        self.pin = getattr(pin, "pin", pin)
+
+    def read_u16(self):
+        return ADC.values.get(self.pin, 0xFFFF)
+
 class UART:
-    pass
+    INV_RX = 2
 
+    def __init__(self, id, *args, **kwargs):
+        pass
+
+    def any(self):
+        return 0
+
+    def readinto(self, buf, nbytes = None):
+        return None
+
+    def write(self, buf):
+        return len(buf)
+
+    def deinit(self):
+        pass
@@ -2,7 +2,7 @@ from button import ButtonEvent
 import light
 from config import config, PWMMode, BrakeMode, ButtonMode, ButtonModeReverse, EmergencyMode, LightStates, SleepWhenLightsOnMode, FadeTimeConfig, SleepDelayConfig, BreatheTimeConfig, BreatheGapConfig, SteeringThresholdConfig, BreatheMinimumBrightnessConfig, EmergencyFlashPeriodConfig, EmergencyFlashCountConfig, EmergencyFadeMode, ESCTemperatureAlarm, ESCTemperatureAlarmEnable, EXTTemperatureAlarm, EXTTemperatureAlarmEnable
 import time
-from animation import SimpleAnimation, BreatheAnimation, FadedFlash, EmergencyFlash
+from animation import SimpleAnimation, BreatheAnimation, FadedFlash, EmergencyFlash, cached
 
 class MenuItem:
 
@@ -139,6 +139,7 @@ class GenericLevelAdjusterMenuItem(LevelAdjusterMenuItem):
 
     def save(self, level):
         setattr(self.config, self.config_class.name, level)
+        self.config.changed()
 
 class AdjustLightLevelMenuItem(LevelAdjusterMenuItem):
 
@@ -177,7 +178,7 @@ class AdjustFadeSpeedMenuItem(LevelAdjusterMenuItem):
         self.cur_fade_time = int(level*1.6)
 
     def animate(self, l, now = None):
-        animation = FadedFlash(100, 0, 1500, self.cur_fade_time)
+        animation = cached(FadedFlash, 100, 0, 1500, self.cur_fade_time)
         l.animate(animation, callback = self.animate, now = now, menu = True)
 
     def save(self, level):
@@ -200,7 +201,7 @@ class AdjustEmergencyFlashPeriodMenuItem(LevelAdjusterMenuItem):
         self.animate_all()
 
     def animate(self, l, now = None):
-        l.animate(EmergencyFlash(100, 100, self.cur_flash_period, config.emergency_flashes_per_side, bool(config.emergency_fade)))
+        l.animate(cached(EmergencyFlash, 100, 100, self.cur_flash_period, config.emergency_flashes_per_side, bool(config.emergency_fade), config.fade_time))
 
     def save(self, level):
         config.emergency_flash_period = self.cur_flash_period
@@ -219,7 +220,7 @@ class AdjustBreatheTimeMenuItem(LevelAdjusterMenuItem):
         self.animate_all()
 
     def animate(self, l, now = None):
-        l.animate(BreatheAnimation(self.cur_breathetime, config.breathe_gap, off_brightness = config.breathe_min_brightness), callback = self.animate, now = now, menu = True)
+        l.animate(cached(BreatheAnimation, self.cur_breathetime, config.breathe_gap, 100, config.breathe_min_brightness), callback = self.animate, now = now, menu = True)
 
     def save(self, level):
         config.breathe_time = self.cur_breathetime
@@ -243,7 +244,7 @@ class AdjustBreatheGapMenuItem(LevelAdjusterMenuItem):
         self.animate_all()
 
     def animate(self, l, now = None):
-        l.animate(BreatheAnimation(config.breathe_time, self.cur_breathegap), callback = self.animate, now = now, menu = True)
+        l.animate(cached(BreatheAnimation, config.breathe_time, self.cur_breathegap), callback = self.animate, now = now, menu = True)
 
     def save(self, level):
         config.breathe_gap = self.cur_breathegap
@@ -280,6 +281,7 @@ class MultiSelectMenuItem(MenuItem):
             self.update()
         if event == ButtonEvent.LONG_CLICK:
             setattr(self.obj, self.prop, self.values[self.cur_value])
+            config.changed()
             return False
         return True
 
@@ -340,6 +342,7 @@ class SteeringThresholdMenuItem(MenuItem):
                 ths = abs(pos)
                 if ths > 20:
                     config.steering_threshold = ths
+                    config.changed()
                     print("LOG Updating steering threshold to %d" % ths)
             return False
         return True
@@ -438,7 +441,7 @@ class Menu:
         self.menu_pos = 0
         self.menu_depth = 0 
         for l in self.vehicle.all_lights:
-            l.animate(SimpleAnimation.multi_flash(1), menu = True)
+            l.animate(cached(SimpleAnimation.multi_flash, 1), menu = True)
         self.menu_stack = [(self.menu, 0)]
         self.clear_all()
         self.last_wrap = time.ticks_ms()
@@ -448,7 +451,7 @@ class Menu:
 
     def flash_all(self, n):
         for l in self.vehicle.all_lights:
-            l.animate(SimpleAnimation.multi_flash(n), menu = True)
+            l.animate(cached(SimpleAnimation.multi_flash, n), menu = True)
 
     def clear_all(self):
         for l in self.vehicle.all_lights:
@@ -4,8 +4,11 @@ except:
     from machine_mock import Pin, UART
 import rp2
 import time
-from config import RCMode
-from animation import SimpleAnimation
+from config import RCMode, PWMFilterMode
+from animation import SimpleAnimation, cached
+from capture import KIND_PWM
+from channelframe import ChannelFrame
+from array import array
 
 #https://github.com/GitJer/PwmIn/blob/main/PwmIn.pio
 
@@ -57,71 +60,156 @@ def time_pulse():
     wrap()
 
 
-def detect_signal_type(vehicle, pins, hardware_button_pin, cli):
-    print("LOG Detecting input signal")
+# Works out whether the receiver is sending PWM or SRXL2 by timing the gaps
+# between pulses on each input.  Detection is incremental: call step() from the
+# main loop until it returns the detected RCMode.
+class SignalDetector:
 
-    gaps = []
+    # Consecutive gaps of the same kind needed on one input
+    GAPS_REQUIRED = 50
 
-    sms = []
-    last_gap_pwm = []
-    for i, pin in enumerate(pins):
-        p = Pin(pin, Pin.IN)
-        sm = rp2.StateMachine(i, time_gap, freq=1_000_000, jmp_pin=p, in_base=p)
-        sm.active(1)
-        sms.append(sm)
-        gaps.append([])
-        last_gap_pwm.append(None)
+    # SRXL should never be longer than 9/115200 = 78us
+    # PWM should not be shorter than 1/333 - 2ms = 1ms
+    PWM_GAP_US = 500
 
-    vehicle.status_led.animate(SimpleAnimation.flash(), loop = True)
-    hardware_button_clicked = False
-            
-    while all(len(g) < 50 for g in gaps):
-        for i, sm in enumerate(sms):
+    # Detection runs on the second PIO block, so it can watch the inputs
+    # while PWMRCDriver is using the first.
+    SM_BASE = 4
+
+    def __init__(self, pins):
+        self.pins = pins
+        self.sms = None
+        self.active = False
+        self.mode = None
+        # Time taken by the last completed detection
+        self.duration_ms = None
+        self.detections = 0
+
+    def start(self, status_led = None):
+        print("LOG Detecting input signal")
+        if self.sms is None:
+            self.sms = []
+            for i, pin in enumerate(self.pins):
+                p = Pin(pin, Pin.IN)
+                self.sms.append(rp2.StateMachine(self.SM_BASE + i, time_gap, freq=1_000_000, jmp_pin=p, in_base=p))
+        n = len(self.pins)
+        self.gaps = [0] * n
+        self.last_gap_pwm = [None] * n
+        for sm in self.sms:
+            # Discard anything left over from a previous detection
+            while sm.rx_fifo() > 0:
+                sm.get()
+            sm.active(1)
+        self.status_led = status_led
+        if status_led is not None:
+            status_led.animate(cached(SimpleAnimation.flash), loop = True)
+        self.mode = None
+        self.started = time.ticks_ms()
+        self.active = True
+
+    def stop(self):
+        if not self.active:
+            return
+        for sm in self.sms:
+            sm.active(0)
+        if self.status_led is not None:
+            self.status_led.animate(None)
+        self.active = False
+
+    def elapsed_ms(self):
+        return time.ticks_diff(time.ticks_ms(), self.started)
+
+    def step(self):
+        # Returns the detected RCMode once detection is complete, else None
+        if not self.active:
+            return None
+        gaps = self.gaps
+        last_gap_pwm = self.last_gap_pwm
+        for i in range(len(self.sms)):
+            sm = self.sms[i]
             while sm.rx_fifo() > 0:
                 gap = (0xFFFFFFFF - sm.get()) * 2
-                # SRXL should never be longer than 9/115200 = 78us
-                # PWM should not be shorter than 1/333 - 2ms = 1ms
-                is_pwm = gap > 500
+                is_pwm = gap > self.PWM_GAP_US
                 if is_pwm == last_gap_pwm[i]:
-                    gaps[i].append(gap)
+                    gaps[i] += 1
                 else:
-                    gaps[i] = []
+                    gaps[i] = 0
                 last_gap_pwm[i] = is_pwm
+                if gaps[i] >= self.GAPS_REQUIRED:
+                    return self.detected(i, RCMode.PWM if is_pwm else RCMode.SMART)
+        return None
 
-        time.sleep_us(10)
-        cli.process()
-        vehicle.update()
-        if hardware_button_pin is not None and hardware_button_pin.value() == 1:
-            hardware_button_clicked = True
-            break
+    def detected(self, channel, mode):
+        self.duration_ms = self.elapsed_ms()
+        self.detections += 1
+        self.mode = mode
+        self.stop()
+        print("LOG Detected %s signal on channel %d in %dms" % ("PWM" if mode == RCMode.PWM else "SRXL2", channel, self.duration_ms))
+        return mode
 
-    vehicle.status_led.animate(None)
+# Filter over the last few pulse widths from one input.  A depth of 1 passes
+# pulses through unchanged; larger depths reduce noise but add latency.
+class PulseFilter:
 
-    # Wait for button to be released, if pressed.
-    if hardware_button_clicked:
-        while hardware_button_pin.value() == 1:
-            time.sleep_us(10)
+    def __init__(self, depth = 3, mode = PWMFilterMode.MEDIAN):
+        self.depth = max(1, depth)
+        self.mode = mode
+        self.ring = array('H', (0 for i in range(self.depth)))
+        self.sorted = array('H', (0 for i in range(self.depth)))
+        self.reset()
 
-    if hardware_button_clicked:
-        return None
+    def reset(self):
+        self.n = 0
+        self.i = 0
+        self.value = None
 
-    for i, g in enumerate(gaps):
-        if len(g) >= 50:
-            pwm = last_gap_pwm[i]
-            print("LOG Detected %s signal on channel %d" % ("PWM" if pwm else "SMART", i))
-            break
+    def add(self, v):
+        if self.mode == PWMFilterMode.EMA:
+            if self.value is None:
+                self.value = v
+            else:
+                self.value += (2 * (v - self.value)) // (self.depth + 1)
+            return self.value
+
+        ring = self.ring
+        ring[self.i] = v
+        self.i = (self.i + 1) % self.depth
+        if self.n < self.depth:
+            self.n += 1
+
+        # Insertion sort into a preallocated array
+        s = self.sorted
+        n = self.n
+        for j in range(n):
+            x = ring[j]
+            k = j
+            while k > 0 and s[k - 1] > x:
+                s[k] = s[k - 1]
+                k -= 1
+            s[k] = x
+        self.value = s[n // 2]
+        return self.value
 
-    if pwm:
-        print("LOG Detected PWM signal")
-        return RCMode.PWM
-    else:
-        print("LOG Detected SRXL2 signal")
-        return RCMode.SMART
 
 class PWMRCDriver:
-    def __init__(self, pins, control_callback):
+
+    CAPTURE_KIND = KIND_PWM
+
+    # An input that sends no pulses for this long is reported as the
+    # failsafe value until pulses return.
+    TIMEOUT_MS = 100
+    FAILSAFE_US = 1500
+
+    MIN_PULSE_US = 700
+    MAX_PULSE_US = 2300
+
+    def __init__(self, pins, control_callback, filter_depth = 3, filter_mode = PWMFilterMode.MEDIAN):
         self.pins = pins
         self.control_callback = control_callback
+        self.filter_depth = filter_depth
+        self.filter_mode = filter_mode
+        # CaptureWriter to record raw input to
+        self.capture = None
 
     def start(self):
         self.sms = []
@@ -131,13 +219,87 @@ class PWMRCDriver:
             sm.active(1)
             self.sms.append(sm)
 
+        n = len(self.pins)
+        self.filters = [PulseFilter(self.filter_depth, self.filter_mode) for i in range(n)]
+        self.last_seen = [None] * n
+        self.failsafe = [False] * n
+        self.frame = ChannelFrame()
+        # Channel numbers for each possible mask
+        self.mask_channels = [tuple(i + 1 for i in range(n) if m & 1 << i) for m in range(1 << n)]
+        self.pulses = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.started = time.ticks_ms()
+
+    def stop(self):
+        for sm in self.sms:
+            sm.active(0)
+
+    def pending(self):
+        # True if there is input waiting to be processed
+        for sm in self.sms:
+            if sm.rx_fifo() > 0:
+                return True
+        return False
+
+    def has_signal(self):
+        # False once every input has timed out, or if none is seen soon after
+        # starting
+        seen = False
+        for i in range(len(self.sms)):
+            if self.last_seen[i] is not None:
+                seen = True
+                if not self.failsafe[i]:
+                    return True
+        return not seen and time.ticks_diff(time.ticks_ms(), self.started) <= self.TIMEOUT_MS
+
     def process(self):
-        data = {}
-        for i, sm in enumerate(self.sms):
+        now = time.ticks_ms()
+        values = self.frame.values
+        mask = 0
+        updated = False
+        for i in range(len(self.sms)):
+            sm = self.sms[i]
             while sm.rx_fifo() > 0:
                 v = (0xFFFFFFFF - sm.get()) * 3
-                if v > 700 and v < 2300:
-                    data[i+1]  = v
-    
-        if len(data) > 0:
-            self.control_callback(data)
+                if self.capture is not None:
+                    self.capture.pulse(i+1, v)
+                if v > self.MIN_PULSE_US and v < self.MAX_PULSE_US:
+                    values[i+1] = self.filters[i].add(v)
+                    self.last_seen[i] = now
+                    self.failsafe[i] = False
+                    self.pulses += 1
+                    mask |= 1 << i
+                    updated = True
+                else:
+                    self.rejected += 1
+
+            last_seen = self.last_seen[i]
+            if last_seen is not None and not mask & 1 << i:
+                if not self.failsafe[i] and time.ticks_diff(now, last_seen) > self.TIMEOUT_MS:
+                    print("LOG Lost PWM signal on input %d" % (i+1))
+                    self.failsafe[i] = True
+                    self.filters[i].reset()
+                    self.timeouts += 1
+                    updated = True
+                if self.failsafe[i]:
+                    values[i+1] = self.FAILSAFE_US
+                    mask |= 1 << i
+
+        if updated:
+            self.frame.set_channels(mask, self.mask_channels[mask])
+            self.control_callback(self.frame)
+
+    def stats(self):
+        return {
+            "pulses": self.pulses,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failsafe": list(i + 1 for i in range(len(self.failsafe)) if self.failsafe[i]),
+            "values": list(self.filters[i].value for i in range(len(self.filters))),
+        }
+
+    def reset_stats(self):
+        self.pulses = 0
+        self.rejected = 0
+        self.timeouts = 0
@@ -0,0 +1,256 @@
+import sim
+sim.install()
+
+from sim import rp2
+from sim.clock import VirtualClock
+from config import PWMFilterMode, RCMode
+from pwm import PulseFilter, PWMRCDriver, SignalDetector
+
+
+def test_median_filter():
+    f = PulseFilter(3)
+    assert [f.add(v) for v in (1500, 1510, 2100, 1505, 1490, 1495)] == [1500, 1510, 1510, 1510, 1505, 1495]
+
+    f = PulseFilter(1)
+    assert [f.add(v) for v in (1500, 2100, 1000)] == [1500, 2100, 1000]
+
+def test_ema_filter():
+    f = PulseFilter(3, PWMFilterMode.EMA)
+    assert [f.add(v) for v in (1500, 1600, 1600, 1600)] == [1500, 1550, 1575, 1587]
+
+def pulse(sm, width):
+    sm.push_rx(0xFFFFFFFF - width // 3)
+
+def make_driver(clock, frames, **kwargs):
+    driver = PWMRCDriver((1, 2), lambda frame: frames.append(frame.as_dict()), **kwargs)
+    driver.start()
+    return driver
+
+def test_driver_failsafe():
+    with VirtualClock() as clock:
+        frames = []
+        driver = make_driver(clock, frames, filter_depth = 1)
+        pulse(driver.sms[0], 1200)
+        pulse(driver.sms[1], 1800)
+        driver.process()
+        assert frames == [{1: 1200, 2: 1800}]
+
+        # Out of range pulses are ignored
+        pulse(driver.sms[0], 3000)
+        driver.process()
+        assert len(frames) == 1
+        assert driver.rejected == 1
+
+        # Input 2 stops, and times out
+        for t in range(10):
+            clock.advance(20000)
+            pulse(driver.sms[0], 1200)
+            driver.process()
+        assert frames[-1] == {1: 1200, 2: PWMRCDriver.FAILSAFE_US}
+        assert driver.failsafe == [False, True]
+
+        # And recovers
+        pulse(driver.sms[1], 1701)
+        driver.process()
+        assert frames[-1] == {2: 1701}
+        assert driver.failsafe == [False, False]
+
+def test_driver_benchmark():
+    import benchmark
+
+    with VirtualClock() as clock:
+        for depth in (1, 3, 5, 8):
+            driver = PWMRCDriver((1, 2), lambda frame: None, filter_depth = depth)
+            driver.start()
+            def process():
+                pulse(driver.sms[0], 1500)
+                pulse(driver.sms[1], 1500)
+                driver.process()
+            (us, allocated) = benchmark.measure(process, 2000)
+            benchmark.report("PWM process, 2 inputs, median depth %d" % depth, us, allocated)
+
+def gap(sm, width):
+    sm.push_rx(0xFFFFFFFF - width // 2)
+
+def feed_gaps(detector, input, width, n):
+    # Returns the result of the first step() to detect a mode
+    for i in range(n):
+        gap(detector.sms[input], width)
+        mode = detector.step()
+        if mode is not None:
+            return mode
+    return None
+
+def test_signal_detector():
+    with VirtualClock() as clock:
+        detector = SignalDetector((1, 2))
+        detector.start()
+        assert detector.step() is None
+
+        # An inconsistent input starts the count again
+        assert feed_gaps(detector, 0, 18000, 30) is None
+        assert feed_gaps(detector, 0, 60, 30) is None
+        clock.advance(250000)
+        assert feed_gaps(detector, 0, 60, 30) == RCMode.SMART
+        assert not detector.active
+        assert detector.duration_ms == 250
+
+        detector.start()
+        assert feed_gaps(detector, 1, 18000, 60) == RCMode.PWM
+        assert detector.detections == 2
+
+def detect(controller, width):
+    for i in range(60):
+        gap(controller.detector.sms[0], width)
+        controller.update_signal()
+
+def test_redetect():
+    import importlib
+    import sys
+
+    with VirtualClock() as clock:
+        if "controller" in sys.modules:
+            controller = importlib.reload(sys.modules["controller"])
+        else:
+            controller = importlib.import_module("controller")
+        detector = controller.detector
+        detector.start()
+        detect(controller, 60)
+        assert controller.mode == RCMode.SMART
+        assert not detector.active
+
+        # Receiver unplugged
+        driver = controller.driver
+        clock.advance(2000000)
+        driver.process()
+        controller.update_signal()
+        assert detector.active
+
+        # A PWM receiver plugged in instead
+        detect(controller, 18000)
+        assert controller.mode == RCMode.PWM
+        assert controller.driver is not driver
+        assert not controller.init
+
+        # Which is unplugged and plugged back in
+        pwm_driver = controller.driver
+        for i in range(10):
+            clock.advance(20000)
+            pulse(pwm_driver.sms[0], 1500)
+            pwm_driver.process()
+        controller.update_signal()
+        assert not detector.active
+        clock.advance(200000)
+        pwm_driver.process()
+        controller.update_signal()
+        assert detector.active
+        detect(controller, 18000)
+        assert controller.driver is pwm_driver
+
+def test_pio_pulse_widths():
+    with VirtualClock() as clock:
+        try:
+            frames = []
+            driver = make_driver(clock, frames, filter_depth = 1)
+            for width in (1000, 1500, 1998, 2001):
+                rp2.drive(1, rp2.pwm_waveform(width))
+                rp2.drive(2, rp2.pwm_waveform(3000 - width, 14000))
+                frames.clear()
+                for i in range(10):
+                    clock.advance(10000)
+                    driver.process()
+                # The timing loop is 3 cycles
+                assert abs(frames[-1].get(1, frames[-2].get(1)) - width) <= 3
+                assert abs(frames[-1].get(2, frames[-2].get(2)) - (3000 - width)) <= 3
+            # Changing waveform can cut a pulse short
+            assert driver.rejected <= 4
+        finally:
+            rp2.release()
+
+def test_pio_fifo_overflow():
+    with VirtualClock() as clock:
+        try:
+            frames = []
+            driver = make_driver(clock, frames, filter_depth = 1)
+            rp2.drive(1, rp2.pwm_waveform(1200))
+            clock.advance(30000)
+            driver.process()
+            assert abs(frames[-1][1] - 1200) <= 3
+            pulses = driver.pulses
+
+            # The pulse width changes while process() isn't called.  The FIFO
+            # keeps the oldest pulses, so the newest ones are lost.
+            rp2.drive(1, rp2.pwm_waveform(1800))
+            clock.advance(200000)
+            sm = driver.sms[0]
+            assert sm.rx_fifo() == rp2.StateMachine.FIFO_DEPTH
+            assert sm.rx_overflows == 10 - rp2.StateMachine.FIFO_DEPTH
+            driver.process()
+            assert frames[-1] == {1: 1800}
+            assert driver.pulses - pulses == rp2.StateMachine.FIFO_DEPTH
+        finally:
+            rp2.release()
+
+def detection_time(waveform, loop_us = 1000):
+    with VirtualClock() as clock:
+        try:
+            detector = SignalDetector((1, 2))
+            detector.start()
+            rp2.drive(2, waveform)
+            mode = None
+            while mode is None and clock.us < 5000000:
+                clock.advance(loop_us)
+                mode = detector.step()
+            return (mode, detector.duration_ms)
+        finally:
+            rp2.release()
+
+def test_pio_detection():
+    # 50 gaps, the first of which is partial
+    (mode, duration) = detection_time(rp2.pwm_waveform(1500))
+    assert mode == RCMode.PWM
+    assert 1000 <= duration <= 1040
+    (mode, duration) = detection_time(rp2.pwm_waveform(1500, 3000))
+    assert mode == RCMode.PWM
+    assert 150 <= duration <= 160
+
+    # A packet with over 50 gaps, every 11ms, is detected within one packet
+    # if the FIFO is read often enough.
+    packet = bytes(range(0x20, 0x70, 3))
+    (mode, duration) = detection_time(rp2.uart_waveform(packet, gap_us = 9500), loop_us = 100)
+    assert mode == RCMode.SMART
+    assert duration <= 2
+
+    # Otherwise gaps are lost from the FIFO, and it takes several packets
+    (mode, duration) = detection_time(rp2.uart_waveform(packet, gap_us = 9500), loop_us = 1000)
+    assert mode == RCMode.SMART
+    assert 10 < duration < 100
+
+def test_pio_benchmark():
+    import benchmark
+    import time
+
+    with VirtualClock() as clock:
+        try:
+            driver = PWMRCDriver((1, 2, 3), lambda frame: None)
+            driver.start()
+            for i in (1, 2, 3):
+                rp2.drive(i, rp2.pwm_waveform(1500))
+            def process():
+                clock.advance(20000)
+                driver.process()
+            (us, allocated) = benchmark.measure(process, 200)
+            benchmark.report("PIO sim, 3 PWM inputs", us, allocated, "frame")
+
+            detector = SignalDetector((1, 2, 3))
+            rp2.drive(1, rp2.uart_waveform(bytes(range(80)), gap_us = 2000))
+            start = time.perf_counter()
+            detections = 20
+            for i in range(detections):
+                detector.start()
+                while detector.step() is None:
+                    clock.advance(1000)
+            us = (time.perf_counter() - start) * 1000000 / detections
+            benchmark.report("PIO sim, SRXL2 detection", us, 0, "detection")
+        finally:
+            rp2.release()
@@ -0,0 +1,102 @@
+import gc
+import time
+
+# Renders the lights at a fixed frame rate, so animations are sampled at the
+# same rate however fast the main loop runs.
+#
+# Each frame, update() sets the level of every light, which Light only
+# records, and then each light whose level differs from the one last written
+# commits it to its outputs.  Light.cur_index holds the frame being rendered
+# and Light.out_index the frame last committed, so nothing is allocated per
+# frame.
+
+# gc.mem_alloc() is MicroPython only
+mem_alloc = getattr(gc, "mem_alloc", None)
+
+class Renderer:
+
+    # Most bytes a frame should allocate.  On MicroPython, frames that
+    # allocate more are counted, so GC pauses from the render path show up in
+    # FRAMES, and FRAMES CHECK fails.
+    ALLOC_BUDGET = 64
+
+    def __init__(self, lights, update, frame_rate):
+        self.lights = lights
+        self.update = update
+        # Scheduler task running render(), whose period follows the frame
+        # rate
+        self.task = None
+        self.set_frame_rate(frame_rate)
+        self.next_frame = time.ticks_us()
+        self.reset_stats()
+
+    def set_frame_rate(self, frame_rate, revision = None):
+        # revision is the config revision the rate was read from
+        self.period_us = 1000000 // frame_rate
+        self.revision = revision
+        if self.task is not None:
+            self.task.period_us = self.period_us
+
+    def reset_stats(self):
+        self.frames = 0
+        # Frames not rendered because the previous one was late
+        self.dropped = 0
+        # Outputs written, as only changed outputs are
+        self.commits = 0
+        self.total_us = 0
+        self.max_us = 0
+        # Most bytes allocated by one frame, and frames over ALLOC_BUDGET
+        self.max_alloc = 0
+        self.over_budget = 0
+
+    def render(self):
+        # Renders a frame if one is due.  Returns True if it did.
+        start = time.ticks_us()
+        late = time.ticks_diff(start, self.next_frame)
+        if late < 0:
+            return False
+        dropped = late // self.period_us
+        self.dropped += dropped
+        self.next_frame = time.ticks_add(self.next_frame, self.period_us * (dropped + 1))
+
+        if mem_alloc is not None:
+            allocated = mem_alloc()
+        self.update()
+        commits = 0
+        for light in self.lights:
+            if light.commit():
+                commits += 1
+        if mem_alloc is not None:
+            # Negative if the GC ran during the frame
+            allocated = mem_alloc() - allocated
+            if allocated > self.max_alloc:
+                self.max_alloc = allocated
+            if allocated > self.ALLOC_BUDGET:
+                self.over_budget += 1
+
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self.frames += 1
+        self.commits += commits
+        self.total_us += elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        return True
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "commits": self.commits,
+            "avg_us": self.total_us // self.frames if self.frames else None,
+            "max_us": self.max_us,
+            "period_us": self.period_us,
+            "max_alloc": self.max_alloc if mem_alloc is not None else None,
+            "over_budget": self.over_budget if mem_alloc is not None else None,
+        }
+
+    def within_budget(self):
+        # True if frames have been rendered and none allocated more than
+        # ALLOC_BUDGET.  None where allocation can't be measured.
+        if mem_alloc is None or self.frames == 0:
+            return None
+        return self.over_budget == 0
@@ -0,0 +1,112 @@
+import sim
+sim.install()
+
+from animation import LEVEL_STEPS
+from config import LightConfig
+from light import Light
+import renderer as renderer_module
+from renderer import Renderer
+from sim.clock import VirtualClock
+
+
+def make_renderer(levels, frame_rate = 500):
+    lights = [Light(LightConfig(10 + i, 20, 100)) for i in range(len(levels))]
+    def update():
+        for (light, level) in zip(lights, levels):
+            light.show_level(level * LEVEL_STEPS)
+    return (lights, Renderer(lights, update, frame_rate))
+
+def test_frame_rate():
+    with VirtualClock() as clock:
+        levels = [0, 0]
+        (lights, renderer) = make_renderer(levels)
+        assert renderer.period_us == 2000
+        # Called far more often than the frame rate
+        rendered = 0
+        for i in range(1000):
+            if renderer.render():
+                rendered += 1
+            clock.advance(10)
+        assert rendered == 5
+        assert renderer.frames == 5
+        assert renderer.dropped == 0
+
+def test_changed_outputs_only():
+    with VirtualClock() as clock:
+        levels = [0, 50, 100]
+        (lights, renderer) = make_renderer(levels)
+        assert renderer.render()
+        assert renderer.commits == 3
+        assert [l.pwms[0].duty_u16() for l in lights] == [0, 0x7FFF, 0xFFFF]
+
+        clock.advance(2000)
+        assert renderer.render()
+        assert renderer.commits == 3
+
+        levels[1] = 60
+        clock.advance(2000)
+        assert renderer.render()
+        assert renderer.commits == 4
+        assert lights[1].pwms[0].duty_u16() == 0xFFFF * 6 // 10
+
+def test_dropped_frames():
+    with VirtualClock() as clock:
+        (lights, renderer) = make_renderer([0])
+        renderer.render()
+        clock.advance(2000)
+        renderer.render()
+        # Three frame periods pass before the next render
+        clock.advance(8000)
+        renderer.render()
+        assert renderer.dropped == 3
+        # Frames stay on the original schedule
+        clock.advance(1000)
+        assert not renderer.render()
+        clock.advance(1000)
+        assert renderer.render()
+        stats = renderer.stats()
+        assert stats["frames"] == 4
+        assert stats["dropped"] == 3
+        renderer.reset_stats()
+        assert renderer.stats()["frames"] == 0
+
+def test_render_benchmark():
+    import benchmark
+    with VirtualClock() as clock:
+        levels = [0, 20, 40, 60, 80, 100]
+        (lights, renderer) = make_renderer(levels)
+        def render():
+            clock.advance(renderer.period_us)
+            renderer.render()
+        (us, allocated) = benchmark.measure(render)
+        benchmark.report("Render frame, 6 lights, unchanged", us, allocated, "frame")
+
+def test_alloc_budget():
+    # Stands in for MicroPython's gc.mem_alloc(), counting what update()
+    # says it allocated
+    allocated = [0]
+    saved = renderer_module.mem_alloc
+    renderer_module.mem_alloc = lambda: allocated[0]
+    with VirtualClock() as clock:
+        try:
+            lights = [Light(LightConfig(10, 20, 100))]
+            sizes = [0, 16, Renderer.ALLOC_BUDGET + 1, 0]
+            def update():
+                allocated[0] += sizes.pop(0)
+            renderer = Renderer(lights, update, 500)
+            assert renderer.within_budget() is None
+            renderer.render()
+            clock.advance(2000)
+            renderer.render()
+            assert renderer.within_budget()
+            clock.advance(2000)
+            renderer.render()
+            assert not renderer.within_budget()
+            assert renderer.stats()["over_budget"] == 1
+            assert renderer.stats()["max_alloc"] == Renderer.ALLOC_BUDGET + 1
+            renderer.reset_stats()
+            clock.advance(2000)
+            renderer.render()
+            assert renderer.within_budget()
+        finally:
+            renderer_module.mem_alloc = saved
@@ -0,0 +1,66 @@
+import io
+import struct
+
+import capture
+from sim.clock import VirtualClock
+from sim.replay import replay
+from srxl2_test import control_frame
+
+
+class Closeable(io.BytesIO):
+    def close(self):
+        pass
+
+def record(kind, events):
+    # events is a list of (t_us, args) passed to the writer at time t_us
+    with VirtualClock() as clock:
+        f = Closeable()
+        w = capture.CaptureWriter(f, kind)
+        for (t, args) in events:
+            clock.advance_to(t)
+            if kind == capture.KIND_UART:
+                w.uart(*args)
+            else:
+                w.pulse(*args)
+        w.close()
+    return f.getvalue()
+
+def test_capture_format():
+    data = record(capture.KIND_PWM, [(1000, (1, 1500)), (21000, (2, 1200))])
+    (kind, records) = capture.read_capture(data)
+    assert kind == capture.KIND_PWM
+    assert records == [(1000, 1, 1500), (21000, 2, 1200)]
+
+    big = bytes(range(256)) * 2
+    data = record(capture.KIND_UART, [(5, (b'\xa6\xcd',)), (7, (big,))])
+    (kind, records) = capture.read_capture(data)
+    assert records[0] == (5, b'\xa6\xcd')
+    assert b''.join(r[1] for r in records[1:]) == big
+
+def test_replay_srxl2():
+    events = []
+    for n in range(200):
+        frame = control_frame({1: 0x8000, 4: 0x8000, 8: 0x8000})
+        # Frame arrives in two UART reads
+        events.append((n * 11000, (frame[:8],)))
+        events.append((n * 11000 + 700, (frame[8:],)))
+    (kind, records) = capture.read_capture(record(capture.KIND_UART, events))
+
+    result = replay(kind, records)
+    assert result.frames == 200
+    assert result.driver.stats()["crc_errors"] == 0
+    # Calibration completes after 30 good frames
+    assert result.controller.init
+    assert not result.controller.vehicle.startup
+
+def test_replay_pwm():
+    events = []
+    for n in range(100):
+        events.append((n * 20000, (1, 1500)))
+        events.append((n * 20000 + 2000, (2, 1900 if n > 50 else 1500)))
+    (kind, records) = capture.read_capture(record(capture.KIND_PWM, events))
+
+    result = replay(kind, records)
+    assert result.frames == 200
+    assert result.controller.init
+    assert result.controller.vehicle.throttle.forward
@@ -0,0 +1,188 @@
+import json
+import sys
+
+import sim
+sim.install()
+
+from sim.runtime import Simulation
+from light import LightState
+
+
+def test_pwm_boot():
+    with Simulation(config = {"pwm_mode": 1}, laststate = LightState.HIGH) as s:
+        receiver = s.pwm_receiver()
+        receiver.set(1, 1500)
+        receiver.set(2, 1500)
+        s.boot()
+        assert s.controller.driver is None
+        s.run(3000)
+        assert s.controller.driver is not None
+        assert s.controller.init
+        assert "LOG Detected PWM signal on channel 0 in 1020ms" in s.log
+        assert s.duty(0) == 0xFFFF
+
+        # A short click steps the lights from high round to low
+        s.press_button(100)
+        s.run(1000)
+        assert s.controller.vehicle.light_state == LightState.LOW
+        assert 0 < s.duty(0) < 0xFFFF
+
+        assert s.command("VERSION").startswith("VERSION")
+        frames = json.loads(s.command("FRAMES")[len("FRAMES "):])
+        assert frames["frames"] >= 4000 // 4
+        assert frames["dropped"] == 0
+        # Allocation is only measured on the device
+        assert s.command("FRAMES CHECK") == "ERR\n"
+
+def test_pwm_signal_lost():
+    with Simulation(config = {"pwm_mode": 1}) as s:
+        receiver = s.pwm_receiver()
+        receiver.set(1, 1500)
+        s.boot()
+        s.run(2000)
+        assert s.controller.init
+        receiver.disconnect()
+        s.run(1000)
+        assert "LOG Input signal lost" in s.log
+        assert s.controller.detector.active
+
+def test_srxl2_esc_telemetry():
+    with Simulation() as s:
+        receiver = s.srxl2_receiver()
+        receiver.esc(rpm = 1000, volts_input = 1200, temp_fet = 30)
+        s.boot()
+        s.run(3000)
+        assert s.controller.init
+        assert s.controller.vehicle.voltage == 1200
+        assert s.controller.vehicle.cells == 3
+
+def test_srxl2_reconnect_low_baud():
+    with Simulation() as s:
+        receiver = s.srxl2_receiver()
+        s.boot()
+        s.run(3000)
+        assert s.controller.init
+        assert s.controller.driver.baudrate == 400000
+
+        # Back after a while, with the master only running at 115200
+        receiver.disconnect()
+        s.run(3000)
+        assert "LOG Input signal lost" in s.log
+        receiver = s.srxl2_receiver(high_baud = False)
+        s.run(3000)
+        driver = s.controller.driver
+        assert driver.baudrate == 115200
+        assert driver.has_signal()
+        assert not s.controller.detector.active
+
+def test_frame_rate_change():
+    with Simulation(config = {"pwm_mode": 1}) as s:
+        s.boot()
+        s.run(500)
+        renderer = s.controller.renderer
+        assert renderer.period_us == 4000
+        assert "SET" in s.command("SET frame_rate 100").splitlines()
+        frames = renderer.frames
+        s.run(1000)
+        assert renderer.period_us == 10000
+        assert s.scheduler.task("lights").period_us == 10000
+        assert 99 <= renderer.frames - frames <= 101
+
+def test_timeline():
+    with Simulation(config = {"pwm_mode": 1}, laststate = LightState.HIGH) as s:
+        receiver = s.pwm_receiver()
+        receiver.set(1, 1500)
+        receiver.set(2, 1500)
+        s.boot()
+        s.run(3000)
+        changes = s.timeline(0)
+        assert changes[0] == (0, None)
+        # Fades up to full at boot, then flashes once the input is found
+        assert changes[1][1] == 0
+        full = [t for (t, d) in changes if d == 0xFFFF]
+        flashes = [t for (t, d) in changes if d == 24575]
+        assert full[0] < flashes[0]
+        assert len(flashes) == 3
+        assert changes[-1][1] == 0xFFFF
+        assert all(changes[i][0] < changes[i + 1][0] for i in range(len(changes) - 1))
+
+def test_boot_to_first_light():
+    with Simulation(config = {"pwm_mode": 1}, laststate = LightState.HIGH) as s:
+        s.boot()
+        s.run(1000)
+        # The last state shows before any receiver is connected
+        assert s.controller.driver is None
+        assert s.duty(0) == 0xFFFF
+        lit = [t for (t, d) in s.timeline(0) if d]
+        assert lit[0] < 300
+        boot = dict(s.controller.boot_times)
+        assert boot["lights"] < 300
+        assert s.command("BOOT").startswith('BOOT [["start", 0], ["delay", 100]')
+        # Nothing needed to boot builds the menu
+        assert s.controller.vehicle._menu is None
+        assert "menu" not in sys.modules
+
+def test_boot_benchmark():
+    import time
+    with Simulation(config = {"pwm_mode": 1}) as s:
+        start = time.perf_counter()
+        s.boot()
+        elapsed = time.perf_counter() - start
+        print("Firmware import and boot: %.1fms on the host, %dms simulated" % (elapsed * 1000, s.boot_us // 1000))
+        assert s.boot_us < 300000
+
+def test_simulation_speed():
+    import time
+    with Simulation(config = {"pwm_mode": 1}) as s:
+        receiver = s.pwm_receiver()
+        receiver.set(1, 1500)
+        receiver.set(2, 1500)
+        s.boot()
+        start = time.perf_counter()
+        s.run(5000)
+        elapsed = time.perf_counter() - start
+        print("5s of PWM input simulated in %.2fs" % elapsed)
+        # Well under real time, so long scenarios are practical
+        assert elapsed < 5
+
+# Allocations the firmware may make per run of a task while driving.  Only
+# changes such as a turn signal starting allocate, a handful a second at
+# most, where anything allocated on every frame or packet, such as a new
+# list, makes at least one per run.
+RUN_ALLOC_BUDGET = 0.1
+
+def test_steady_state_allocations():
+    import math
+    with Simulation(laststate = LightState.HIGH) as s:
+        receiver = s.pwm_receiver()
+        for i in (1, 2, 3):
+            receiver.set(i, 1500)
+        s.boot()
+        s.run(3000)
+        assert s.controller.init
+
+        # 20s of driving back and forth while steering
+        def drive(t):
+            receiver.set(2, 1500 + int(300 * math.sin(t / 700)))
+            receiver.set(3, 1500 + int(400 * math.sin(t / 300)))
+        start = s.ms
+        for t in range(0, 20000, 50):
+            s.at(start + t, lambda t = t: drive(t))
+        s.measure_allocations = True
+        s.run(20000)
+        s.measure_allocations = False
+
+        assert s.controller.vehicle.turning != 0
+        for name in s.allocations:
+            print("%s allocated %.3f times/run" % (name, s.allocated(name)))
+            assert s.allocated(name) < RUN_ALLOC_BUDGET, name
+
+        # Holding a steady speed, nothing allocates at all
+        receiver.set(2, 1700)
+        receiver.set(3, 1500)
+        s.run(3000)
+        before = sum(a[1] for a in s.allocations.values())
+        s.measure_allocations = True
+        s.run(5000)
+        s.measure_allocations = False
+        assert sum(a[1] for a in s.allocations.values()) == before
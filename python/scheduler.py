@@ -0,0 +1,233 @@
+import gc
+import time
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+
+# Run time histograms for each task, shown by the PROFILE command.  Set to 0
+# to build without them: MicroPython's compiler then drops the profiling code
+# entirely.
+_PROFILE = const(1)
+
+# gc.mem_alloc() is MicroPython only
+mem_alloc = getattr(gc, "mem_alloc", None)
+
+
+# Counts of durations in power of two buckets.  The first bucket is under
+# 1 << MIN_SHIFT us, and the last is everything from its lower bound up.
+class Histogram:
+
+    BUCKETS = 12
+    MIN_SHIFT = 4
+
+    def __init__(self):
+        self.counts = array('I', (0 for i in range(self.BUCKETS)))
+
+    def add(self, us):
+        v = us >> self.MIN_SHIFT
+        i = 0
+        while v and i < self.BUCKETS - 1:
+            v >>= 1
+            i += 1
+        self.counts[i] += 1
+
+    def reset(self):
+        for i in range(self.BUCKETS):
+            self.counts[i] = 0
+
+    def limits(self):
+        # Upper bound of each bucket in us, or None for the last
+        return [1 << (self.MIN_SHIFT + i) for i in range(self.BUCKETS - 1)] + [None]
+
+    def stats(self):
+        return {"limits_us": self.limits(), "counts": list(self.counts)}
+
+
+# Cooperative scheduler for the main loop.
+#
+# Each task is a function run either every period_us, or as soon as its ready
+# function returns True, whichever comes first.  Tasks run to completion, so
+# they should do a small amount of work and return.  Only the time functions
+# available on every MicroPython port are used, so the scheduler also runs on
+# the unix port and under a sim.clock VirtualClock.
+
+class Task:
+
+    def __init__(self, name, fn, period_us = None, ready = None, alloc_budget = None):
+        self.name = name
+        self.fn = fn
+        # Run at least this often, or None to only run when ready
+        self.period_us = period_us
+        # Optional function returning True when the task has work to do
+        self.ready = ready
+        # Most bytes a run should allocate, or None not to measure.  On
+        # MicroPython, runs that allocate more are counted, as for
+        # Renderer.ALLOC_BUDGET.
+        self.alloc_budget = alloc_budget
+        self.next_run = time.ticks_us()
+        if _PROFILE:
+            self.histogram = Histogram()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.runs = 0
+        self.total_us = 0
+        self.max_us = 0
+        # Periods skipped entirely because the task was run late
+        self.missed = 0
+        # Largest delay past the deadline at which the task was run
+        self.max_late_us = 0
+        self.reset_alloc()
+        if _PROFILE:
+            self.histogram.reset()
+
+    def reset_alloc(self):
+        # Most bytes allocated by one run, and runs over alloc_budget
+        self.max_alloc = 0
+        self.over_budget = 0
+
+    def due(self, now):
+        if self.period_us is not None and time.ticks_diff(now, self.next_run) >= 0:
+            return True
+        return self.ready is not None and self.ready()
+
+    def run(self, now):
+        if self.period_us is not None:
+            late = time.ticks_diff(now, self.next_run)
+            if late >= 0:
+                if late > self.max_late_us:
+                    self.max_late_us = late
+                skipped = late // self.period_us
+                self.missed += skipped
+                # Keep to the original phase
+                self.next_run = time.ticks_add(self.next_run, self.period_us * (skipped + 1))
+            else:
+                # Woken early by ready()
+                self.next_run = time.ticks_add(now, self.period_us)
+
+        measure = self.measures_alloc()
+        if measure:
+            allocated = mem_alloc()
+        self.fn()
+        if measure:
+            # Negative if the GC ran during the run
+            allocated = mem_alloc() - allocated
+            if allocated > self.max_alloc:
+                self.max_alloc = allocated
+            if allocated > self.alloc_budget:
+                self.over_budget += 1
+        elapsed = time.ticks_diff(time.ticks_us(), now)
+        self.runs += 1
+        self.total_us += elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        if _PROFILE:
+            self.histogram.add(elapsed)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "total_us": self.total_us,
+            "avg_us": self.total_us // self.runs if self.runs else None,
+            "max_us": self.max_us,
+            "missed": self.missed,
+            "max_late_us": self.max_late_us,
+            "period_us": self.period_us,
+            "max_alloc": self.max_alloc if self.measures_alloc() else None,
+            "over_budget": self.over_budget if self.measures_alloc() else None,
+        }
+
+    def measures_alloc(self):
+        return self.alloc_budget is not None and mem_alloc is not None
+
+
+class Scheduler:
+
+    # Longest sleep between passes, so ready() functions are polled often
+    # enough to catch incoming data.
+    POLL_US = 100
+
+    def __init__(self):
+        self.tasks = []
+        self.passes = 0
+        self.idle_us = 0
+        if _PROFILE:
+            # Time taken by each pass over the tasks
+            self.histogram = Histogram()
+
+    def add(self, name, fn, period_us = None, ready = None, alloc_budget = None):
+        task = Task(name, fn, period_us, ready, alloc_budget)
+        self.tasks.append(task)
+        return task
+
+    def task(self, name):
+        for t in self.tasks:
+            if t.name == name:
+                return t
+        return None
+
+    def run_once(self):
+        # Runs every due task once.  Returns the time in us until the next
+        # periodic task is due.
+        self.passes += 1
+        wait = self.POLL_US
+        if _PROFILE:
+            start = time.ticks_us()
+        for task in self.tasks:
+            now = time.ticks_us()
+            if task.due(now):
+                task.run(now)
+            if task.period_us is not None:
+                wait = min(wait, time.ticks_diff(task.next_run, time.ticks_us()))
+        if _PROFILE:
+            self.histogram.add(time.ticks_diff(time.ticks_us(), start))
+        return wait
+
+    def run(self):
+        while True:
+            wait = self.run_once()
+            if wait > 0:
+                self.idle_us += wait
+                time.sleep_us(wait)
+
+    def reset_stats(self):
+        self.passes = 0
+        self.idle_us = 0
+        if _PROFILE:
+            self.histogram.reset()
+        for task in self.tasks:
+            task.reset_stats()
+
+    def stats(self):
+        s = {"passes": self.passes, "idle_us": self.idle_us}
+        for task in self.tasks:
+            s[task.name] = task.stats()
+        return s
+
+    def reset_alloc(self):
+        for task in self.tasks:
+            task.reset_alloc()
+
+    def within_budget(self):
+        # True if tasks with an alloc_budget have run and none went over it.
+        # None where allocation can't be measured.
+        ran = False
+        for task in self.tasks:
+            if task.measures_alloc() and task.runs > 0:
+                if task.over_budget > 0:
+                    return False
+                ran = True
+        return True if ran else None
+
+    def profile(self):
+        # Run time histograms, or None if built without them
+        if not _PROFILE:
+            return None
+        p = {"pass": self.histogram.stats()}
+        for task in self.tasks:
+            p[task.name] = task.histogram.stats()
+        return p
@@ -0,0 +1,179 @@
+import sim
+sim.install()
+
+from sim import rp2
+from sim.clock import VirtualClock
+from scheduler import Histogram, Scheduler
+import scheduler as scheduler_module
+
+
+def run_for(scheduler, clock, us):
+    # As Scheduler.run(), for a limited time
+    end = clock.us + us
+    while clock.us < end:
+        wait = scheduler.run_once()
+        clock.advance(max(1, min(wait, end - clock.us)))
+
+def test_periodic_tasks():
+    with VirtualClock() as clock:
+        scheduler = Scheduler()
+        runs = []
+        fast = scheduler.add("fast", lambda: runs.append("fast"), 1000)
+        slow = scheduler.add("slow", lambda: runs.append("slow"), 10000)
+        run_for(scheduler, clock, 20000)
+        assert fast.runs == 20
+        assert slow.runs == 2
+        assert fast.missed == 0
+        assert scheduler.stats()["fast"]["runs"] == 20
+
+def test_ready_wakes_task():
+    with VirtualClock() as clock:
+        scheduler = Scheduler()
+        pending = []
+        handled = []
+        def handle():
+            handled.append(clock.us)
+            pending.clear()
+        task = scheduler.add("input", handle, 5000, lambda: len(pending) > 0)
+        run_for(scheduler, clock, 1000)
+        assert len(handled) == 1
+
+        pending.append(1)
+        run_for(scheduler, clock, 1000)
+        assert len(handled) == 2
+        # Handled within one poll interval
+        assert handled[1] - 1000 <= Scheduler.POLL_US
+
+        # Period restarts from the early run
+        run_for(scheduler, clock, 5000)
+        assert handled[2] == handled[1] + 5000
+        assert task.missed == 0
+
+def test_missed_deadlines():
+    with VirtualClock() as clock:
+        scheduler = Scheduler()
+        tick = scheduler.add("tick", lambda: None, 1000)
+        busy = scheduler.add("busy", lambda: clock.advance(3500), 10000)
+        run_for(scheduler, clock, 20000)
+        assert busy.max_us == 3500
+        assert busy.total_us == busy.runs * 3500
+        # Each busy run delays tick by 3.5 periods.  It then runs once late,
+        # having missed two periods entirely.
+        assert tick.missed == busy.runs * 2
+        assert tick.max_late_us >= 2500
+
+        scheduler.reset_stats()
+        assert scheduler.stats()["tick"]["missed"] == 0
+
+def test_histogram():
+    h = Histogram()
+    for us in (0, 15, 16, 31, 100, 1000000):
+        h.add(us)
+    assert list(h.counts) == [2, 2, 0, 1] + [0] * (Histogram.BUCKETS - 5) + [1]
+    assert h.limits()[:3] == [16, 32, 64]
+    assert h.limits()[-1] is None
+    h.reset()
+    assert sum(h.counts) == 0
+
+def test_profile_command(capsys):
+    import cli
+    import json
+    from vehicle import Vehicle
+    from config import config
+
+    with VirtualClock() as clock:
+        scheduler = Scheduler()
+        scheduler.add("slow", lambda: clock.advance(500), 10000)
+        run_for(scheduler, clock, 50000)
+
+        console = cli.CLI(Vehicle(config))
+        console.scheduler = scheduler
+        capsys.readouterr()
+        console.do_command("PROFILE")
+        out = capsys.readouterr().out
+        assert out.startswith("PROFILE ")
+        profile = json.loads(out[8:])
+        # 500us falls in the 256-511us bucket
+        assert profile["slow"]["counts"][5] == 5
+        assert sum(profile["pass"]["counts"]) == scheduler.passes
+
+        console.do_command("PROFILE RESET")
+        assert capsys.readouterr().out == "PROFILE\n"
+        assert sum(scheduler.profile()["slow"]["counts"]) == 0
+
+def test_alloc_budget():
+    # Stands in for MicroPython's gc.mem_alloc(), counting what the tasks
+    # say they allocated
+    allocated = [0]
+    saved = scheduler_module.mem_alloc
+    scheduler_module.mem_alloc = lambda: allocated[0]
+    with VirtualClock() as clock:
+        try:
+            sizes = [0, 16, 33, 0]
+            def process():
+                allocated[0] += sizes.pop(0)
+            def other():
+                allocated[0] += 1000
+            scheduler = Scheduler()
+            scheduler.add("input", process, 1000, alloc_budget = 32)
+            scheduler.add("other", other, 1000)
+            assert scheduler.within_budget() is None
+            scheduler.run_once()
+            clock.advance(1000)
+            scheduler.run_once()
+            # Tasks without a budget aren't measured
+            assert scheduler.within_budget()
+            assert scheduler.stats()["other"]["max_alloc"] is None
+            clock.advance(1000)
+            scheduler.run_once()
+            assert not scheduler.within_budget()
+            assert scheduler.stats()["input"]["over_budget"] == 1
+            assert scheduler.stats()["input"]["max_alloc"] == 33
+            scheduler.reset_alloc()
+            clock.advance(1000)
+            scheduler.run_once()
+            assert scheduler.within_budget()
+        finally:
+            scheduler_module.mem_alloc = saved
+
+def test_controller_tasks():
+    import importlib
+    import sys
+    import cli
+    from config import RCMode
+
+    with VirtualClock() as clock:
+        try:
+            if "controller" in sys.modules:
+                controller = importlib.reload(sys.modules["controller"])
+            else:
+                controller = importlib.import_module("controller")
+            controller.console = cli.CLI(controller.vehicle)
+            scheduler = controller.make_scheduler()
+            controller.detector.start()
+            for pin in controller.config.input_pins:
+                rp2.drive(pin, rp2.pwm_waveform(1500))
+            run_for(scheduler, clock, 2000000)
+            assert controller.mode == RCMode.PWM
+            assert controller.init
+
+            stats = scheduler.stats()
+            assert stats["lights"]["runs"] >= 2000000 // controller.renderer.period_us - 1
+            assert stats["therm"]["runs"] >= 2000000 // controller.THERM_PERIOD_US - 1
+            # Input is processed as pulses arrive, well beyond its period
+            assert stats["input"]["runs"] > 2000000 // controller.INPUT_PERIOD_US
+        finally:
+            rp2.release()
+
+def test_scheduler_benchmark():
+    import benchmark
+
+    with VirtualClock() as clock:
+        scheduler = Scheduler()
+        for i in range(5):
+            scheduler.add("task%d" % i, lambda: None, 1000 * (i + 1), lambda: False)
+        def run_once():
+            clock.advance(100)
+            scheduler.run_once()
+        (us, allocated) = benchmark.measure(run_once, 5000)
+        benchmark.report("Scheduler pass, 5 tasks", us, allocated, "pass")
@@ -0,0 +1,32 @@
+# Host-side support for running the firmware under CPython.
+#
+# This package is not copied to the controller.  install() makes the firmware
+# modules importable off-device by providing stand-ins for modules that only
+# exist in MicroPython, and the board's pin definitions.
+
+import os
+import sys
+import types
+
+FIRMWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAND_INS = ("machine", "uselect", "rp2")
+
+def load_pins(board):
+    # Load pins.py.<board> as the pins module, as is done when installing
+    # the firmware.
+    path = os.path.join(FIRMWARE_DIR, "pins.py." + board)
+    module = types.ModuleType("pins")
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), module.__dict__)
+    sys.modules["pins"] = module
+    return module
+
+def install(board = "pdwrc_v2"):
+    if FIRMWARE_DIR not in sys.path:
+        sys.path.insert(0, FIRMWARE_DIR)
+    for name in STAND_INS:
+        if name not in sys.modules:
+            __import__("sim." + name)
+            sys.modules[name] = sys.modules["sim." + name]
+    load_pins(board)
@@ -0,0 +1,63 @@
+import time
+
+# Virtual clock providing MicroPython's time.ticks_* and sleep functions.
+# Time only moves when the clock is advanced or something sleeps.
+class VirtualClock:
+
+    FUNCTIONS = ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add", "sleep", "sleep_ms", "sleep_us")
+
+    def __init__(self, start_us = 0):
+        self.us = start_us
+        self.saved = None
+
+    def ticks_us(self):
+        return self.us
+
+    def ticks_ms(self):
+        return self.us // 1000
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def ticks_add(self, a, b):
+        return a + b
+
+    def sleep(self, s):
+        self.us += int(s * 1000000)
+
+    def sleep_ms(self, ms):
+        self.us += ms * 1000
+
+    def sleep_us(self, us):
+        self.us += us
+
+    def advance(self, us):
+        self.us += us
+
+    def advance_to(self, us):
+        if us > self.us:
+            self.us = us
+
+    def install(self):
+        # Replace the time module functions with this clock's
+        self.saved = {}
+        for name in self.FUNCTIONS:
+            self.saved[name] = getattr(time, name, None)
+            setattr(time, name, getattr(self, name))
+
+    def uninstall(self):
+        for (name, fn) in self.saved.items():
+            if fn is None:
+                delattr(time, name)
+            else:
+                setattr(time, name, fn)
+        self.saved = None
+
+    # with VirtualClock() as clock: installs the clock for the block
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+        return False
@@ -0,0 +1,199 @@
+# Stand-in for MicroPython's machine module, installed by sim.install().
+#
+# Output levels set through Pin and PWM are recorded against time.ticks_us()
+# in timeline.  Input pin levels come from a sim.rp2 waveform if one is
+# driving the pin, otherwise from levels.  UARTs are connected to whatever
+# uart_connector returns for their baud rate, and ADC readings are set in
+# machine_mock.ADC.values.
+
+import time
+
+import machine_mock
+from machine_mock import ADC
+from sim import rp2
+
+FULL_DUTY = 0xFFFF
+
+
+class Timeline:
+
+    # Output duty (0-0xFFFF) over time, recorded for each pin as a list of
+    # (t_us, duty) changes.
+
+    def __init__(self):
+        self.changes = {}
+
+    def reset(self):
+        self.changes = {}
+
+    def record(self, pin, duty):
+        changes = self.changes.get(pin)
+        if changes is None:
+            changes = []
+            self.changes[pin] = changes
+        elif changes and changes[-1][1] == duty:
+            return
+        t = time.ticks_us() if hasattr(time, "ticks_us") else 0
+        if changes and changes[-1][0] == t:
+            # Only the last change at any instant is seen
+            changes.pop()
+            if changes and changes[-1][1] == duty:
+                return
+        changes.append((t, duty))
+
+    def duty(self, pin):
+        # Current duty of pin, or None if it has never been set
+        changes = self.changes.get(pin)
+        return changes[-1][1] if changes else None
+
+    def duty_at(self, pin, t):
+        duty = None
+        for (ct, d) in self.changes.get(pin, ()):
+            if ct > t:
+                break
+            duty = d
+        return duty
+
+    def between(self, pin, start, end):
+        # Changes in [start, end), preceded by the duty at start
+        result = [(start, self.duty_at(pin, start))]
+        for (t, d) in self.changes.get(pin, ()):
+            if start < t < end:
+                result.append((t, d))
+        return result
+
+timeline = Timeline()
+
+# Levels of input pins not driven by a waveform
+levels = {}
+
+def pin_level(pin):
+    wave = rp2.waveforms.get(pin)
+    if wave is not None:
+        (waveform, start) = wave
+        return waveform.level(time.ticks_us() - start)
+    return levels.get(pin, 0)
+
+
+class Pin(machine_mock.Pin):
+
+    def __init__(self, pin, mode = machine_mock.Pin.IN, *args, **kwargs):
+        super().__init__(pin)
+        self.mode = mode
+
+    def value(self, v = None):
+        if v is None:
+            if self.mode == Pin.OUT:
+                return self._value
+            return pin_level(self.pin)
+        self._value = 1 if v else 0
+        timeline.record(self.pin, FULL_DUTY if v else 0)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class PWM:
+
+    def __init__(self, pin, freq = None, duty_u16 = None):
+        self.pin = rp2.pin_id(pin)
+        self._freq = freq
+        self._duty = 0
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, freq = None):
+        if freq is None:
+            return self._freq
+        self._freq = freq
+
+    def duty_u16(self, duty = None):
+        if duty is None:
+            return self._duty
+        self._duty = duty
+        timeline.record(self.pin, duty)
+
+    def deinit(self):
+        self.duty_u16(0)
+
+
+class NullPort:
+
+    # Nothing connected
+
+    def any(self):
+        return 0
+
+    def readinto(self, buf, nbytes = None):
+        return None
+
+    def write(self, data):
+        return len(data)
+
+    def deinit(self):
+        pass
+
+def null_connector(baudrate):
+    return NullPort()
+
+# Function returning the port a UART at a given baud rate is connected to,
+# e.g. sim.srxl2bus.SRXL2Master.connect
+uart_connector = null_connector
+
+
+class UART:
+    INV_RX = 2
+    INV_TX = 1
+
+    def __init__(self, id, baudrate = 9600, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self.connector = uart_connector
+        self.port = uart_connector(baudrate)
+
+    def connected(self):
+        # The port for whatever is plugged in now, which may have changed
+        # since the UART was opened
+        if self.connector is not uart_connector:
+            self.connector = uart_connector
+            self.port = uart_connector(self.baudrate)
+        return self.port
+
+    def any(self):
+        return self.connected().any()
+
+    def read(self, nbytes = None):
+        buf = bytearray(nbytes if nbytes is not None else max(1, self.any()))
+        n = self.readinto(buf)
+        return None if not n else bytes(buf[0:n])
+
+    def readinto(self, buf, nbytes = None):
+        return self.connected().readinto(buf, nbytes)
+
+    def write(self, data):
+        return self.connected().write(data)
+
+    def deinit(self):
+        self.port.deinit()
+
+
+def freq(hz = None):
+    return 125_000_000
+
+def unique_id():
+    return b"SIMULATE"
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def reset_state():
+    # Clear recorded output and inputs, for a fresh boot
+    global uart_connector
+    timeline.reset()
+    levels.clear()
+    ADC.values.clear()
+    uart_connector = null_connector
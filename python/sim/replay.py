@@ -0,0 +1,188 @@
+# Replay a capture recorded with the CAPTURE command through the input driver,
+# controller.handle_control_packet and Vehicle.update, on a virtual clock.
+#
+#   python -m sim.replay capture.bin [--board pdwrc_v2] [--loop-us 1000]
+#
+# Run from the python directory.  The replay runs as fast as the host allows
+# and reports the pipeline throughput.
+
+import sys
+import time
+
+import sim
+from sim.clock import VirtualClock
+
+
+class ReplayUART:
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def push(self, data):
+        self.buf += data
+
+    def any(self):
+        return len(self.buf)
+
+    def write(self, data):
+        return len(data)
+
+    def deinit(self):
+        pass
+
+    def readinto(self, buf, nbytes = None):
+        n = min(len(self.buf), len(buf))
+        if nbytes is not None:
+            n = min(n, nbytes)
+        if n == 0:
+            return None
+        buf[0:n] = self.buf[0:n]
+        del self.buf[0:n]
+        return n
+
+
+class ReplayResult:
+
+    def __init__(self, records, frames, virtual_us, elapsed_us, iterations):
+        self.records = records
+        self.frames = frames
+        self.virtual_us = virtual_us
+        self.elapsed_us = elapsed_us
+        self.iterations = iterations
+
+    @property
+    def us_per_frame(self):
+        return self.elapsed_us / self.frames if self.frames else None
+
+    @property
+    def frames_per_s(self):
+        return self.frames * 1000000 / self.elapsed_us if self.elapsed_us else None
+
+    @property
+    def speedup(self):
+        return self.virtual_us / self.elapsed_us if self.elapsed_us else None
+
+    def __repr__(self):
+        s = "%d records, %d frames, %.1fs of input replayed in %.3fs (%.0fx real time)\n" % (
+                self.records, self.frames, self.virtual_us / 1000000, self.elapsed_us / 1000000, self.speedup or 0)
+        s += "%.0f frames/s, %.1fus per frame, %d loop iterations" % (
+                self.frames_per_s or 0, self.us_per_frame or 0, self.iterations)
+        return s
+
+
+def replay(kind, records, board = "pdwrc_v2", loop_us = 1000, clock = None):
+    # Feeds records, as returned by capture.read_capture(), through a freshly
+    # imported controller.  Between input records the main loop runs every
+    # loop_us microseconds of virtual time.
+    if clock is None:
+        clock = VirtualClock()
+    sim.install(board)
+    with clock:
+        return run(kind, records, loop_us, clock)
+
+
+def run(kind, records, loop_us, clock):
+    import importlib
+    from capture import KIND_UART
+    from config import RCMode
+
+    # Each replay starts from a newly booted controller
+    if "controller" in sys.modules:
+        controller = importlib.reload(sys.modules["controller"])
+    else:
+        controller = importlib.import_module("controller")
+
+    vehicle = controller.vehicle
+    config = controller.config
+    frames = [0]
+
+    def control(data):
+        frames[0] += 1
+        controller.handle_control_packet(data)
+
+    if kind == KIND_UART:
+        from srxl2driver import SRXL2Driver
+        mode = RCMode.SMART
+        driver = SRXL2Driver(config.input_pins[0], control, controller.handle_telemetry_packet)
+        uart = ReplayUART()
+        # The capture holds bytes as read, whatever the baud rate
+        driver.open_uart = lambda baudrate: uart
+        driver.start()
+        def deliver(record):
+            uart.push(record[1])
+    else:
+        from pwm import PWMRCDriver
+        mode = RCMode.PWM
+        driver = PWMRCDriver(config.input_pins, control, config.pwm_filter_depth, config.pwm_filter_mode)
+        driver.start()
+        def deliver(record):
+            (t, channel, width) = record
+            if 0 < channel <= len(driver.sms):
+                driver.sms[channel - 1].push_rx(0xFFFFFFFF - width // 3)
+
+    controller.mode = mode
+    vehicle.mode = mode
+
+    base = clock.ticks_us()
+    next_loop = base
+    iterations = 0
+    i = 0
+    start = time.perf_counter()
+    while i < len(records):
+        clock.advance_to(min(base + records[i][0], next_loop))
+        while i < len(records) and base + records[i][0] <= clock.us:
+            deliver(records[i])
+            i += 1
+        driver.process()
+        vehicle.update()
+        iterations += 1
+        if clock.us >= next_loop:
+            next_loop = clock.us + loop_us
+    elapsed = (time.perf_counter() - start) * 1000000
+
+    result = ReplayResult(len(records), frames[0], clock.us - base, elapsed, iterations)
+    result.controller = controller
+    result.driver = driver
+    return result
+
+
+def main(args):
+    import io
+    from capture import read_capture
+
+    board = "pdwrc_v2"
+    loop_us = 1000
+    quiet = True
+    paths = []
+    while args:
+        a = args.pop(0)
+        if a == "--board":
+            board = args.pop(0)
+        elif a == "--loop-us":
+            loop_us = int(args.pop(0))
+        elif a == "--verbose":
+            quiet = False
+        else:
+            paths.append(a)
+
+    if len(paths) != 1:
+        print("Usage: python -m sim.replay CAPTURE [--board BOARD] [--loop-us N] [--verbose]")
+        return 1
+
+    with open(paths[0], "rb") as f:
+        (kind, records) = read_capture(f.read())
+
+    # Firmware logging goes to stdout, which is discarded unless --verbose
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = io.StringIO()
+    try:
+        result = replay(kind, records, board = board, loop_us = loop_us)
+    finally:
+        sys.stdout = stdout
+    print(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
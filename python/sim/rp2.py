@@ -0,0 +1,518 @@
+# Stand-in for MicroPython's rp2 module.
+#
+# asm_pio() assembles programs written with the usual PIO assembler functions,
+# and StateMachine runs them cycle by cycle against pin waveforms set with
+# drive().  State machines catch up with time.ticks_us() whenever their RX
+# FIFO is read, so drive them from a sim.clock VirtualClock.
+#
+# A state machine whose pins have no waveform doesn't run, and values can be
+# put straight into its RX FIFO with push_rx().
+#
+# Only the parts of the instruction set used by the firmware are supported:
+# jmp, wait (pin and gpio), mov, set, in_, push, pull and nop.  Side-set,
+# autopush/autopull, out and irq are not.
+
+import bisect
+import builtins
+import time
+import types
+
+
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+
+
+# Pin waveforms
+
+class Waveform:
+
+    # Pin level over time, given as a list of (level, duration_us) segments.
+    # The list repeats if repeat is set, otherwise the pin stays at idle after
+    # the last segment.
+
+    def __init__(self, segments, repeat = True, idle = 0):
+        self.levels = []
+        self.ends = []
+        t = 0
+        for (level, duration) in segments:
+            t += duration
+            self.levels.append(1 if level else 0)
+            self.ends.append(t)
+        self.period = t
+        self.repeat = repeat and t > 0
+        self.idle = 1 if idle else 0
+
+    def segment(self, t):
+        # Returns (level, until), where the level holds from t_us until until_us
+        if t < 0:
+            return (self.idle, 0)
+        base = 0
+        if self.repeat:
+            base = t - t % self.period
+            t -= base
+        elif t >= self.period:
+            return (self.idle, NEVER)
+        i = bisect.bisect_right(self.ends, t)
+        return (self.levels[i], base + self.ends[i])
+
+    def level(self, t):
+        return self.segment(t)[0]
+
+NEVER = 1 << 62
+
+def pwm_waveform(width, period = 20000, inverted = True):
+    # An RC PWM signal.  The controller's inputs are inverted, so by default
+    # the pin is low during the pulse.
+    active = 0 if inverted else 1
+    return Waveform(((active, width), (1 - active, period - width)), idle = 1 - active)
+
+def uart_waveform(data, baudrate = 115200, gap_us = 0, repeat = True, inverted = True):
+    # data sent 8N1 with no gap between bytes, followed by gap_us idle
+    bit_us = 1000000 / baudrate
+    bits = []
+    for b in data:
+        bits.append(0)
+        for i in range(8):
+            bits.append((b >> i) & 1)
+        bits.append(1)
+    segments = []
+    t = 0
+    n = 0
+    for i in range(len(bits)):
+        if i + 1 == len(bits) or bits[i + 1] != bits[i]:
+            # Round segment ends rather than lengths, so error doesn't build up
+            end = round((i + 1) * bit_us)
+            segments.append((bits[i] ^ inverted, end - t))
+            t = end
+    if gap_us > 0:
+        segments.append((1 ^ inverted, gap_us))
+    return Waveform(segments, repeat = repeat, idle = 1 ^ inverted)
+
+
+# Waveform and start time (us) for each driven pin number
+waveforms = {}
+# Changed whenever waveforms is, so state machines drop cached pin levels
+generation = [0]
+
+def drive(pin, waveform, start = None):
+    # Drive a pin with waveform, starting now, or at ticks_us() start
+    if start is None:
+        start = time.ticks_us()
+    waveforms[pin_id(pin)] = (waveform, start)
+    generation[0] += 1
+
+def release(pin = None):
+    # Stop driving pin, or all pins
+    if pin is None:
+        waveforms.clear()
+    else:
+        waveforms.pop(pin_id(pin), None)
+    generation[0] += 1
+
+def pin_id(pin):
+    # A pin number, or a machine_mock.Pin
+    return getattr(pin, "pin", pin)
+
+
+# Assembler
+
+class Instruction:
+
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+        self.delay = 0
+
+    def __getitem__(self, delay):
+        # nop() [3]
+        self.delay = delay
+        return self
+
+    def side(self, value):
+        raise NotImplementedError("side-set is not supported by the simulator")
+
+
+class Program:
+
+    def __init__(self, name, kwargs):
+        self.name = name
+        self.kwargs = kwargs
+        self.instructions = []
+        self.labels = {}
+        self.wrap_target = 0
+        self.wrap = None
+
+    def __len__(self):
+        return len(self.instructions)
+
+
+def invert(src):
+    return ("invert", src)
+
+def reverse(src):
+    return ("reverse", src)
+
+
+class Assembler:
+
+    NAMES = ("x", "y", "null", "isr", "osr", "pins", "pindirs", "pin", "gpio", "pc", "exec", "status",
+             "block", "noblock", "iffull", "ifempty",
+             "not_x", "x_dec", "not_y", "y_dec", "x_not_y", "not_osre")
+
+    def __init__(self, program):
+        self.program = program
+
+    def namespace(self):
+        ns = {"__builtins__": builtins, "invert": invert, "reverse": reverse}
+        for name in self.NAMES:
+            ns[name] = name
+        for name in ("wrap_target", "wrap", "label", "nop", "jmp", "wait", "in_", "push", "pull", "mov", "set"):
+            ns[name] = getattr(self, name)
+        for name in ("out", "irq", "word"):
+            ns[name] = self.unsupported(name)
+        return ns
+
+    def unsupported(self, name):
+        def instruction(*args, **kwargs):
+            raise NotImplementedError("%s is not supported by the simulator" % name)
+        return instruction
+
+    def emit(self, op, *args):
+        instruction = Instruction(op, args)
+        self.program.instructions.append(instruction)
+        return instruction
+
+    def wrap_target(self):
+        self.program.wrap_target = len(self.program.instructions)
+
+    def wrap(self):
+        self.program.wrap = len(self.program.instructions) - 1
+
+    def label(self, name):
+        self.program.labels[name] = len(self.program.instructions)
+
+    def nop(self):
+        return self.emit("mov", "y", "y")
+
+    def jmp(self, cond, target = None):
+        if target is None:
+            (cond, target) = (None, cond)
+        return self.emit("jmp", cond, target)
+
+    def wait(self, polarity, src, index):
+        return self.emit("wait", polarity, src, index)
+
+    def in_(self, src, bit_count):
+        return self.emit("in", src, bit_count)
+
+    def push(self, block = "block"):
+        return self.emit("push", block)
+
+    def pull(self, block = "block"):
+        return self.emit("pull", block)
+
+    def mov(self, dest, src):
+        return self.emit("mov", dest, src)
+
+    def set(self, dest, value):
+        return self.emit("set", dest, value)
+
+
+def asm_pio(**kwargs):
+    def decorator(fn):
+        program = Program(fn.__name__, kwargs)
+        types.FunctionType(fn.__code__, Assembler(program).namespace(), fn.__name__)()
+        if program.wrap is None:
+            program.wrap = len(program.instructions) - 1
+        return program
+    return decorator
+
+
+# State machines
+
+class StateMachine:
+
+    FIFO_DEPTH = 4
+
+    def __init__(self, id, program = None, freq = 125_000_000, in_base = None, jmp_pin = None, **kwargs):
+        self.id = id
+        self.program = program
+        self.fifo = []
+        self.tx_fifo = []
+        self.freq = freq
+        self.cycle_ns = 1000000000 // freq
+        self.in_base = pin_id(in_base)
+        self.jmp_pin = pin_id(jmp_pin)
+        # Values dropped by push(noblock) because the RX FIFO was full
+        self.rx_overflows = 0
+        self.cycles = 0
+        self.running = False
+        self.pc = 0
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.isr_count = 0
+        self.osr = 0
+        self.osr_count = 32
+        # Current level and the time it lasts until, for each pin
+        self.levels = {}
+        # Start of the current pass round a counting loop, see compile_jmp()
+        self.loop_pc = None
+        self.loop_t = 0
+        self.loop_x = 0
+        self.loop_y = 0
+        self.loop_edge = 0
+        self.generation = generation[0]
+        self.ops = None if program is None else self.compile(program)
+
+    def active(self, value = None):
+        if value is None:
+            return self.running
+        if value and not self.running:
+            self.t_ns = self.now_ns()
+        elif not value and self.running:
+            self.sync()
+        self.running = bool(value)
+
+    def rx_fifo(self):
+        self.sync()
+        return len(self.fifo)
+
+    def get(self):
+        self.sync()
+        return self.fifo.pop(0)
+
+    def put(self, value):
+        self.tx_fifo.append(value & 0xFFFFFFFF)
+
+    def push_rx(self, value):
+        # Values are dropped if the FIFO is full, as with push(noblock)
+        if len(self.fifo) < self.FIFO_DEPTH:
+            self.fifo.append(value)
+        else:
+            self.rx_overflows += 1
+
+    def now_ns(self):
+        if hasattr(time, "ticks_us"):
+            return time.ticks_us() * 1000
+        return 0
+
+    def driven(self):
+        return self.jmp_pin in waveforms or self.in_base in waveforms
+
+    def sync(self):
+        # Run the program up to the current time
+        if self.running and self.ops is not None and self.driven():
+            self.run_until(self.now_ns())
+
+    def run_until(self, end_ns):
+        if self.generation != generation[0]:
+            self.levels.clear()
+            self.generation = generation[0]
+        self.end_ns = end_ns
+        ops = self.ops
+        cycle_ns = self.cycle_ns
+        while self.t_ns < end_ns:
+            cycles = ops[self.pc](self)
+            self.t_ns += cycles * cycle_ns
+            self.cycles += cycles
+
+    def level(self, pin):
+        # Level of pin at the current time
+        t = self.t_ns // 1000
+        cached = self.levels.get(pin)
+        if cached is not None and cached[1] > t and cached[2] <= t:
+            return cached[0]
+        wave = waveforms.get(pin)
+        if wave is None:
+            return 0
+        (waveform, start) = wave
+        (level, until) = waveform.segment(t - start)
+        self.levels[pin] = (level, until + start, t)
+        return level
+
+    def next_edge_ns(self, pin):
+        # Earliest time the level of pin might change
+        self.level(pin)
+        cached = self.levels.get(pin)
+        if cached is None:
+            return NEVER
+        return cached[1] * 1000
+
+    # Compiling instructions to functions.  Each takes the state machine,
+    # updates pc, and returns the number of cycles taken.
+
+    def compile(self, program):
+        ops = []
+        for (i, instruction) in enumerate(program.instructions):
+            next_pc = program.wrap_target if i == program.wrap else i + 1
+            op = getattr(self, "compile_" + instruction.op)(program, next_pc, 1 + instruction.delay, *instruction.args)
+            if instruction.op != "jmp":
+                op = self.breaks_loop(op)
+            ops.append(op)
+        return ops
+
+    def breaks_loop(self, op):
+        def wrapped(sm):
+            sm.loop_pc = None
+            return op(sm)
+        return wrapped
+
+    def compile_jmp(self, program, next_pc, cycles, cond, target):
+        target = program.labels[target] if type(target) is str else target
+        condition = self.condition(cond)
+        if cond == "x_dec":
+            return self.counting_loop(target, next_pc, cycles, condition)
+        def op(sm):
+            sm.pc = target if condition(sm) else next_pc
+            return cycles
+        return op
+
+    def counting_loop(self, target, next_pc, cycles, condition):
+        # A jmp(x_dec) at the head of a loop made only of jmps, such as the
+        # timing loops in pwm.py, goes round the same way each time until x
+        # runs out or the jmp pin changes.  Once one pass has been seen with
+        # no edge during it, skip as many whole passes as can't reach either.
+        def op(sm):
+            pc = sm.pc
+            edge = sm.end_ns if sm.jmp_pin is None else min(sm.next_edge_ns(sm.jmp_pin), sm.end_ns)
+            if sm.loop_pc == pc and sm.loop_edge == edge and sm.x == (sm.loop_x - 1) & 0xFFFFFFFF and sm.y == sm.loop_y:
+                period = sm.t_ns - sm.loop_t
+                n = min(sm.x - 1, (edge - sm.t_ns) // period - 1)
+                if n > 0:
+                    sm.x -= n
+                    sm.t_ns += n * period
+                    sm.cycles += n * period // sm.cycle_ns
+            sm.loop_pc = pc
+            sm.loop_t = sm.t_ns
+            sm.loop_x = sm.x
+            sm.loop_y = sm.y
+            sm.loop_edge = edge
+            sm.pc = target if condition(sm) else next_pc
+            return cycles
+        return op
+
+    def condition(self, cond):
+        if cond is None:
+            return lambda sm: True
+        if cond == "not_x":
+            return lambda sm: sm.x == 0
+        if cond == "not_y":
+            return lambda sm: sm.y == 0
+        if cond == "x_not_y":
+            return lambda sm: sm.x != sm.y
+        if cond == "pin":
+            return lambda sm: sm.level(sm.jmp_pin) == 1
+        if cond == "not_osre":
+            return lambda sm: sm.osr_count < 32
+        if cond == "x_dec":
+            def x_dec(sm):
+                x = sm.x
+                sm.x = (x - 1) & 0xFFFFFFFF
+                return x != 0
+            return x_dec
+        if cond == "y_dec":
+            def y_dec(sm):
+                y = sm.y
+                sm.y = (y - 1) & 0xFFFFFFFF
+                return y != 0
+            return y_dec
+        raise ValueError("Unknown jmp condition %r" % (cond,))
+
+    def compile_wait(self, program, next_pc, cycles, polarity, src, index):
+        if src == "pin":
+            pin = None
+        elif src == "gpio":
+            pin = index
+        else:
+            raise NotImplementedError("wait on %s is not supported by the simulator" % src)
+        def op(sm):
+            p = sm.in_base + index if pin is None else pin
+            if sm.level(p) == polarity:
+                sm.pc = next_pc
+                return cycles
+            # Stalled, so skip straight to the next edge
+            edge = min(sm.next_edge_ns(p), sm.end_ns)
+            return max(1, -(-(edge - sm.t_ns) // sm.cycle_ns))
+        return op
+
+    def source(self, src):
+        if type(src) is tuple:
+            (operation, inner) = src
+            read = self.source(inner)
+            if operation == "invert":
+                return lambda sm: ~read(sm) & 0xFFFFFFFF
+            return lambda sm: int("{:032b}".format(read(sm))[::-1], 2)
+        if src in ("x", "y", "isr", "osr"):
+            return lambda sm: getattr(sm, src)
+        if src == "null" or src == "status":
+            return lambda sm: 0
+        if src == "pins":
+            return lambda sm: sm.level(sm.in_base)
+        if type(src) is int:
+            return lambda sm: src
+        raise NotImplementedError("%s source is not supported by the simulator" % (src,))
+
+    def compile_mov(self, program, next_pc, cycles, dest, src):
+        read = self.source(src)
+        if dest == "pc":
+            def op(sm):
+                sm.pc = read(sm) % len(sm.ops)
+                return cycles
+            return op
+        def op(sm):
+            v = read(sm)
+            if dest == "isr":
+                sm.isr_count = 0
+            elif dest == "osr":
+                sm.osr_count = 0
+            if dest in ("x", "y", "isr", "osr"):
+                setattr(sm, dest, v)
+            sm.pc = next_pc
+            return cycles
+        return op
+
+    def compile_set(self, program, next_pc, cycles, dest, value):
+        return self.compile_mov(program, next_pc, cycles, dest, value & 0x1F)
+
+    def compile_in(self, program, next_pc, cycles, src, bit_count):
+        read = self.source(src)
+        mask = (1 << bit_count) - 1
+        def op(sm):
+            sm.isr = ((sm.isr << bit_count) | (read(sm) & mask)) & 0xFFFFFFFF
+            sm.isr_count = min(32, sm.isr_count + bit_count)
+            sm.pc = next_pc
+            return cycles
+        return op
+
+    def compile_push(self, program, next_pc, cycles, block):
+        def op(sm):
+            if len(sm.fifo) >= sm.FIFO_DEPTH:
+                if block == "block":
+                    return 1
+                sm.rx_overflows += 1
+            else:
+                sm.fifo.append(sm.isr)
+            sm.isr = 0
+            sm.isr_count = 0
+            sm.pc = next_pc
+            return cycles
+        return op
+
+    def compile_pull(self, program, next_pc, cycles, block):
+        def op(sm):
+            if sm.tx_fifo:
+                sm.osr = sm.tx_fifo.pop(0)
+            elif block == "block":
+                return 1
+            else:
+                sm.osr = sm.x
+            sm.osr_count = 0
+            sm.pc = next_pc
+            return cycles
+        return op
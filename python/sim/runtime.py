@@ -0,0 +1,351 @@
+# Boots and runs the whole firmware under CPython on a virtual clock.
+#
+#   s = Simulation(config = {"pwm_mode": 1})
+#   receiver = s.pwm_receiver()
+#   receiver.set(1, 1500)
+#   s.boot()
+#   s.run(2000)
+#   receiver.set(1, 1900)
+#   s.run(500)
+#   s.duty(0)       # duty of the first light output, 0-0xFFFF
+#   s.close()
+#
+# Each simulation boots from freshly imported firmware modules, in its own
+# directory for config.json and laststate.txt, and the modules that were
+# loaded before are put back by close().  Time only passes in run(), which
+# goes as fast as the host allows.
+
+import dis
+import inspect
+import io
+import json
+import os
+import sys
+import tempfile
+
+import sim
+from sim import machine, rp2
+from sim.clock import VirtualClock
+from sim.srxl2bus import SRXL2Master
+from srxl2 import SRXL2Control
+
+
+def firmware_modules():
+    names = []
+    for f in os.listdir(sim.FIRMWARE_DIR):
+        if f.endswith(".py") and not f.endswith("_test.py") and f not in ("benchmark.py", "machine_mock.py"):
+            names.append(f[:-3])
+    return names
+
+
+# Bytecodes that allocate on MicroPython: containers, strings, closures,
+# slices and generators.  Ints up to 2**30 don't allocate there, so the ints
+# CPython makes aren't counted.  Floats, and objects made by builtins such as
+# list.append growing a list, aren't seen.
+ALLOC_OPS = frozenset(dis.opmap[name] for name in (
+    "BUILD_LIST", "BUILD_MAP", "BUILD_SET", "BUILD_CONST_KEY_MAP", "BUILD_TUPLE",
+    "BUILD_STRING", "BUILD_SLICE", "FORMAT_VALUE", "FORMAT_SIMPLE", "FORMAT_WITH_SPEC",
+    "MAKE_FUNCTION", "RETURN_GENERATOR") if name in dis.opmap)
+
+class AllocationCounter:
+
+    # Counts allocations made by the firmware's own code while installed as
+    # the trace function: each allocating bytecode run, each instance made,
+    # seen as a call to __init__, and each call packing *args.  Objects that are freed again within
+    # the run are counted too.
+
+    def __init__(self):
+        self.count = 0
+
+    def call(self, frame, event, arg):
+        code = frame.f_code
+        filename = code.co_filename
+        if os.path.dirname(filename) != sim.FIRMWARE_DIR or filename.endswith("_test.py"):
+            return None
+        if code.co_name == "__init__":
+            self.count += 1
+        # Extra positional arguments are packed into a tuple
+        if code.co_flags & inspect.CO_VARARGS and frame.f_locals[code.co_varnames[code.co_argcount + code.co_kwonlyargcount]]:
+            self.count += 1
+        frame.f_trace_lines = False
+        frame.f_trace_opcodes = True
+        return self.opcode
+
+    def opcode(self, frame, event, arg):
+        if event == "opcode" and frame.f_code.co_code[frame.f_lasti] in ALLOC_OPS:
+            self.count += 1
+        return self.opcode
+
+
+class PWMReceiver:
+
+    # A PWM receiver connected to the controller's inputs
+
+    PERIOD_US = 20000
+
+    def __init__(self, sim):
+        self.pins = sim.config_pins("INPUTS")
+
+    def set(self, input, width):
+        # Set the pulse width on an input, numbered from 1
+        rp2.drive(self.pins[input - 1], rp2.pwm_waveform(width, self.PERIOD_US))
+
+    def disconnect(self, input = None):
+        if input is None:
+            for pin in self.pins:
+                rp2.release(pin)
+        else:
+            rp2.release(self.pins[input - 1])
+
+
+class SRXL2Receiver:
+
+    # An SRXL2 receiver acting as bus master, with a Smart ESC attached
+
+    def __init__(self, sim, **kwargs):
+        self.sim = sim
+        self.pin = sim.config_pins("INPUTS")[0]
+        self.master = SRXL2Master(sim.clock, **kwargs)
+        self.connected = False
+        self.connect()
+
+    def connect(self):
+        # The UART reads from the bus, and signal detection sees its gaps
+        machine.uart_connector = self.master.connect
+        frame = bytes(SRXL2Control.build(self.master.channels))
+        gap = SRXL2Master.FRAME_PERIOD_US - len(frame) * 10 * 1000000 // 115200
+        rp2.drive(self.pin, rp2.uart_waveform(frame, gap_us = gap))
+        self.connected = True
+
+    def disconnect(self):
+        machine.uart_connector = machine.null_connector
+        if self.master.port is not None:
+            self.master.port.deinit()
+        rp2.release(self.pin)
+        self.connected = False
+
+    def set(self, channel, value):
+        # Set a channel, 0-0xFFFF with 0x8000 as centre
+        self.master.channels[channel] = value
+
+    def esc(self, **values):
+        # Set ESC telemetry fields, e.g. esc(rpm = 1000, volts_input = 1200)
+        if self.master.esc_telemetry is None:
+            self.master.esc_telemetry = {}
+        self.master.esc_telemetry.update(values)
+
+
+class Output:
+
+    # Collects what the firmware prints.  Unlike io.StringIO it never copies
+    # what it holds, so printing doesn't show up as a large allocation.
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class Simulation:
+
+    def __init__(self, board = "pdwrc_v2", config = None, laststate = None, directory = None, quiet = True):
+        self.board = board
+        self.config_data = config
+        self.laststate = laststate
+        self.directory = directory
+        self.quiet = quiet
+        self.clock = VirtualClock()
+        self.events = []
+        self.output = Output()
+        self.controller = None
+        self.scheduler = None
+        self.saved_modules = None
+        self.saved_cwd = None
+        self.saved_stdout = None
+        self.tmpdir = None
+        # {task name: [runs, allocations]} made by each scheduler task while
+        # measure_allocations is set, see allocated()
+        self.allocations = {}
+        self.measure_allocations = False
+        self.clock.install()
+        sim.install(board)
+        machine.reset_state()
+        rp2.release()
+
+    def config_pins(self, name):
+        return getattr(sys.modules["pins"].Pins, name)
+
+    def pwm_receiver(self):
+        return PWMReceiver(self)
+
+    def srxl2_receiver(self, **kwargs):
+        return SRXL2Receiver(self, **kwargs)
+
+    # Firmware state
+
+    def enter(self):
+        self.saved_cwd = os.getcwd()
+        os.chdir(self.directory)
+        if self.quiet:
+            self.saved_stdout = sys.stdout
+            sys.stdout = self.output
+
+    def leave(self):
+        os.chdir(self.saved_cwd)
+        if self.saved_stdout is not None:
+            sys.stdout = self.saved_stdout
+            self.saved_stdout = None
+
+    def boot(self):
+        # Imports the firmware and runs controller.setup()
+        if self.directory is None:
+            self.tmpdir = tempfile.TemporaryDirectory()
+            self.directory = self.tmpdir.name
+        if self.config_data is not None:
+            with open(os.path.join(self.directory, "config.json"), "w") as f:
+                json.dump(self.config_data, f)
+        if self.laststate is not None:
+            with open(os.path.join(self.directory, "laststate.txt"), "w") as f:
+                f.write("%d\n" % self.laststate)
+
+        self.saved_modules = {}
+        for name in firmware_modules():
+            if name in sys.modules:
+                self.saved_modules[name] = sys.modules.pop(name)
+        self.boot_start = self.clock.us
+        self.enter()
+        try:
+            import controller
+            self.controller = controller
+            self.scheduler = controller.setup()
+            for task in self.scheduler.tasks:
+                task.fn = self.measured(task.name, task.fn)
+        finally:
+            self.leave()
+        self.boot_us = self.clock.us - self.boot_start
+        return self
+
+    def measured(self, name, fn):
+        # Each run adds the allocations the firmware made during it, see
+        # AllocationCounter.  Tracing only while tasks run keeps the
+        # simulation itself fast.
+        counts = [0, 0]
+        self.allocations[name] = counts
+        counter = AllocationCounter()
+        def run():
+            if not self.measure_allocations:
+                return fn()
+            counter.count = 0
+            sys.settrace(counter.call)
+            try:
+                fn()
+            finally:
+                sys.settrace(None)
+            counts[0] += 1
+            counts[1] += counter.count
+        return run
+
+    def allocated(self, name):
+        # Average allocations made by each run of a scheduler task, see
+        # AllocationCounter
+        (runs, allocated) = self.allocations[name]
+        return allocated / runs if runs else 0
+
+    def close(self):
+        for name in firmware_modules():
+            sys.modules.pop(name, None)
+        if self.saved_modules is not None:
+            sys.modules.update(self.saved_modules)
+            self.saved_modules = None
+        machine.reset_state()
+        rp2.release()
+        self.clock.uninstall()
+        if self.tmpdir is not None:
+            self.tmpdir.cleanup()
+            self.tmpdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Running
+
+    @property
+    def ms(self):
+        return self.clock.us // 1000
+
+    def at(self, t_ms, fn):
+        # Call fn when the clock reaches t_ms during run()
+        self.events.append((t_ms * 1000, fn))
+        self.events.sort(key = lambda e: e[0])
+
+    def run(self, ms):
+        end = self.clock.us + ms * 1000
+        self.enter()
+        try:
+            while self.clock.us < end:
+                while self.events and self.events[0][0] <= self.clock.us:
+                    self.events.pop(0)[1]()
+                wait = self.scheduler.run_once()
+                step = min(max(1, wait), end - self.clock.us)
+                if self.events:
+                    step = max(1, min(step, self.events[0][0] - self.clock.us))
+                self.clock.advance(step)
+        finally:
+            self.leave()
+
+    def command(self, s):
+        # Runs a CLI command, returning what it printed
+        out = io.StringIO()
+        self.enter()
+        saved = sys.stdout
+        sys.stdout = out
+        try:
+            self.controller.console.do_command(s)
+        finally:
+            sys.stdout = saved
+            self.leave()
+        return out.getvalue()
+
+    def press_button(self, ms = 100):
+        # Presses the hardware button for ms
+        pin = self.config_pins("BUTTON")
+        machine.levels[pin] = 1
+        self.at(self.ms + ms, lambda: machine.levels.__setitem__(pin, 0))
+
+    def set_adc(self, pin, reading):
+        machine.ADC.values[pin] = reading
+
+    # Output
+
+    def output_pins(self, n):
+        pins = self.config_pins("OUTPUTS")[n]
+        return pins if type(pins) in (list, tuple) else (pins,)
+
+    def duty(self, n):
+        # Current duty of light output n
+        return machine.timeline.duty(self.output_pins(n)[0])
+
+    def status_led(self):
+        return machine.timeline.duty(self.config_pins("STATUS_LEDS")[0])
+
+    def timeline(self, n, start_ms = 0, end_ms = None):
+        # [(t_ms, duty)] for light output n
+        if end_ms is None:
+            end_ms = self.ms + 1
+        changes = machine.timeline.between(self.output_pins(n)[0], start_ms * 1000, end_ms * 1000)
+        return [(t / 1000, d) for (t, d) in changes]
+
+    @property
+    def log(self):
+        return self.output.getvalue().splitlines()
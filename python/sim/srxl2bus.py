@@ -0,0 +1,118 @@
+# Emulation of an SRXL2 bus, as seen through the controller's UART.
+#
+# SRXL2Master plays the part of a receiver acting as bus master, with a Smart
+# ESC attached.  It polls each device ID with a handshake, then broadcasts
+# the baud rate for the bus: 400000 if it and every device that replied
+# support it, otherwise 115200.  It then sends a control frame every 11ms,
+# each followed by a telemetry packet from the ESC if esc_telemetry is set.
+#
+# Use connect() as SRXL2Driver.open_uart, so the driver's UART is a port on
+# the emulated bus.  Bytes sent while the port is at a different baud rate
+# to the bus arrive as garbage.
+
+from srxl2 import SRXL2, SRXL2Control, SRXL2Handshake, SRXL2Telemetry
+
+
+class SRXL2Port:
+
+    def __init__(self, master, baudrate):
+        self.master = master
+        self.baudrate = baudrate
+        self.rx = bytearray()
+
+    def any(self):
+        self.master.step()
+        return len(self.rx)
+
+    def readinto(self, buf, nbytes = None):
+        n = min(len(self.rx), len(buf))
+        if nbytes is not None:
+            n = min(n, nbytes)
+        if n == 0:
+            return None
+        buf[0:n] = self.rx[0:n]
+        del self.rx[0:n]
+        return n
+
+    def write(self, data):
+        self.master.receive(self, bytes(data))
+        return len(data)
+
+    def deinit(self):
+        if self.master.port is self:
+            self.master.port = None
+
+
+class SRXL2Master:
+
+    RECEIVER_ID = 0x21
+    ESC_ID = 0x40
+
+    POLL_PERIOD_US = 1000
+    FRAME_PERIOD_US = 11000
+
+    def __init__(self, clock, device_ids = (ESC_ID,), high_baud = True, esc_high_baud = True):
+        self.clock = clock
+        self.device_ids = device_ids
+        self.high_baud = high_baud
+        self.esc_high_baud = esc_high_baud
+        self.channels = {1: 0x8000, 4: 0x8000}
+        # ESC telemetry values, as {field: value}, or None to send none
+        self.esc_telemetry = None
+        self.parser = SRXL2()
+        self.port = None
+        self.frames_sent = 0
+        self.restart()
+
+    def restart(self):
+        # Master starts, or restarts after losing a device, at 115200
+        self.baudrate = 115200
+        self.replies = {}
+        self.stage = 0
+        self.next_t = self.clock.ticks_us()
+
+    def connect(self, baudrate):
+        self.port = SRXL2Port(self, baudrate)
+        return self.port
+
+    def send(self, data):
+        if self.port is None:
+            return
+        if self.port.baudrate == self.baudrate:
+            self.port.rx += data
+        else:
+            self.port.rx += bytes(len(data))
+
+    def receive(self, port, data):
+        if port.baudrate != self.baudrate:
+            return
+        packet = self.parser.parse(data)
+        if type(packet) == SRXL2Handshake and packet.dest_id == self.RECEIVER_ID:
+            self.replies[packet.src_id] = packet.baud_supported
+
+    def handshake(self, src_id, dest_id, high_baud):
+        baud = SRXL2Handshake.BAUD_400000 if high_baud else SRXL2Handshake.BAUD_115200
+        return SRXL2Handshake.build(src_id, dest_id, baud)
+
+    def step(self):
+        while self.clock.ticks_us() >= self.next_t:
+            if self.stage < len(self.device_ids):
+                dest = self.device_ids[self.stage]
+                self.send(self.handshake(self.RECEIVER_ID, dest, self.high_baud))
+                if dest == self.ESC_ID:
+                    self.replies[dest] = int(self.esc_high_baud)
+                    self.send(self.handshake(dest, self.RECEIVER_ID, self.esc_high_baud))
+                self.stage += 1
+                self.next_t += self.POLL_PERIOD_US
+            elif self.stage == len(self.device_ids):
+                high = self.high_baud and all(b & SRXL2Handshake.BAUD_400000 for b in self.replies.values())
+                self.send(self.handshake(self.RECEIVER_ID, SRXL2Handshake.BROADCAST, high))
+                self.baudrate = 400000 if high else 115200
+                self.stage += 1
+                self.next_t += self.POLL_PERIOD_US
+            else:
+                self.send(SRXL2Control.build(self.channels))
+                self.frames_sent += 1
+                if self.esc_telemetry is not None:
+                    self.send(SRXL2Telemetry.build(SRXL2Telemetry.DEVICE_ESC, self.esc_telemetry, dest_id = self.RECEIVER_ID))
+                self.next_t += self.FRAME_PERIOD_US
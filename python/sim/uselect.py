@@ -0,0 +1,18 @@
+# Stand-in for MicroPython's uselect.  Nothing is ever ready to read.
+
+POLLIN = 1
+
+class poll:
+
+    def register(self, obj, eventmask = POLLIN):
+        pass
+
+    def poll(self, timeout = -1):
+        return []
+
+    def ipoll(self, timeout = -1, flags = 0):
+        # Exhausted already, so it can be returned every time without
+        # allocating
+        return NOTHING
+
+NOTHING = iter(())
@@ -1,36 +1,87 @@
 import struct
+from array import array
+from channelframe import ChannelFrame
+
+try:
+    import micropython
+except ImportError:
+    class micropython:
+        def native(f):
+            return f
+
+def crc_table():
+    table = array('H', (0 for i in range(256)))
+    for i in range(256):
+        crc = i << 8
+        for b in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[i] = crc
+    return table
+
+CRC_TABLE = crc_table()
+
+# CRC-16-CCITT (XMODEM) over the first length bytes of data, as used by SRXL2
+@micropython.native
+def crc16(data, length):
+    table = CRC_TABLE
+    crc = 0
+    for i in range(length):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ data[i]]
+    return crc
 
 class SRXL2InvalidPacketException(Exception):
     pass
 
-class SRXL2Packet:
+# Decoder for one entry in a packet's _struct_maps_, compiled once by
+# SRXL2Packet.setup() so that decoding a packet only unpacks and assigns.
+class SRXL2Decoder:
 
-    def __init__(self, packet):
-        self.length = packet[2]
+    def __init__(self, endian, fields):
+        self.fmt = endian + ''.join(fmt_s for name, fmt_s, mult in fields)
+        self.size = struct.calcsize(self.fmt)
+        self.plain = tuple((i, name) for i, (name, fmt_s, mult) in enumerate(fields) if mult == 1)
+        self.scaled = tuple((i, name, mult) for i, (name, fmt_s, mult) in enumerate(fields) if mult != 1)
+
+    def decode(self, obj, data, offset = 0):
+        if len(data) - offset < self.size:
+            raise SRXL2InvalidPacketException("Short packet")
+        fields = struct.unpack_from(self.fmt, data, offset)
+        for (i, name) in self.plain:
+            setattr(obj, name, fields[i])
+        for (i, name, mult) in self.scaled:
+            setattr(obj, name, fields[i] * mult)
+        return fields
 
-        self.process_struct('fields', packet[3:])
 
+class SRXL2Packet:
 
-    def process_struct(self, name, data):
+    __slots__ = ('length',)
 
-        fmt = self._structs_[name]
-        if len(data) < struct.calcsize(fmt):
-            raise SRXL2InvalidPacketException("Short packet")
-        fields = struct.unpack(fmt, data[0:struct.calcsize(fmt)])
-        for i, (name, fmt, mult) in enumerate(self._struct_maps_[name][1]):
-            if mult != 1:
-                setattr(self, name, fields[i] * mult)
-            else:
-                setattr(self, name, fields[i])
+    def __init__(self, packet = None):
+        if packet is not None:
+            self.decode(packet)
 
+    def decode(self, packet):
+        self.length = packet[2]
+        self._decoders_['fields'].decode(self, packet, 3)
+
+    def process_struct(self, name, data, offset = 0):
+        return self._decoders_[name].decode(self, data, offset)
 
     @classmethod
     def setup(cls):
-        cls._structs_ = {}
+        cls._decoders_ = {}
         for name, (endian, fields) in cls._struct_maps_.items():
-            fmt = ''.join(fmt_s for name, fmt_s, mult in fields)
-            cls._structs_[name] = endian + fmt
-        cls._header_size_ = struct.calcsize(cls._structs_['fields']) + 2
+            cls._decoders_[name] = SRXL2Decoder(endian, fields)
+        cls._header_size_ = cls._decoders_['fields'].size + 2
+        # Instances reused by parsers created with reuse = True.  Packets are
+        # decoded into the spare one, which only replaces the instance once
+        # it has decoded, so a bad packet can't half overwrite a good one.
+        cls._instance_ = cls()
+        cls._spare_ = cls()
 
 class SRXL2Control(SRXL2Packet):
 
@@ -44,24 +95,67 @@ class SRXL2Control(SRXL2Packet):
             ))
         }
 
-    def __init__(self, packet):
+    __slots__ = ('command', 'reply_id', 'rssi', 'frame_losses', 'channel_mask', 'channel_data', 'pwm_channel_data')
+
+    # channel_mask -> (struct format, size, channel numbers)
+    _channel_formats_ = {}
+    MAX_CHANNEL_FORMATS = 16
+
+    def __init__(self, packet = None):
+        self.channel_data = ChannelFrame()
+        self.pwm_channel_data = ChannelFrame()
         super().__init__(packet)
-        self.channel_data = {}
-        self.pwm_channel_data = {}
-        i = self._header_size_ + 1
 
+    @classmethod
+    def channel_format(cls, mask):
+        f = cls._channel_formats_.get(mask)
+        if f is None:
+            channels = tuple(n + 1 for n in range(32) if 1 << n & mask)
+            fmt = '<%dH' % len(channels)
+            f = (fmt, struct.calcsize(fmt), channels)
+            # Receivers send the same mask in every frame, so the cache only
+            # grows if the mask is corrupt.
+            if len(cls._channel_formats_) >= cls.MAX_CHANNEL_FORMATS:
+                cls._channel_formats_.clear()
+            cls._channel_formats_[mask] = f
+        return f
+
+    def decode(self, packet):
+        super().decode(packet)
 
         if self.command != 0:
-            return 
+            self.channel_data.set_channels(0, ())
+            self.pwm_channel_data.set_channels(0, ())
+            return
 
-        for n in range(32):
-            if 1 << n & self.channel_mask:
-                if len(packet) < i + 2:
-                    raise SRXL2InvalidPacketException("Short packet")
-                self.channel_data[n+1] = struct.unpack('<H', packet[i:i+2])[0]
-                self.pwm_channel_data[n+1] = int(1000 + (1000*self.channel_data[n+1]/0xFFFF))
-                i += 2
-        #print(self.channel_data)
+        (fmt, size, channels) = self.channel_format(self.channel_mask)
+        i = self._header_size_ + 1
+        if len(packet) < i + size:
+            raise SRXL2InvalidPacketException("Short packet")
+        values = struct.unpack_from(fmt, packet, i)
+
+        raw = self.channel_data.values
+        pwm = self.pwm_channel_data.values
+        for n in range(len(channels)):
+            ch = channels[n]
+            v = values[n]
+            raw[ch] = v
+            pwm[ch] = 1000 + (1000 * v) // 0xFFFF
+        self.channel_data.set_channels(self.channel_mask, channels)
+        self.pwm_channel_data.set_channels(self.channel_mask, channels)
+
+    def build(channels, rssi = 0, frame_losses = 0):
+        # channels is a dict of {channel: value}
+        mask = 0
+        for ch in channels:
+            mask |= 1 << (ch - 1)
+        packet = bytearray(struct.pack('<BBBBBBHL', 0xA6, 0xCD, 0, 0, 0, rssi, frame_losses, mask))
+        for ch in sorted(channels):
+            packet += struct.pack('<H', channels[ch])
+        packet[2] = len(packet) + 2
+        crc = crc16(packet, len(packet))
+        packet += bytes((crc >> 8, crc & 0xFF))
+        return packet
 
     def __repr__(self):
         s = '[CTL] %d' % self.channel_mask
@@ -70,18 +164,53 @@ class SRXL2Control(SRXL2Packet):
         return s
 
 
+# Descriptor for one field of a telemetry payload.  The field is unpacked when
+# it is first read, and the value is kept until the packet is next decoded.
+class TelemetryField:
+
+    def __init__(self, device, index, fmt, offset, mult):
+        self.device = device
+        self.bit = 1 << index
+        self.index = index
+        self.fmt = fmt
+        self.offset = offset
+        self.mult = mult
+
+    def __get__(self, obj, owner = None):
+        if obj is None:
+            return self
+        if obj.device != self.device:
+            raise AttributeError("Not available for device %d" % obj.device)
+        if obj._decoded & self.bit:
+            return obj._values[self.index]
+        v = struct.unpack_from(self.fmt, obj.payload, self.offset)[0]
+        if self.mult != 1:
+            v = v * self.mult
+        values = obj._values
+        if self.index >= len(values):
+            # Device registered after this packet was made
+            values.extend([None] * (self.index + 1 - len(values)))
+        values[self.index] = v
+        obj._decoded |= self.bit
+        return v
+
+
 class SRXL2Telemetry(SRXL2Packet):
 
     DEVICE_ESC = 0x20 
+    PAYLOAD_SIZE = 14
 
     _struct_maps_ = {
         'fields': ('<', (
             ('dest_id', 'B', 1),
             ('device', 'B', 1),
             ('s_id', 'B', 1),
-            ('telemetry', '14s', 1),
             )),
+    }
 
+    # Payload layout for each device type.  Fields become TelemetryField
+    # descriptors on this class, so adding a device adds no per-packet cost.
+    _devices_ = {
         DEVICE_ESC: ('>', (
             ('rpm', 'H', 10),
             ('volts_input', 'H', 1),
@@ -95,13 +224,77 @@ class SRXL2Telemetry(SRXL2Packet):
         ))
     }
 
+    _field_count_ = 0
 
-    def __init__(self, packet):
+    __slots__ = ('dest_id', 'device', 's_id', 'buf', 'payload', '_values', '_decoded')
+
+    def __init__(self, packet = None):
+        # The payload is copied into a buffer owned by the packet, as the
+        # packet it came from may be overwritten before the fields are read.
+        self.buf = bytearray(self.PAYLOAD_SIZE)
+        self.payload = memoryview(self.buf)
+        self._values = [None] * self._field_count_
+        self._decoded = 0
         super().__init__(packet)
-        if self.device in self._struct_maps_:
-            self.process_struct(self.device, self.telemetry)
+
+    @classmethod
+    def register_device(cls, device, struct_map):
+        (endian, fields) = struct_map
+        offset = 0
+        for (name, fmt_s, mult) in fields:
+            fmt = endian + fmt_s
+            setattr(cls, name, TelemetryField(device, cls._field_count_, fmt, offset, mult))
+            cls._field_count_ += 1
+            offset += struct.calcsize(fmt)
+        cls._devices_[device] = struct_map
+
+    @classmethod
+    def setup(cls):
+        for device, struct_map in cls._devices_.items():
+            cls.register_device(device, struct_map)
+        super().setup()
+
+    def decode(self, packet):
+        super().decode(packet)
+        start = self._header_size_ + 1
+        if len(packet) < start + self.PAYLOAD_SIZE:
+            raise SRXL2InvalidPacketException("Short packet")
+        self.buf[0:self.PAYLOAD_SIZE] = packet[start:start + self.PAYLOAD_SIZE]
+        self._decoded = 0
+
+    def build(device, values, dest_id = 0, s_id = 0):
+        # values is a dict of {field: value} for the device's payload fields
+        cls = SRXL2Telemetry
+        (endian, fields) = cls._devices_[device]
+        packet = bytearray(struct.pack('<BBBBBB', 0xA6, 0x80, 0, dest_id, device, s_id))
+        payload = bytearray(cls.PAYLOAD_SIZE)
+        offset = 0
+        for (name, fmt, mult) in fields:
+            raw = int(round(values.get(name, 0) / mult))
+            struct.pack_into(endian + fmt, payload, offset, raw)
+            offset += struct.calcsize(endian + fmt)
+        packet += payload
+        packet[2] = len(packet) + 2
+        crc = crc16(packet, len(packet))
+        packet += bytes((crc >> 8, crc & 0xFF))
+        return packet
+
+    def copy(self, other):
+        # Copy another packet's header fields and payload
+        self.length = other.length
+        self.dest_id = other.dest_id
+        self.device = other.device
+        self.s_id = other.s_id
+        self.buf[0:self.PAYLOAD_SIZE] = other.buf
+        self._decoded = 0
+
+    @property
+    def telemetry(self):
+        return bytes(self.buf)
 
     def __repr__(self):
+        if not self.is_esc_telemetry:
+            return "[TELEMETRY] device %d" % self.device
         s = "[ESC] "
         s += "MOTOR: %5dRPM %3.2fA  IN: %2.1fV  FET: %2.1f°C " % (self.rpm, self.current_motor/1000, self.volts_input/100, self.temp_fet)
         s += "BEC: %2.1f°C  " % (self.temp_bec)
@@ -115,7 +308,44 @@ class SRXL2Telemetry(SRXL2Packet):
         return self.device == self.DEVICE_ESC
 
 
-for cls in (SRXL2Control, SRXL2Telemetry):
+class SRXL2Handshake(SRXL2Packet):
+
+    PACKET_TYPE = 0x21
+    BROADCAST = 0xFF
+
+    # Values of baud_supported
+    BAUD_115200 = 0
+    BAUD_400000 = 1
+
+    _struct_maps_ = {
+        'fields': ('<', (
+            ('src_id', 'B', 1),
+            ('dest_id', 'B', 1),
+            ('priority', 'B', 1),
+            ('baud_supported', 'B', 1),
+            ('info', 'B', 1),
+            ('uid', 'L', 1),
+            )),
+    }
+
+    __slots__ = ('src_id', 'dest_id', 'priority', 'baud_supported', 'info', 'uid')
+
+    def build(src_id, dest_id, baud_supported, priority = 10, info = 0, uid = 0):
+        packet = bytearray(struct.pack('<BBBBBBBBL', 0xA6, SRXL2Handshake.PACKET_TYPE, 14,
+                src_id, dest_id, priority, baud_supported, info, uid))
+        crc = crc16(packet, len(packet))
+        packet += bytes((crc >> 8, crc & 0xFF))
+        return packet
+
+    @property
+    def is_broadcast(self):
+        return self.dest_id == self.BROADCAST
+
+    def __repr__(self):
+        return "[HANDSHAKE] %02x -> %02x baud %d" % (self.src_id, self.dest_id, self.baud_supported)
+
+
+for cls in (SRXL2Control, SRXL2Telemetry, SRXL2Handshake):
     cls.setup()
 
 class SRXL2:
@@ -123,20 +353,141 @@ class SRXL2:
     PACKET_TYPES = {
         0xCD: SRXL2Control,
         0x80: SRXL2Telemetry,
+        0x21: SRXL2Handshake,
         }
 
+    def __init__(self, reuse = False, check_crc = True):
+        # If reuse is set, each packet type is decoded into one of two
+        # preallocated instances in turn, so a packet returned by parse() is
+        # only valid until the next packet of the same type is parsed.  It is
+        # left untouched by a packet that fails to decode.
+        self.reuse = reuse
+        self.check_crc = check_crc
+        self.crc_errors = 0
+        self.invalid_packets = 0
+        self.unknown_packets = 0
+
     def parse(self, packet):
         if len(packet) < 3:
             return None
-        (mfr_id, packet_type, length) = struct.unpack("BBB", packet[0:3])
+        mfr_id = packet[0]
+        packet_type = packet[1]
+        length = packet[2]
         if mfr_id != 0xA6 or packet_type not in self.PACKET_TYPES:
+            self.unknown_packets += 1
             print("Unkown packet: %d %d" %(mfr_id, packet_type))
             return None
 
+        if len(packet) < length or length < 5:
+            self.invalid_packets += 1
+            print("Invalid packet")
+            return None
+
+        # CRC is the last two bytes, MSB first
+        if self.check_crc and crc16(packet, length - 2) != (packet[length - 2] << 8 | packet[length - 1]):
+            self.crc_errors += 1
+            return None
+
         try:
-            return self.PACKET_TYPES[packet_type](packet)
+            cls = self.PACKET_TYPES[packet_type]
+            if self.reuse:
+                p = cls._spare_
+                p.decode(packet)
+                cls._spare_ = cls._instance_
+                cls._instance_ = p
+                return p
+            return cls(packet)
         except SRXL2InvalidPacketException as e:
+            self.invalid_packets += 1
             print("Invalid packet")
         return None
 
 
+# Splits a stream of SRXL2 bytes into packets.
+#
+# Bytes are read straight into a fixed, preallocated buffer and complete
+# packets are returned as memoryviews into it, so no copies are made.  The
+# unparsed tail is moved back to the start of the buffer when the free space
+# gets too small for a packet, which keeps every packet contiguous.  Any bytes
+# that can't be the start of a packet are skipped until the next 0xA6 header.
+class SRXL2Framer:
+
+    HEADER = 0xA6
+    MIN_PACKET = 5      # header + CRC
+    MAX_PACKET = 80
+
+    def __init__(self, size = 256):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.head = 0
+        self.tail = 0
+        # Count of bytes skipped while looking for a header
+        self.skipped = 0
+        # Count of headers whose packet failed the CRC
+        self.crc_errors = 0
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+
+    @property
+    def pending(self):
+        return self.tail - self.head
+
+    def compact(self):
+        n = self.tail - self.head
+        if n > 0 and self.head > 0:
+            self.mv[0:n] = self.mv[self.head:self.tail]
+        self.head = 0
+        self.tail = n
+
+    def write_buffer(self):
+        # Returns a view of the free space.  Call commit() with the number of
+        # bytes written into it.
+        if len(self.buf) - self.tail < self.MAX_PACKET:
+            self.compact()
+        return self.mv[self.tail:]
+
+    def commit(self, n):
+        self.tail += n
+
+    def feed(self, data):
+        # Copy data into the buffer.  Returns the number of bytes accepted.
+        # Used when the bytes have already been read into another buffer.
+        if len(self.buf) - self.tail < self.MAX_PACKET:
+            self.compact()
+        n = min(len(data), len(self.buf) - self.tail)
+        if n == len(data):
+            self.buf[self.tail:self.tail + n] = data
+        else:
+            self.buf[self.tail:self.tail + n] = data[0:n]
+        self.tail += n
+        return n
+
+    def next_packet(self):
+        # Returns a view of the next complete packet with a valid CRC, or None
+        # if there isn't one yet.  The view is only valid until the buffer is
+        # next written.
+        buf = self.buf
+        h = self.head
+        tail = self.tail
+        (header, min_packet, max_packet) = (self.HEADER, self.MIN_PACKET, self.MAX_PACKET)
+        while tail - h >= 3:
+            length = buf[h + 2]
+            if buf[h] != header or length < min_packet or length > max_packet:
+                h += 1
+                self.skipped += 1
+                continue
+            if tail - h < length:
+                break
+            # A stray header byte can claim a length that spans the real
+            # packet, so on a bad CRC look for a header from the next byte
+            packet = self.mv[h:h + length]
+            if crc16(packet, length - 2) != (buf[h + length - 2] << 8 | buf[h + length - 1]):
+                h += 1
+                self.crc_errors += 1
+                continue
+            self.head = h + length
+            return packet
+        self.head = h
+        return None
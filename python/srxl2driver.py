@@ -1,41 +1,219 @@
-from srxl2 import SRXL2, SRXL2Control, SRXL2Telemetry
-from machine import UART, Pin
+from srxl2 import SRXL2, SRXL2Control, SRXL2Telemetry, SRXL2Handshake, SRXL2Framer
+try:
+    from machine import UART, Pin
+except ImportError:
+    from machine_mock import UART, Pin
 import time
+from capture import KIND_UART
 
 class SRXL2Driver:
-    def __init__(self, pin, control_callback, telemetry_callback):
+
+    # A gap this long means the bus is idle, so any partial packet left in
+    # the buffer will never be completed.
+    IDLE_RESET_US = 100
+
+    # Period over which rates in stats() are calculated
+    RATE_PERIOD_MS = 1000
+
+    CAPTURE_KIND = KIND_UART
+
+    BAUD_DEFAULT = 115200
+    BAUD_HIGH = 400000
+
+    # If no valid packet is seen for this long, try the other baud rate.  The
+    # bus master drops back to 115200 if it loses a device, and we may have
+    # missed the handshake that moved the bus to 400000.
+    BAUD_TIMEOUT_MS = 500
+
+    # has_signal() is False once no valid packet has been seen for this
+    # long, at either baud rate.
+    SIGNAL_TIMEOUT_MS = 1200
+
+    def __init__(self, pin, control_callback, telemetry_callback, device_id = None, allow_high_baud = True, uid = 0):
         self.pin = Pin(pin, Pin.IN)
         self.control_callback = control_callback
         self.telemetry_callback = telemetry_callback
+        # CaptureWriter to record raw input to
+        self.capture = None
+        # If device_id is set, reply to handshakes from the bus master for
+        # that ID.  Otherwise we only listen, and follow whatever baud rate
+        # the master sets.
+        self.device_id = device_id
+        self.allow_high_baud = allow_high_baud
+        self.uid = uid
+
+    def open_uart(self, baudrate):
+        return UART(1, baudrate = baudrate, tx=Pin(8), rx=self.pin, bits=8, parity=None, invert = UART.INV_RX)
 
     def start(self):
-        self.u = UART(1, baudrate = 115200, tx=Pin(8), rx=self.pin, bits=8, parity=None, invert = UART.INV_RX)
-        self.rx = bytes()
-        self.srxl2 = SRXL2()
+        self.framer = SRXL2Framer()
+        # The framer checks the CRC
+        self.srxl2 = SRXL2(reuse = True, check_crc = False)
+        # Last ESC telemetry packet in a batch, copied out of the parser's
+        # reused instances as other telemetry packets may follow it
+        self.esc_telemetry = SRXL2Telemetry()
+        self.baudrate = None
+        self.baud_switches = 0
+        self.set_baudrate(self.BAUD_DEFAULT)
+        self.lastt = time.ticks_us()
+        # Allow the first packet the same time to arrive
+        self.last_valid = time.ticks_ms()
+        self.reset_stats()
+
+    def stop(self):
+        self.u.deinit()
+
+    def pending(self):
+        # True if there is input waiting to be processed
+        return self.u.any() > 0
+
+    def has_signal(self):
+        return time.ticks_diff(time.ticks_ms(), self.last_valid) <= self.SIGNAL_TIMEOUT_MS
+
+    def set_baudrate(self, baudrate):
+        if baudrate != self.baudrate:
+            if self.baudrate is not None:
+                self.baud_switches += 1
+                print("LOG SRXL2 switching to %d baud" % baudrate)
+            self.baudrate = baudrate
+            self.u = self.open_uart(baudrate)
+            self.framer.reset()
+        self.last_packet = time.ticks_ms()
+
+    def handle_handshake(self, packet):
+        if packet.is_broadcast:
+            # Master has finished the handshake and set the bus rate
+            if packet.baud_supported & SRXL2Handshake.BAUD_400000 and self.allow_high_baud:
+                self.set_baudrate(self.BAUD_HIGH)
+            else:
+                self.set_baudrate(self.BAUD_DEFAULT)
+        elif self.device_id is not None and packet.dest_id == self.device_id:
+            baud = SRXL2Handshake.BAUD_400000 if self.allow_high_baud else SRXL2Handshake.BAUD_115200
+            self.u.write(SRXL2Handshake.build(self.device_id, packet.src_id, baud, uid = self.uid))
+
+    def reset_stats(self):
+        self.bytes_received = 0
+        self.frames = 0
+        self.control_frames = 0
+        self.telemetry_frames = 0
+        self.dropped_control = 0
+        self.idle_resets = 0
+        self.rssi = None
+        self.frame_losses = None
+        self.srxl2.invalid_packets = 0
+        self.srxl2.unknown_packets = 0
+        self.framer.skipped = 0
+        self.framer.crc_errors = 0
+
+        # Longest gap between calls to process() in the current rate period
+        self.last_process = time.ticks_us()
+        self.max_process_gap = 0
+
+        self.rate_start = time.ticks_ms()
+        self.rate_snapshot = (0, 0, 0)
+        self.rates = None
+
+    def errors(self):
+        return self.framer.crc_errors + self.srxl2.invalid_packets + self.srxl2.unknown_packets
+
+    def update_rates(self, now):
+        elapsed = time.ticks_diff(now, self.rate_start)
+        if elapsed < self.RATE_PERIOD_MS:
+            return
+        counts = (self.bytes_received, self.frames, self.errors())
+        self.rates = {
+            "bytes_per_s": (counts[0] - self.rate_snapshot[0]) * 1000 // elapsed,
+            "frames_per_s": (counts[1] - self.rate_snapshot[1]) * 1000 // elapsed,
+            "errors_per_s": (counts[2] - self.rate_snapshot[2]) * 1000 // elapsed,
+            "max_process_gap_us": self.max_process_gap,
+        }
+        self.rate_snapshot = counts
+        self.rate_start = now
+        self.max_process_gap = 0
+
+    def stats(self):
+        return {
+            "bytes": self.bytes_received,
+            "frames": self.frames,
+            "control": self.control_frames,
+            "telemetry": self.telemetry_frames,
+            "dropped_control": self.dropped_control,
+            "crc_errors": self.framer.crc_errors,
+            "invalid": self.srxl2.invalid_packets,
+            "unknown": self.srxl2.unknown_packets,
+            "skipped_bytes": self.framer.skipped,
+            "idle_resets": self.idle_resets,
+            "baudrate": self.baudrate,
+            "baud_switches": self.baud_switches,
+            "rssi": self.rssi,
+            "frame_losses": self.frame_losses,
+            "rates": self.rates,
+        }
 
     def process(self):
 
         telemetry_packet = None
         control_packet = None
+        framer = self.framer
+
+        now = time.ticks_us()
+        gap = time.ticks_diff(now, self.last_process)
+        if gap > self.max_process_gap:
+            self.max_process_gap = gap
+        self.last_process = now
 
-        while self.u.any() > 0:
-            self.rx += self.u.read()
-            if len(self.rx) > 2 and len(self.rx) >= self.rx[2]:
-                packet = self.srxl2.parse(self.rx)
-                if type(packet) == SRXL2Control:
+        n = self.u.any()
+        while n > 0:
+            buf = framer.write_buffer()
+            n = self.u.readinto(buf, min(n, len(buf)))
+            if n:
+                if self.capture is not None:
+                    self.capture.uart(buf[0:n])
+                framer.commit(n)
+                self.bytes_received += n
+            data = framer.next_packet()
+            while data is not None:
+                packet = self.srxl2.parse(data)
+                if packet is not None:
+                    self.frames += 1
+                    self.last_packet = time.ticks_ms()
+                    self.last_valid = self.last_packet
+                if type(packet) == SRXL2Handshake:
+                    self.handle_handshake(packet)
+                elif type(packet) == SRXL2Control:
+                    self.control_frames += 1
+                    if control_packet is not None:
+                        self.dropped_control += 1
                     control_packet = packet
-                elif type(packet) == SRXL2Telemetry and packet.is_esc_telemetry:
-                    telemetry_packet = packet
-                self.rx = self.rx[self.rx[2]:]
+                elif type(packet) == SRXL2Telemetry:
+                    self.telemetry_frames += 1
+                    if packet.is_esc_telemetry:
+                        telemetry_packet = self.esc_telemetry
+                        telemetry_packet.copy(packet)
+                data = framer.next_packet()
             self.lastt = time.ticks_us()
+            n = self.u.any()
 
-        if telemetry_packet is not None or control_packet is not None:
-            self.rx = bytes()
         if control_packet is not None:
+            self.rssi = control_packet.rssi
+            self.frame_losses = control_packet.frame_losses
             self.control_callback(control_packet.pwm_channel_data)
         if telemetry_packet is not None:
             self.telemetry_callback(telemetry_packet)
 
-        # Throw away any remaining bytes after 100us of inactivity
-        if time.ticks_us() - self.lastt > 100:
-            self.rx = bytes()
+        # Throw away any partial packet after a period of inactivity
+        if framer.pending > 0 and time.ticks_diff(time.ticks_us(), self.lastt) > self.IDLE_RESET_US:
+            framer.reset()
+            self.idle_resets += 1
+
+        # Try the other baud rate while nothing valid arrives.  Once the
+        # signal is lost, wait at the default rate, which a master that comes
+        # back starts at.
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.last_packet) > self.BAUD_TIMEOUT_MS:
+            if self.baudrate == self.BAUD_DEFAULT and self.allow_high_baud and self.has_signal():
+                self.set_baudrate(self.BAUD_HIGH)
+            else:
+                self.set_baudrate(self.BAUD_DEFAULT)
+
+        self.update_rates(now)
@@ -0,0 +1,112 @@
+from sim.clock import VirtualClock
+from sim.replay import ReplayUART
+from sim.srxl2bus import SRXL2Master
+import srxl2
+from srxl2 import SRXL2Control, SRXL2Telemetry
+from srxl2driver import SRXL2Driver
+
+
+def run(master_args = {}, driver_args = {}, ms = 200):
+    with VirtualClock() as clock:
+        master = SRXL2Master(clock, **master_args)
+        received = []
+        driver = SRXL2Driver(0, lambda data: received.append(data.as_dict()), None, **driver_args)
+        driver.open_uart = master.connect
+        driver.start()
+        for i in range(ms * 10):
+            clock.advance(100)
+            driver.process()
+        return (master, driver, received)
+
+def test_high_baud():
+    (master, driver, received) = run()
+    assert master.baudrate == 400000
+    assert driver.baudrate == 400000
+    assert len(received) == master.frames_sent > 10
+    assert received[-1] == {1: 1500, 4: 1500}
+
+def test_master_default_baud():
+    (master, driver, received) = run({"high_baud": False})
+    assert driver.baudrate == master.baudrate == 115200
+    assert len(received) == master.frames_sent > 10
+    assert driver.baud_switches == 0
+
+def test_handshake_reply():
+    # Controller replies to the master, and doesn't support 400000
+    (master, driver, received) = run({"device_ids": (0x40, 0x60)}, {"device_id": 0x60, "allow_high_baud": False})
+    assert master.replies == {0x40: 1, 0x60: 0}
+    assert driver.baudrate == master.baudrate == 115200
+    assert len(received) == master.frames_sent > 10
+
+    (master, driver, received) = run({"device_ids": (0x40, 0x60)}, {"device_id": 0x60})
+    assert master.replies == {0x40: 1, 0x60: 1}
+    assert driver.baudrate == master.baudrate == 400000
+
+def test_missed_handshake():
+    with VirtualClock() as clock:
+        master = SRXL2Master(clock)
+        received = []
+        driver = SRXL2Driver(0, lambda data: received.append(data), None)
+        driver.open_uart = master.connect
+        driver.start()
+        # Bus has moved to 400000 before the driver starts listening
+        clock.advance(50000)
+        master.step()
+        del master.port.rx[:]
+        for i in range(10000):
+            clock.advance(100)
+            driver.process()
+        assert driver.baudrate == 400000
+        n = len(received)
+        assert n > 0
+
+        # Master restarts after losing a device, and a new device doesn't
+        # support 400000
+        master.high_baud = False
+        master.restart()
+        for i in range(10000):
+            clock.advance(100)
+            driver.process()
+        assert driver.baudrate == 115200
+        assert len(received) > n + 10
+
+def test_batch_kept_from_later_packets():
+    with VirtualClock() as clock:
+        port = ReplayUART()
+        received = []
+        telemetry = []
+        driver = SRXL2Driver(0, lambda data: received.append(data.as_dict()),
+                lambda p: telemetry.append((p.device, p.rpm)))
+        driver.open_uart = lambda baudrate: port
+        driver.start()
+
+        # A control packet that fails to decode after a good one, and other
+        # telemetry after the ESC's, all read at once
+        bad = SRXL2Control.build({1: 0xFFFF}, rssi = 99)
+        bad[8] = 0b111
+        other = SRXL2Telemetry.build(SRXL2Telemetry.DEVICE_ESC, {})
+        other[4] = 0x7E
+        for p in (bad, other):
+            crc = srxl2.crc16(p, len(p) - 2)
+            p[-2:] = bytes((crc >> 8, crc & 0xFF))
+        port.push(SRXL2Control.build({1: 0x8000}, rssi = 50) + bad)
+        port.push(SRXL2Telemetry.build(SRXL2Telemetry.DEVICE_ESC, {"rpm": 5000}))
+        port.push(other)
+        driver.process()
+
+        assert driver.srxl2.invalid_packets == 1
+        assert received == [{1: 1500}]
+        assert driver.rssi == 50
+        assert telemetry == [(SRXL2Telemetry.DEVICE_ESC, 5000)]
+
+def test_no_receiver():
+    # Baud rates are tried until the signal is lost, then the default is kept
+    with VirtualClock() as clock:
+        driver = SRXL2Driver(0, None, None)
+        driver.open_uart = lambda baudrate: ReplayUART()
+        driver.start()
+        for i in range(10000):
+            clock.advance(1000)
+            driver.process()
+        assert not driver.has_signal()
+        assert driver.baud_switches == SRXL2Driver.SIGNAL_TIMEOUT_MS // SRXL2Driver.BAUD_TIMEOUT_MS
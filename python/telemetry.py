@@ -1,4 +1,4 @@
-from animation import SimpleAnimation
+from animation import SimpleAnimation, cached
 from button import ButtonEvent
 import time
 
@@ -31,10 +31,14 @@ class Telemetry:
                     self.do_number_animation(self.vehicle.ext_temperature, callback = self.done)
         return True
 
-    def done(self, animation, now):
-        self.vehicle.in_telemetry = False
+    def done(self, light, now):
+        # Every light calls this as it finishes the last number, so any one
+        # that isn't held by a higher priority animation ends telemetry.
+        # Lights still finishing after telemetry is restarted are ignored.
+        if self.position == 3:
+            self.vehicle.in_telemetry = False
 
-    def number_animation(self, voltage):
+    def number_animation(voltage):
         values = list((voltage // div) % 10 for div in (100, 10 ,1))
         a = []
         non_zero = False
@@ -50,10 +54,11 @@ class Telemetry:
         return SimpleAnimation.join(*a)
 
     def do_number_animation(self, value, callback = None):
-        anim = self.number_animation(value)
+        # Each light plays the same animation from its own playhead
+        anim = cached(Telemetry.number_animation, value)
         now = time.ticks_ms()
-        for i, l in enumerate(self.vehicle.lights + [self.vehicle.status_led]):
-            l.animate(anim, now = now, callback = callback if i == 0 else None)
+        for l in self.vehicle.all_lights:
+            l.animate(anim, now = now, callback = callback)
 
     def start(self):
         for l in self.vehicle.lights:
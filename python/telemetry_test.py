@@ -0,0 +1,43 @@
+import sim
+sim.install()
+
+from button import ButtonEvent
+from config import LightConfig
+from light import Light
+from sim.clock import VirtualClock
+from telemetry import Telemetry
+
+
+class Vehicle:
+
+    def __init__(self):
+        self.lights = [Light(LightConfig(10, 20, 80)) for i in range(2)]
+        self.status_led = Light(LightConfig(11, 0, 100), no_pwm = True)
+        self.all_lights = self.lights + [self.status_led]
+        self.voltage = None
+        self.cells = None
+        self.esc_temperature = None
+        self.ext_temperature = 42
+        self.in_telemetry = True
+
+def test_done_by_any_light():
+    with VirtualClock() as clock:
+        vehicle = Vehicle()
+        telemetry = Telemetry(vehicle)
+        telemetry.start()
+        for i in range(3):
+            assert telemetry.click(ButtonEvent.SHORT_CLICK)
+        # The first light is held by a higher priority animation
+        held = vehicle.all_lights[0]
+        held.animate(Telemetry.number_animation(1), priority = 5)
+        clock.advance(60000000)
+        vehicle.all_lights[1].tick()
+        assert not vehicle.in_telemetry
+
+        # Restarted before the held light finishes
+        vehicle.in_telemetry = True
+        telemetry.start()
+        held.animate(None, priority = 5)
+        held.tick()
+        assert held.animation is None
+        assert vehicle.in_telemetry
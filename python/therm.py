@@ -0,0 +1,119 @@
+try:
+    from machine import ADC, Pin
+except ImportError:
+    from machine_mock import ADC, Pin
+from array import array
+import math
+import time
+from config import config
+
+# External temperature probe: an NTC thermistor from the ADC input to ground,
+# with a pull-up resistor to 3.3V.
+#
+# update() takes a sample every SAMPLE_PERIOD_MS, each the average of
+# OVERSAMPLE ADC reads (both can be changed by init()), and converts it to
+# temperature through a lookup table built once by init().  The result is
+# smoothed, and published as value, in degrees C, or None if no probe is
+# fitted.
+
+R_PULLUP = 10000
+R_NOMINAL = 10000
+T_NOMINAL = 25
+BETA = 3950
+
+SAMPLE_PERIOD_MS = 100
+OVERSAMPLE = 16
+
+# Exponential filter over samples, with weight 1/(1 << FILTER_SHIFT)
+FILTER_SHIFT = 2
+
+# Lookup table entries are spaced 1 << LUT_SHIFT apart over the 16 bit ADC
+# range, and hold tenths of a degree.
+LUT_SHIFT = 10
+LUT_SIZE = (1 << (16 - LUT_SHIFT)) + 1
+
+# Readings outside this range mean the probe is disconnected or shorted
+MIN_READING = 0x0400
+MAX_READING = 0xFC00
+
+adc = None
+sample_period = SAMPLE_PERIOD_MS
+oversample = OVERSAMPLE
+lut = None
+next_sample = None
+# Filtered reading, scaled up by 1 << FILTER_SHIFT
+filtered = None
+value = None
+samples = 0
+
+def reading_temperature(reading):
+    # Steinhart-Hart (beta form) for an ADC reading, in degrees C
+    r = R_PULLUP * reading / (0x10000 - reading)
+    t = 1 / (1 / (T_NOMINAL + 273.15) + math.log(r / R_NOMINAL) / BETA)
+    return t - 273.15
+
+def build_lut():
+    table = array('h', (0 for i in range(LUT_SIZE)))
+    for i in range(LUT_SIZE):
+        # Clamp the ends, where the resistance is zero or infinite
+        reading = min(max(i << LUT_SHIFT, 1), 0xFFFF)
+        t = reading_temperature(reading)
+        table[i] = int(max(-999, min(t, 999)) * 10)
+    return table
+
+def lookup(reading):
+    # Temperature in tenths of a degree, interpolated from the table
+    i = reading >> LUT_SHIFT
+    a = lut[i]
+    b = lut[i + 1]
+    return a + ((b - a) * (reading & ((1 << LUT_SHIFT) - 1)) >> LUT_SHIFT)
+
+def init(period_ms = SAMPLE_PERIOD_MS, reads = OVERSAMPLE):
+    global adc, sample_period, oversample, lut, next_sample, filtered, value, samples
+    sample_period = period_ms
+    oversample = reads
+    if config.therm_pin is None:
+        adc = None
+    else:
+        adc = ADC(Pin(config.therm_pin))
+    if lut is None:
+        lut = build_lut()
+    next_sample = time.ticks_ms()
+    filtered = None
+    value = None
+    samples = 0
+
+def sample():
+    # Average of several reads
+    total = 0
+    for i in range(oversample):
+        total += adc.read_u16()
+    return total // oversample
+
+def update():
+    # Takes a sample if one is due.  Cheap to call more often.
+    global next_sample, filtered, value, samples
+    if adc is None:
+        return
+    now = time.ticks_ms()
+    if time.ticks_diff(now, next_sample) < 0:
+        return
+    next_sample = time.ticks_add(next_sample, sample_period)
+    if time.ticks_diff(now, next_sample) >= 0:
+        # Fallen behind, so don't try to catch up
+        next_sample = time.ticks_add(now, sample_period)
+
+    reading = sample()
+    samples += 1
+    if reading < MIN_READING or reading > MAX_READING:
+        filtered = None
+        value = None
+        return
+    if filtered is None:
+        filtered = reading << FILTER_SHIFT
+    else:
+        filtered += reading - (filtered >> FILTER_SHIFT)
+    value = (lookup(filtered >> FILTER_SHIFT) + 5) // 10
+
+def get_value():
+    return value
@@ -0,0 +1,75 @@
+import sim
+sim.install()
+
+from machine_mock import ADC
+from sim.clock import VirtualClock
+from config import config
+import therm
+
+
+def reading_for(t):
+    # ADC reading for a temperature in degrees C
+    import math
+    r = therm.R_NOMINAL * math.exp(therm.BETA * (1 / (t + 273.15) - 1 / (therm.T_NOMINAL + 273.15)))
+    return int(0x10000 * r / (r + therm.R_PULLUP))
+
+def test_lookup():
+    therm.lut = therm.build_lut()
+    for t in (-20, 0, 25, 60, 100, 120):
+        reading = reading_for(t)
+        assert abs(therm.lookup(reading) - therm.reading_temperature(reading) * 10) <= 10
+        assert abs(therm.lookup(reading) - t * 10) <= 10
+
+def test_sampling():
+    with VirtualClock() as clock:
+        try:
+            ADC.values[config.therm_pin] = reading_for(40)
+            therm.init()
+            therm.update()
+            assert therm.value == 40
+            assert therm.samples == 1
+
+            # Further calls before the next sample is due do nothing
+            clock.advance(therm.SAMPLE_PERIOD_MS * 500)
+            therm.update()
+            assert therm.samples == 1
+
+            # The value follows changes gradually
+            ADC.values[config.therm_pin] = reading_for(80)
+            clock.advance(therm.SAMPLE_PERIOD_MS * 500)
+            therm.update()
+            assert 40 < therm.value < 80
+            for i in range(50):
+                clock.advance(therm.SAMPLE_PERIOD_MS * 1000)
+                therm.update()
+            assert therm.value == 80
+            assert therm.get_value() == 80
+
+            # Probe unplugged
+            ADC.values[config.therm_pin] = 0xFFFF
+            clock.advance(therm.SAMPLE_PERIOD_MS * 1000)
+            therm.update()
+            assert therm.value is None
+        finally:
+            del ADC.values[config.therm_pin]
+
+def test_therm_benchmark():
+    import benchmark
+
+    with VirtualClock() as clock:
+        try:
+            ADC.values[config.therm_pin] = reading_for(40)
+            therm.init()
+            def update():
+                clock.advance(therm.SAMPLE_PERIOD_MS * 1000)
+                therm.update()
+            (us, allocated) = benchmark.measure(update, 2000)
+            benchmark.report("Thermistor sample", us, allocated, "sample")
+            (us, allocated) = benchmark.measure(lambda: therm.reading_temperature(0x8000), 2000)
+            benchmark.report("Thermistor Steinhart-Hart", us, allocated, "sample")
+            (us, allocated) = benchmark.measure(lambda: therm.lookup(0x8000), 2000)
+            benchmark.report("Thermistor lookup", us, allocated, "sample")
+            (us, allocated) = benchmark.measure(therm.update, 2000)
+            benchmark.report("Thermistor update, not due", us, allocated)
+        finally:
+            del ADC.values[config.therm_pin]
@@ -0,0 +1,182 @@
+import _thread
+import time
+from channelframe import ChannelFrame
+from srxl2 import SRXL2Telemetry
+
+# Sequence numbers wrap, so they stay small ints on MicroPython
+SEQ_MASK = 0x3FFFFFFF
+
+
+# A pair of buffers passed from one writer thread to one reader thread
+# without locks.  The writer fills one buffer while the reader copies the
+# other.  A read is torn only if the writer has started two writes since the
+# reader picked its buffer, so end_read() checks for that and the reader then
+# tries again.
+class DoubleBuffer:
+
+    def __init__(self, a, b):
+        self.buffers = (a, b)
+        # Sequence number of the last write started, and the last completed
+        self.started = 0
+        self.seq = 0
+
+    def begin_write(self):
+        self.started = (self.seq + 1) & SEQ_MASK
+        return self.buffers[self.started & 1]
+
+    def end_write(self):
+        self.seq = self.started
+
+    def begin_read(self):
+        # Returns (seq, buffer) for the latest complete write
+        seq = self.seq
+        return (seq, self.buffers[seq & 1])
+
+    def end_read(self, seq):
+        # True if the buffer from begin_read(seq) wasn't written while read
+        return (self.started - seq) & SEQ_MASK < 2
+
+
+# The input thread on the second core.  The RP2040 can only start a thread
+# there once the last one has completely exited, so rather than a thread per
+# driver, one is started the first time it's needed and polls whichever
+# driver is attached.  Drivers are swapped under a lock, which is held for
+# each pass, so once detach() returns the driver is no longer being polled.
+class Core1:
+
+    # Pause between passes, and between checks when no driver is attached
+    IDLE_US = 50
+    DETACHED_MS = 1
+
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.driver = None
+        self.started = False
+
+    def run_once(self):
+        # Polls the attached driver.  Returns False if there isn't one.
+        with self.lock:
+            driver = self.driver
+            if driver is None:
+                return False
+            driver.poll()
+        return True
+
+    def run(self):
+        while True:
+            if self.run_once():
+                time.sleep_us(self.IDLE_US)
+            else:
+                time.sleep_ms(self.DETACHED_MS)
+
+    def attach(self, driver):
+        with self.lock:
+            self.driver = driver
+        if not self.started:
+            self.started = True
+            _thread.start_new_thread(self.run, ())
+
+    def detach(self, driver):
+        with self.lock:
+            if self.driver is driver:
+                self.driver = None
+
+core1 = Core1()
+
+
+# Runs an input driver on the second core.  The driver's callbacks publish
+# the latest channel frame and telemetry packet into double buffers, and
+# process(), called on the first core, passes them on to the real callbacks.
+# Frames that arrive faster than process() is called are dropped, so only
+# the latest is delivered.
+class ThreadedDriver:
+
+    def __init__(self, driver, control_callback, telemetry_callback = None):
+        self.driver = driver
+        self.control_callback = control_callback
+        self.telemetry_callback = telemetry_callback
+        driver.control_callback = self.publish_control
+        if hasattr(driver, "telemetry_callback"):
+            driver.telemetry_callback = self.publish_telemetry
+        self.CAPTURE_KIND = driver.CAPTURE_KIND
+
+        self.frames = DoubleBuffer(ChannelFrame(), ChannelFrame())
+        self.frame = ChannelFrame()
+        self.frame_seq = 0
+        self.telemetry = DoubleBuffer(SRXL2Telemetry(), SRXL2Telemetry())
+        self.packet = SRXL2Telemetry()
+        self.telemetry_seq = 0
+
+        self.reset_thread_stats()
+
+    def reset_thread_stats(self):
+        # Frames overwritten before process() was called
+        self.skipped_frames = 0
+        # Reads retried because the buffer was written during the read
+        self.read_retries = 0
+
+    @property
+    def capture(self):
+        return self.driver.capture
+
+    @capture.setter
+    def capture(self, capture):
+        self.driver.capture = capture
+
+    # Input thread
+
+    def publish_control(self, frame):
+        self.frames.begin_write().copy(frame)
+        self.frames.end_write()
+
+    def publish_telemetry(self, packet):
+        self.telemetry.begin_write().copy(packet)
+        self.telemetry.end_write()
+
+    def poll(self):
+        self.driver.process()
+
+    def start(self):
+        self.driver.start()
+        core1.attach(self)
+
+    def stop(self):
+        core1.detach(self)
+        self.driver.stop()
+
+    # Main thread
+
+    def read(self, buffer, into):
+        while True:
+            (seq, src) = buffer.begin_read()
+            into.copy(src)
+            if buffer.end_read(seq):
+                return seq
+            self.read_retries += 1
+
+    def pending(self):
+        return self.frames.seq != self.frame_seq or self.telemetry.seq != self.telemetry_seq
+
+    def process(self):
+        if self.frames.seq != self.frame_seq:
+            seq = self.read(self.frames, self.frame)
+            self.skipped_frames += ((seq - self.frame_seq) & SEQ_MASK) - 1
+            self.frame_seq = seq
+            self.control_callback(self.frame)
+        if self.telemetry.seq != self.telemetry_seq:
+            self.telemetry_seq = self.read(self.telemetry, self.packet)
+            if self.telemetry_callback is not None:
+                self.telemetry_callback(self.packet)
+
+    def has_signal(self):
+        return self.driver.has_signal()
+
+    def stats(self):
+        s = self.driver.stats()
+        s["skipped_frames"] = self.skipped_frames
+        s["read_retries"] = self.read_retries
+        return s
+
+    def reset_stats(self):
+        self.driver.reset_stats()
+        self.reset_thread_stats()
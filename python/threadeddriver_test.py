@@ -0,0 +1,181 @@
+import sim
+sim.install()
+
+import sys
+import threading
+import time
+
+from channelframe import ChannelFrame
+from sim.clock import VirtualClock
+import threadeddriver
+from threadeddriver import Core1, DoubleBuffer, ThreadedDriver
+from pwm import PWMRCDriver
+from srxl2driver import SRXL2Driver
+from srxl2_test import add_crc, control_frame
+from sim.replay import ReplayUART
+
+
+CHANNELS = tuple(range(1, 17))
+MASK = (1 << len(CHANNELS)) - 1
+
+def test_double_buffer():
+    b = DoubleBuffer([0], [0])
+    (seq, buf) = b.begin_read()
+    assert seq == 0
+
+    # One write during a read goes to the other buffer
+    b.begin_write()[0] = 1
+    b.end_write()
+    assert b.end_read(seq)
+
+    # A second write reuses the buffer being read
+    (seq, buf) = b.begin_read()
+    assert buf == [1]
+    b.begin_write()[0] = 2
+    b.end_write()
+    b.begin_write()
+    assert not b.end_read(seq)
+
+def test_torn_reads():
+    # Writer publishes frames with every channel set to the same value.  The
+    # reader must never see a frame with mixed values.
+    frames = DoubleBuffer(ChannelFrame(), ChannelFrame())
+    stop = []
+    written = [0]
+
+    def writer():
+        src = ChannelFrame()
+        n = 0
+        while not stop:
+            n = (n + 1) & 0xFFFF
+            for ch in CHANNELS:
+                src.values[ch] = n
+            src.set_channels(MASK, CHANNELS)
+            frames.begin_write().copy(src)
+            frames.end_write()
+            written[0] += 1
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    t = threading.Thread(target = writer)
+    t.start()
+    try:
+        frame = ChannelFrame()
+        reads = 0
+        retries = 0
+        end = time.perf_counter() + 0.5
+        while time.perf_counter() < end:
+            (seq, buf) = frames.begin_read()
+            frame.copy(buf)
+            if not frames.end_read(seq):
+                retries += 1
+                continue
+            reads += 1
+            if frame.channels:
+                values = set(frame.values[ch] for ch in CHANNELS)
+                assert len(values) == 1, values
+    finally:
+        stop.append(True)
+        t.join()
+        sys.setswitchinterval(interval)
+    assert reads > 100
+    assert written[0] > 100
+    print("%d reads, %d retried, %d writes" % (reads, retries, written[0]))
+
+def test_threaded_pwm():
+    with VirtualClock() as clock:
+        frames = []
+        driver = ThreadedDriver(PWMRCDriver((1, 2), None, filter_depth = 1), lambda f: frames.append(f.as_dict()))
+        # Run the input thread's side by hand
+        driver.driver.start()
+        sms = driver.driver.sms
+        sms[0].push_rx(0xFFFFFFFF - 1500 // 3)
+        driver.poll()
+        assert driver.pending()
+        driver.process()
+        assert frames == [{1: 1500}]
+        assert not driver.pending()
+
+        # Only the latest frame is delivered
+        for width in (1200, 1300, 1401):
+            sms[1].push_rx(0xFFFFFFFF - width // 3)
+            driver.poll()
+        driver.process()
+        assert frames[-1] == {2: 1401}
+        assert driver.stats()["skipped_frames"] == 2
+
+def test_threaded_srxl2():
+    import srxl2
+
+    with VirtualClock() as clock:
+        frames = []
+        telemetry = []
+        inner = SRXL2Driver(1, None, None)
+        uart = ReplayUART()
+        inner.open_uart = lambda baudrate: uart
+        driver = ThreadedDriver(inner, lambda f: frames.append(f.as_dict()), lambda p: telemetry.append(p.rpm))
+        inner.start()
+
+        uart.push(control_frame({1: 0x8000, 4: 0xFFFF}))
+        driver.poll()
+        driver.process()
+        assert frames == [{1: 1500, 4: 2000}]
+
+        payload = bytes((0xA6, 0x80, 22, 0, srxl2.SRXL2Telemetry.DEVICE_ESC, 0, 0x01, 0x00)) + bytes(12)
+        uart.push(add_crc(bytearray(payload)))
+        driver.poll()
+        driver.process()
+        assert telemetry == [2560]
+
+class Inner:
+
+    # A driver counting the times it's polled
+
+    CAPTURE_KIND = None
+
+    def __init__(self):
+        self.polls = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def process(self):
+        assert self.running
+        self.polls += 1
+
+def test_one_input_thread():
+    # Switching drivers reuses the thread, as core 1 can't start another
+    # until the first has exited
+    threads = []
+    saved = (threadeddriver.core1, threadeddriver._thread.start_new_thread)
+    threadeddriver.core1 = Core1()
+    threadeddriver._thread.start_new_thread = lambda fn, args: threads.append(fn)
+    try:
+        core = threadeddriver.core1
+        first = ThreadedDriver(Inner(), None)
+        first.start()
+        assert core.run_once()
+        first.stop()
+        assert not core.run_once()
+
+        second = ThreadedDriver(Inner(), None)
+        second.start()
+        assert core.run_once()
+        assert (first.driver.polls, second.driver.polls) == (1, 1)
+        assert threads == [core.run]
+
+        # Stopping waits for a pass in progress
+        core.lock.acquire()
+        stopper = threading.Thread(target = second.stop)
+        stopper.start()
+        stopper.join(0.05)
+        assert stopper.is_alive() and second.driver.running
+        core.lock.release()
+        stopper.join()
+        assert not second.driver.running
+    finally:
+        (threadeddriver.core1, threadeddriver._thread.start_new_thread) = saved
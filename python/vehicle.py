@@ -4,11 +4,9 @@ except ImportError:
     from machine_mock import Pin, PWM
 from button import ButtonEvent, Button
 from channel import Channel, SteeringChannel
-import menu
-import telemetry
 import time
 from light import LightState, Light
-from animation import SimpleAnimation, BreatheAnimation, EmergencyFlash, FadedFlash
+from animation import SimpleAnimation, BreatheAnimation, EmergencyFlash, FadedFlash, cached
 from config import LightConfig, RCMode, config, BrakeMode, ButtonMode, EmergencyMode
 from laststate import LastState
 
@@ -33,8 +31,9 @@ class Vehicle:
         self.lights = [Light(c, channel = n) for (n, c) in enumerate(config.lights)]
         self.in_menu = False
         self.in_telemetry = False
-        self.menu = menu.Menu(self)
-        self.telemetry = telemetry.Telemetry(self)
+        # Built when first entered, see the menu and telemetry properties
+        self._menu = None
+        self._telemetry = None
         self.config = config
         self.voltage = None
         self.low_voltage = None
@@ -43,6 +42,7 @@ class Vehicle:
         self.esc_braking = False
         self.quick_brake = None
         self.status_led = Light(LightConfig(config.status_led_pins, 0, 100, menu = 100), no_pwm = True)
+        self.all_lights = self.lights + [self.status_led]
 
         self.throttle = Channel()
         self.steering = SteeringChannel()
@@ -64,6 +64,23 @@ class Vehicle:
         self.ext_over_temp = False
         self.ext_temperature = None
 
+    # The menu has many items, so it and telemetry are only imported and
+    # built when needed rather than at boot.
+
+    @property
+    def menu(self):
+        if self._menu is None:
+            import menu
+            self._menu = menu.Menu(self)
+        return self._menu
+
+    @property
+    def telemetry(self):
+        if self._telemetry is None:
+            import telemetry
+            self._telemetry = telemetry.Telemetry(self)
+        return self._telemetry
+
     def primary_click(self, event, count = None):
         if self.in_menu:
             self.in_menu = self.menu.click(event)
@@ -88,7 +105,7 @@ class Vehicle:
                 # animations.
                 for l in self.all_lights:
                     l.set_level(0)
-                    l.animate(SimpleAnimation.multi_flash(1))
+                    l.animate(cached(SimpleAnimation.multi_flash, 1))
             elif event == ButtonEvent.EXTRA_LONG_CLICK:
                 if count == 1:
                     self.telemetry.start()
@@ -150,7 +167,7 @@ class Vehicle:
             self.low_voltage = voltage
 
         self.esc_temperature = temperature
-        self.update_over_temp(temperature - config.esc_temperature_alarm)
+        self.update_over_temp()
 
     def update_over_temp(self):
         if self.esc_temperature is not None:
@@ -166,7 +183,7 @@ class Vehicle:
         if esc_over > 1 and not self.esc_over_temp and config.esc_temperature_alarm_enable:
             self.esc_over_temp = True
             for l in self.lights:
-                l.animate(SimpleAnimation.multi_flash(3,500,100,100), now =now, loop = True, priority=AnimationPriority.ESC_TEMP_ALARM)
+                l.animate(cached(SimpleAnimation.multi_flash, 3, 500, 100, 100), now =now, loop = True, priority=AnimationPriority.ESC_TEMP_ALARM)
         elif esc_over <= 0 and self.esc_over_temp:
             self.esc_over_temp = False
             for l in self.lights:
@@ -175,10 +192,10 @@ class Vehicle:
         if ext_over > 1 and not self.ext_over_temp and config.ext_temperature_alarm_enable:
             self.ext_over_temp = True
             for l in self.lights:
-                l.animate(SimpleAnimation.multi_flash(2,500,100,100), now =now, loop = True, priority=AnimationPriority.EXT_TEMP_ALARM)
-        elif ext_over <= 0:
+                l.animate(cached(SimpleAnimation.multi_flash, 2, 500, 100, 100), now =now, loop = True, priority=AnimationPriority.EXT_TEMP_ALARM)
+        elif ext_over <= 0 and self.ext_over_temp:
             self.ext_over_temp = False
-            for l in self.lights + [self.status_led]:
+            for l in self.all_lights:
                 l.animate(None, priority = AnimationPriority.EXT_TEMP_ALARM)
 
     def update_brake(self, reconfig = False):
@@ -228,7 +245,7 @@ class Vehicle:
             if self.turning != Turn.RIGHT:
                 for l in self.lights:
                     if l.config.turn_right > 0:
-                        l.animate(FadedFlash(l.config.turn_right, 0, 1000), now = now, loop = True)
+                        l.animate(cached(FadedFlash, l.config.turn_right, 0, 1000, config.fade_time), now = now, loop = True)
                         self.turning = Turn.RIGHT
                     else: 
                         l.animate(None)
@@ -236,7 +253,7 @@ class Vehicle:
             if self.turning != Turn.LEFT:
                 for l in self.lights:
                     if l.config.turn_left > 0:
-                        l.animate(FadedFlash(l.config.turn_left, 0, 1000), now = now, loop = True)
+                        l.animate(cached(FadedFlash, l.config.turn_left, 0, 1000, config.fade_time), now = now, loop = True)
                         self.turning = Turn.LEFT
                     else: 
                         l.animate(None)
@@ -263,7 +280,8 @@ class Vehicle:
         if not self.emergency or reconfig:
             for l in self.lights:
                 if l.config.emergency1 > 0 or l.config.emergency2 > 0:
-                    l.animate(EmergencyFlash(l.config.emergency1, l.config.emergency2, config.emergency_flash_period, config.emergency_flashes_per_side, bool(self.config.emergency_fade)), priority = AnimationPriority.EMERGENCY)
+                    flash = cached(EmergencyFlash, l.config.emergency1, l.config.emergency2, config.emergency_flash_period, config.emergency_flashes_per_side, bool(self.config.emergency_fade), config.fade_time)
+                    l.animate(flash, priority = AnimationPriority.EMERGENCY)
                 else:
                     l.animate(None, priority = AnimationPriority.EMERGENCY)
             self.emergency = True
@@ -296,7 +314,7 @@ class Vehicle:
             self.sleeping = True
             for l in self.lights:
                 if l.config.breathe > 0:
-                    l.animate(BreatheAnimation(config.breathe_time, config.breathe_gap, brightness = l.config.breathe, off_brightness = (l.config.breathe * config.breathe_min_brightness) // 100), now = now, loop = True)
+                    l.animate(cached(BreatheAnimation, config.breathe_time, config.breathe_gap, l.config.breathe, (l.config.breathe * config.breathe_min_brightness) // 100), now = now, loop = True)
                 else:
                     l.set_level(0)
                     l.animate(None)
@@ -323,8 +341,11 @@ class Vehicle:
         flash = self.lights_flash or (config.secondary_button_mode == ButtonMode.FLASH and self.secondary_button.is_pressed)
         handbrake = config.secondary_button_mode == ButtonMode.BRAKE and self.secondary_button.is_pressed
         for light in self.lights:
-            if self.in_menu or self.in_telemetry or self.sleeping or self.startup:
+            if self.in_menu or self.in_telemetry or self.sleeping:
                 light.tick(now)
+            elif self.startup:
+                # Show the last state while the receiver is found
+                light.update(now, self.light_state, False, False, False)
             else:
                 light.update(now, self.light_state, self.brakes_on or handbrake, flash, self.emergency)
 
@@ -334,7 +355,7 @@ class Vehicle:
         now = time.ticks_ms()
         for (i, l) in enumerate(self.lights):
             b = 75 if i == n else 0
-            l.animate(SimpleAnimation.multi_flash(3, 0, 750, 750, brightness = b), priority = 3, now = now)
+            l.animate(cached(SimpleAnimation.multi_flash, 3, 0, 750, 750, False, b), priority = 3, now = now)
 
     def light_on(self, n, val):
         now = time.ticks_ms()
@@ -342,8 +363,3 @@ class Vehicle:
 
     def light_off(self, n):
         self.lights[n].animate(None, priority = 3)
-
-    @property
-    def all_lights(self):
-        return self.lights + [self.status_led]
-